@@ -17,7 +17,8 @@ class ProductSerializer(serializers.ModelSerializer):
     )
     class Meta:
         model = Product
-        fields = ["id", "title", "brand", "image", "category", "price", "created_at", "updated_at"]
+        fields = ["id", "title", "brand", "image", "category", "price",
+                  "rating_avg", "rating_count", "created_at", "updated_at"]
 
 class ReviewSerializer(serializers.ModelSerializer):
     class Meta:
@@ -39,7 +40,8 @@ class ProductDetailSerializer(serializers.ModelSerializer):
     class Meta:
         model = Product
         fields = ["id", "title", "slug", "brand", "category", "price",
-                  "image", "available", "discount", "created_at", "updated_at", "discounted_price", "reviews"]
+                  "image", "available", "discount", "rating_avg", "rating_count",
+                  "created_at", "updated_at", "discounted_price", "reviews"]
 
     def get_discounted_price(self, obj):
         discounted_price = obj.get_discounted_price()
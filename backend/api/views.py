@@ -1,11 +1,15 @@
+from decimal import Decimal, InvalidOperation
+
 from django.contrib.auth import get_user_model
 from django.shortcuts import get_object_or_404
 from rest_framework import generics, permissions, status
 from rest_framework.exceptions import ValidationError
+from rest_framework.filters import OrderingFilter
 from rest_framework.response import Response
 from rest_framework.views import APIView
 
 from recommend.models import Review
+from shop.facets import filter_products, get_facets
 from shop.models import Product
 
 from .pagination import StandardResultsSetPagination
@@ -18,7 +22,28 @@ class ProductListApiView(generics.ListAPIView):
     permission_classes = [IsAdminOrReadOnly]
     pagination_class = StandardResultsSetPagination
     serializer_class = ProductSerializer
-    queryset = Product.objects.select_related('category').order_by('id')
+    # Only available products, which are the ones the facets count.
+    queryset = Product.objects.filter(available=True).select_related('category').order_by('id')
+    filter_backends = [OrderingFilter]
+    ordering_fields = ['rating_avg', 'rating_count', 'price', 'created_at']
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        min_rating = self.request.query_params.get('min_rating')
+        if min_rating:
+            try:
+                queryset = queryset.filter(rating_avg__gte=Decimal(min_rating))
+            except InvalidOperation:
+                raise ValidationError({'min_rating': 'A number is required.'})
+        return filter_products(queryset, self.request.query_params)
+
+    def list(self, request, *args, **kwargs):
+        response = super().list(request, *args, **kwargs)
+        response.data['facets'] = {
+            facet.name: {option.value: option.count for option in facet.options}
+            for facet in get_facets(request.query_params)
+        }
+        return response
 
 
 class ProductDetailAPIView(generics.RetrieveAPIView):
@@ -1,3 +1,4 @@
+import sys
 from datetime import timedelta
 from pathlib import Path
 
@@ -24,6 +25,7 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
 
     #third party libraries
     'mathfilters',
@@ -105,6 +107,19 @@ DATABASES = {
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 
+#Cache
+CACHES = {
+    'default': env.cache('CACHE_URL', default='redis://localhost:6379/1'),
+}
+
+# Tests run against a process-local cache, so they neither need Redis nor
+# see the entries of the development server or of another test run.
+if 'test' in sys.argv:
+    CACHES = {
+        'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+    }
+
+
 AUTH_PASSWORD_VALIDATORS = [
     {
         'NAME': 'django.contrib.auth.password_validation.UserAttributeSimilarityValidator',
@@ -146,6 +161,19 @@ MESSAGE_TAGS = {
         messages.ERROR: 'alert-danger',
  }
 
+#Shop
+SHOP_SEARCH_BACKEND = 'shop.search.PostgresSearchBackend'
+SHOP_SEARCH_CONFIG = 'russian'
+SHOP_SEARCH_PAGE_SIZE = 15
+SHOP_THUMBNAIL_SIZES = ['400x400']
+SHOP_PRICE_RANGES = [(0, 50), (50, 100), (100, 250), (250, 500), (500, None)]
+SHOP_FACET_BRAND_LIMIT = 20
+
+#Cart
+CART_STORAGE = env('CART_STORAGE', default='cart.storage.SessionCartStorage')
+CART_REDIS_URL = env('CART_REDIS_URL', default='redis://localhost:6379/2')
+CART_REDIS_TIMEOUT = 60 * 60 * 24 * 30
+
 #Crispy Forms
 CRISPY_ALLOWED_TEMPLATE_PACKS = "bootstrap5"
 CRISPY_TEMPLATE_PACK = "bootstrap5"
@@ -206,6 +234,25 @@ STRIPE_WEBHOOK_SECRET = env('STRIPE_WEBHOOK_SECRET')
 YOOKASSA_SECRET_KEY = env('YOOKASSA_SECRET_KEY')
 YOOKASSA_SHOP_ID = env('YOOKASSA_SHOP_ID')
 
+#Payment
+# Stripe Checkout sessions, which expire with the reservation, last at least 30 minutes.
+PAYMENT_RESERVATION_TIMEOUT = timedelta(minutes=35)
+PAYMENT_GATEWAYS = {
+    'stripe': 'payment.gateways.StripeGateway',
+    'yookassa': 'payment.gateways.YooKassaGateway',
+}
+PAYMENT_STRIPE_API_BASE = env('PAYMENT_STRIPE_API_BASE', default='https://api.stripe.com')
+PAYMENT_YOOKASSA_API_BASE = env('PAYMENT_YOOKASSA_API_BASE', default='https://api.yookassa.ru/v3')
+PAYMENT_HTTP_TIMEOUT = (3.05, 10)  # connect, read
+PAYMENT_HTTP_RETRIES = 2
+PAYMENT_HTTP_BACKOFF = 0.5
+PAYMENT_HTTP_POOL_SIZE = 10
+PAYMENT_ASYNC = env.bool('PAYMENT_ASYNC', default=False)
+PAYMENT_YOOKASSA_VERIFY_IP = True
+# The number of proxies appending to X-Forwarded-For in front of Django: the
+# nginx service of docker-compose. Set it to 0 when Django is reached directly.
+PAYMENT_TRUSTED_PROXIES = env.int('PAYMENT_TRUSTED_PROXIES', default=1)
+
 
 GOOGLE_FONTS = ['Montserrat:wght@300,400', 'Roboto']
 GOOGLE_FONTS_DIR = BASE_DIR / 'static'
@@ -218,12 +265,24 @@ CELERY_RESULT_EXTENDED = True
 CELERY_BROKER_CONNECTION_RETRY_ON_STARTUP = True
 CELERY_BEAT_SCHEDULER = 'django_celery_beat.schedulers.DatabaseScheduler'
 
-# CELERY_BEAT_SCHEDULE = {
-#     "sample_task": {
-#         "task": "core.tasks.sample_task",
-#         "schedule": crontab(minute="*/1"),
-#     },
-# }
+CELERY_BEAT_SCHEDULE = {
+    "release_expired_reservations": {
+        "task": "payment.tasks.release_expired_reservations",
+        "schedule": timedelta(minutes=1),
+    },
+    "process_webhook_events": {
+        "task": "payment.tasks.process_webhook_events",
+        "schedule": timedelta(minutes=1),
+    },
+    "send_outbox_emails": {
+        "task": "payment.tasks.send_outbox_emails",
+        "schedule": timedelta(seconds=30),
+    },
+    "roll_up_sales": {
+        "task": "payment.tasks.roll_up_sales",
+        "schedule": timedelta(minutes=5),
+    },
+}
 
 
 # REST_FRAMEWORK
@@ -1,62 +1,188 @@
 from decimal import Decimal
+from typing import NamedTuple
+
+from django.core.cache import cache
+from django.utils.functional import cached_property
 
 from shop.models import ProductProxy
+from shop.prices import from_cents, get_prices, to_cents
+
+from .storage import get_cart_storage
+
+CART_COUNT_TIMEOUT = 60 * 60
+LINE_PRODUCT_FIELDS = ('id', 'title', 'slug', 'price', 'discount', 'image')
+
+
+class CartLine(NamedTuple):
+    """
+    An immutable line of the cart, with its totals computed once.
+
+    Attributes:
+        product (ProductProxy): The product, with only the displayed fields loaded.
+        qty (int): The quantity.
+        price (Decimal): The current unit price of the product.
+        total (Decimal): The price of the line.
+        list_total (Decimal): The price of the line before the discount.
+        added_price (Decimal): The unit price the product was added at.
+        price_changed (bool): Whether the price changed since it was added.
+    """
+    product: ProductProxy
+    qty: int
+    price: Decimal
+    total: Decimal
+    list_total: Decimal
+    added_price: Decimal
+    price_changed: bool
+
+
+def _count_key(session_key):
+    return f'cart:count:{session_key}'
+
+
+def get_item_count(request):
+    """
+    Returns the number of items in the visitor's cart for the navbar badge.
+
+    The count is cached by session key, so a page render neither loads the
+    session nor reads the cart storage, and a visitor without a session has
+    an empty cart by definition.
+
+    Args:
+        request: The HTTP request object.
+
+    Returns:
+        int: The number of items.
+    """
+    session_key = request.session.session_key
+    if session_key is None:
+        return 0
+    count = cache.get(_count_key(session_key))
+    if count is None:
+        cart = Cart(request)
+        cart._cache_count()
+        count = len(cart)
+    return count
 
 
 class Cart():
 
     def __init__(self, request) -> None:
 
-        self.session = request.session
+        self.request = request
 
-        cart = self.session.get('session_key')
+        self.storage = get_cart_storage(request)
 
-        if not cart:
-            cart = self.session['session_key'] = {}
-
-        self.cart = cart
+        self.cart = self.storage.items()
 
     
     def __len__(self):
-        return sum(item['qty'] for item in self.cart.values())
+        return sum(qty for qty, _ in self.cart.values())
 
     def __iter__(self):
-        product_ids = self.cart.keys()
-        products = ProductProxy.objects.filter(id__in=product_ids)
-        cart = self.cart.copy()
-
-
-        for product in products:
-            cart[str(product.id)]['product'] = product
-
-        for item in cart.values():
-            item['price'] = Decimal(item['price'])
-            item['total'] = item['price'] * item['qty']
-            yield item
+        return iter(self.lines)
+
+    @cached_property
+    def prices(self):
+        """
+        The current prices in cents of the products in the cart that can
+        still be bought, from the shop's price table.
+        """
+        return get_prices(self.cart.keys())
+
+    @cached_property
+    def lines(self):
+        """
+        Builds the lines at the current prices in one pass over a single
+        query, skipping products that are gone or no longer available.
+        """
+        prices = self.prices
+        products = ProductProxy.objects.only(*LINE_PRODUCT_FIELDS).in_bulk(prices.keys())
+        lines = []
+        for product_id, (qty, added_cents) in self.cart.items():
+            product = products.get(product_id)
+            if product is not None:
+                price_cents = prices[product_id]
+                lines.append(CartLine(product, qty, from_cents(price_cents),
+                                      from_cents(price_cents * qty), product.price * qty,
+                                      from_cents(added_cents), price_cents != added_cents))
+        return tuple(lines)
+
+    def _changed(self):
+        self.__dict__.pop('lines', None)
+        self.__dict__.pop('prices', None)
+        self._cache_count()
+
+    def _cache_count(self):
+        session_key = self.request.session.session_key
+        if session_key is not None:
+            cache.set(_count_key(session_key), len(self), CART_COUNT_TIMEOUT)
 
     def add(self, product, quantity):
 
-        product_id = str(product.id)
+        if product.id in self.cart:
+            self.update(product.id, quantity)
+            return
 
-        if product_id not in self.cart:
-            self.cart[product_id] = {'qty': quantity, 'price': str(product.get_discounted_price())}
-        
-        self.cart[product_id]['qty'] = quantity
-
-        self.session.modified = True
+        price_cents = to_cents(product.get_discounted_price())
+        self.storage.set(product.id, quantity, price_cents)
+        self.cart[product.id] = (quantity, price_cents)
+        self._changed()
 
     
     def delete(self, product):
-        product_id = str(product)
+        product_id = int(product)
         if product_id in self.cart:
+            self.storage.delete(product_id)
             del self.cart[product_id]
-            self.session.modified = True
+            self._changed()
 
     def update(self, product, quantity):
-        product_id = str(product)
-        if product_id in self.cart:
-            self.cart[product_id]['qty'] = quantity
-            self.session.modified = True
+        product_id = int(product)
+        if product_id in self.cart and self.storage.set_quantity(product_id, quantity):
+            self.cart[product_id] = (quantity, self.cart[product_id][1])
+            self._changed()
+
+    def apply(self, operations, products):
+        """
+        Applies a batch of operations in memory and stores the resulting
+        changes with a single write, so either all of them apply or none.
+
+        Operations follow the single-product views: adding a product already
+        in the cart sets its quantity, updating a product not in the cart
+        does nothing.
+
+        Args:
+            operations (list): (operation, product_id, quantity) tuples, the
+                operation being "add", "update" or "delete".
+            products (dict): The products being added, by id.
+        """
+        lines = dict(self.cart)
+        for operation, product_id, quantity in operations:
+            if operation == 'delete':
+                lines.pop(product_id, None)
+            elif product_id in lines:
+                lines[product_id] = (quantity, lines[product_id][1])
+            elif operation == 'add':
+                lines[product_id] = (quantity, to_cents(products[product_id].get_discounted_price()))
+
+        changed = {product_id: line for product_id, line in lines.items()
+                   if self.cart.get(product_id) != line}
+        deleted = [product_id for product_id in self.cart if product_id not in lines]
+        if changed or deleted:
+            self.storage.update_lines(changed, deleted)
+            self.cart = lines
+            self._changed()
+
+    def clear(self):
+        self.storage.clear()
+        self.cart = {}
+        self._changed()
 
     def get_total_price(self):
-        return sum(Decimal(item['price']) * item['qty'] for item in self.cart.values())
\ No newline at end of file
+        """
+        Returns the total at the current prices, leaving out the products
+        that can no longer be bought, without loading any product.
+        """
+        prices = self.prices
+        return from_cents(sum(qty * prices[product_id]
+                              for product_id, (qty, _) in self.cart.items() if product_id in prices))
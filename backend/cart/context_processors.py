@@ -1,5 +1,43 @@
-from .cart import Cart
+from django.utils.functional import cached_property
+
+from .cart import Cart, get_item_count
+
+
+class LazyCart:
+    """
+    The cart as seen by templates.
+
+    Nothing is loaded until a template uses it: the length comes from the
+    cached item count, and the session and storage are only read when the
+    lines or the total are rendered. Every value is computed once per request.
+    """
+
+    def __init__(self, request):
+        self._request = request
+
+    @cached_property
+    def _cart(self):
+        return Cart(self._request)
+
+    @cached_property
+    def count(self):
+        if '_cart' in self.__dict__:
+            return len(self._cart)
+        return get_item_count(self._request)
+
+    @cached_property
+    def total(self):
+        return self._cart.get_total_price()
+
+    def __len__(self):
+        return self.count
+
+    def __iter__(self):
+        return iter(self._cart)
+
+    def get_total_price(self):
+        return self.total
 
 
 def cart(request):
-    return {'cart': Cart(request)}
\ No newline at end of file
+    return {'cart': LazyCart(request)}
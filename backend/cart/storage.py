@@ -0,0 +1,211 @@
+import uuid
+from functools import lru_cache
+
+import redis
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+from shop.prices import from_cents, to_cents
+
+CART_SESSION_ID = 'session_key'
+CART_ID_SESSION_KEY = 'cart_id'
+
+
+class BaseCartStorage:
+    """
+    Stores the lines of one visitor's cart as product id -> (quantity, unit
+    price in cents), all integers.
+
+    Reading a cart never creates any state; only writes do.
+    """
+
+    def __init__(self, request):
+        self.request = request
+
+    def items(self):
+        """
+        Returns:
+            dict: (quantity, price in cents) by product id.
+        """
+        raise NotImplementedError
+
+    def set(self, product_id, quantity, price_cents):
+        """
+        Adds a line or replaces it.
+        """
+        raise NotImplementedError
+
+    def set_quantity(self, product_id, quantity):
+        """
+        Changes the quantity of an existing line, keeping its price.
+
+        Returns:
+            bool: Whether the line existed.
+        """
+        raise NotImplementedError
+
+    def delete(self, product_id):
+        raise NotImplementedError
+
+    def update_lines(self, lines, deleted):
+        """
+        Stores several changes at once.
+
+        Args:
+            lines (dict): The (quantity, price in cents) to set by product id.
+            deleted (list): The product ids of the lines to delete.
+        """
+        for product_id, (quantity, price_cents) in lines.items():
+            self.set(product_id, quantity, price_cents)
+        for product_id in deleted:
+            self.delete(product_id)
+
+    def clear(self):
+        raise NotImplementedError
+
+
+class SessionCartStorage(BaseCartStorage):
+    """
+    Keeps the cart in the Django session in the historical format,
+    {"<product id>": {"qty": <int>, "price": "<decimal>"}}, so carts of
+    existing sessions keep working.
+    """
+
+    @property
+    def _cart(self):
+        return self.request.session.get(CART_SESSION_ID, {})
+
+    def _save(self, cart):
+        self.request.session[CART_SESSION_ID] = cart
+        self.request.session.modified = True
+
+    def items(self):
+        return {
+            int(product_id): (line['qty'], to_cents(line['price']))
+            for product_id, line in self._cart.items()
+        }
+
+    def set(self, product_id, quantity, price_cents):
+        cart = self._cart
+        cart[str(product_id)] = {'qty': quantity, 'price': str(from_cents(price_cents))}
+        self._save(cart)
+
+    def set_quantity(self, product_id, quantity):
+        cart = self._cart
+        line = cart.get(str(product_id))
+        if line is None:
+            return False
+        line['qty'] = quantity
+        self._save(cart)
+        return True
+
+    def delete(self, product_id):
+        cart = self._cart
+        if cart.pop(str(product_id), None) is not None:
+            self._save(cart)
+
+    def update_lines(self, lines, deleted):
+        cart = self._cart
+        for product_id, (quantity, price_cents) in lines.items():
+            cart[str(product_id)] = {'qty': quantity, 'price': str(from_cents(price_cents))}
+        for product_id in deleted:
+            cart.pop(str(product_id), None)
+        self._save(cart)
+
+    def clear(self):
+        if CART_SESSION_ID in self.request.session:
+            del self.request.session[CART_SESSION_ID]
+
+
+@lru_cache(maxsize=None)
+def get_redis_client(url):
+    return redis.Redis.from_url(url)
+
+
+class RedisCartStorage(BaseCartStorage):
+    """
+    Keeps every cart in a Redis hash with two integer fields per line,
+    "<product id>:q" and "<product id>:p", the quantity and the price in cents.
+
+    Each change is a single atomic command on its own fields, so adding to
+    or updating the cart never rewrites the session. The session only holds
+    the id of the cart, written once when the first line is added.
+    """
+    SET_QUANTITY_SCRIPT = """
+        if redis.call('HEXISTS', KEYS[1], ARGV[1]) == 0 then return 0 end
+        redis.call('HSET', KEYS[1], ARGV[2], ARGV[3])
+        redis.call('EXPIRE', KEYS[1], ARGV[4])
+        return 1
+    """
+
+    def __init__(self, request):
+        super().__init__(request)
+        self.redis = get_redis_client(settings.CART_REDIS_URL)
+        self.timeout = settings.CART_REDIS_TIMEOUT
+        self._set_quantity = self.redis.register_script(self.SET_QUANTITY_SCRIPT)
+
+    def _key(self, create=False):
+        cart_id = self.request.session.get(CART_ID_SESSION_KEY)
+        if cart_id is None and create:
+            cart_id = self.request.session[CART_ID_SESSION_KEY] = uuid.uuid4().hex
+        return f'cart:{cart_id}' if cart_id else None
+
+    def items(self):
+        key = self._key()
+        if key is None:
+            return {}
+        lines = {}
+        for field, value in self.redis.hgetall(key).items():
+            product_id, kind = field.decode().split(':')
+            lines.setdefault(int(product_id), {})[kind] = int(value)
+        return {
+            product_id: (line['q'], line['p'])
+            for product_id, line in lines.items() if 'q' in line and 'p' in line
+        }
+
+    def set(self, product_id, quantity, price_cents):
+        key = self._key(create=True)
+        with self.redis.pipeline() as pipe:
+            pipe.hset(key, mapping={f'{product_id}:q': quantity, f'{product_id}:p': price_cents})
+            pipe.expire(key, self.timeout)
+            pipe.execute()
+
+    def set_quantity(self, product_id, quantity):
+        key = self._key()
+        if key is None:
+            return False
+        return bool(self._set_quantity(
+            keys=[key], args=[f'{product_id}:p', f'{product_id}:q', quantity, self.timeout]))
+
+    def delete(self, product_id):
+        key = self._key()
+        if key is not None:
+            self.redis.hdel(key, f'{product_id}:q', f'{product_id}:p')
+
+    def update_lines(self, lines, deleted):
+        key = self._key(create=bool(lines))
+        if key is None:
+            return
+        with self.redis.pipeline(transaction=True) as pipe:
+            if lines:
+                pipe.hset(key, mapping={
+                    field: value
+                    for product_id, (quantity, price_cents) in lines.items()
+                    for field, value in ((f'{product_id}:q', quantity), (f'{product_id}:p', price_cents))
+                })
+            if deleted:
+                pipe.hdel(key, *(f'{product_id}:{kind}' for product_id in deleted for kind in 'qp'))
+            pipe.expire(key, self.timeout)
+            pipe.execute()
+
+    def clear(self):
+        key = self._key()
+        if key is not None:
+            self.redis.delete(key)
+
+
+def get_cart_storage(request):
+    """
+    Returns the storage configured by the CART_STORAGE setting for the request.
+    """
+    return import_string(settings.CART_STORAGE)(request)
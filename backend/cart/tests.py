@@ -1,12 +1,20 @@
 import json
+from decimal import Decimal
+from unittest import skipUnless
 
+import redis
+from django.conf import settings
 from django.contrib.sessions.middleware import SessionMiddleware
+from django.contrib.sessions.models import Session
+from django.core.cache import cache
 
-from django.test import Client, RequestFactory, TestCase
+from django.test import Client, RequestFactory, TestCase, override_settings
 from django.urls import reverse
 
 from shop.models import Category, ProductProxy
 
+from .cart import Cart, get_item_count
+from .storage import CART_SESSION_ID, get_redis_client
 from .views import cart_add, cart_delete, cart_update, cart_view
 
 
@@ -31,6 +39,7 @@ class CartViewTest(TestCase):
 class CartAddViewTestCase(TestCase):
 
     def setUp(self):
+        cache.clear()
         self.category = Category.objects.create(name='Category 1')
         self.product = ProductProxy.objects.create(title='Example Product', price=10.0, category=self.category)
         self.factory = RequestFactory().post(reverse('cart:add-to-cart'), {
@@ -54,6 +63,7 @@ class CartAddViewTestCase(TestCase):
 class CartDeleteViewTestCase(TestCase):
 
     def setUp(self):
+        cache.clear()
         self.category = Category.objects.create(name='Category 1')
         self.product = ProductProxy.objects.create(title='Example Product', price=10.0, category=self.category)
         
@@ -76,6 +86,7 @@ class CartDeleteViewTestCase(TestCase):
 class CartUpdateViewTestCase(TestCase):
 
     def setUp(self):
+        cache.clear()
         self.category = Category.objects.create(name='Category 1')
         self.product = ProductProxy.objects.create(title='Example Product', price=10.0, category=self.category)
         self.factory = RequestFactory().post(reverse('cart:add-to-cart'), {
@@ -99,4 +110,177 @@ class CartUpdateViewTestCase(TestCase):
         self.assertEqual(response.status_code, 200)
         data = json.loads(response.content)
         self.assertEqual(data['total'], '50.00')
-        self.assertEqual(data['qty'], 5)
\ No newline at end of file
+        self.assertEqual(data['qty'], 5)
+
+
+def redis_available():
+    try:
+        return get_redis_client(settings.CART_REDIS_URL).ping()
+    except redis.RedisError:
+        return False
+
+
+class CartStorageTestMixin:
+
+    def setUp(self):
+        cache.clear()
+        self.category = Category.objects.create(name='Category 1')
+        self.product = ProductProxy.objects.create(
+            title='Example Product', price=10.0, discount=10, category=self.category)
+        self.request = RequestFactory().get('/')
+        SessionMiddleware(lambda request: None).process_request(self.request)
+
+    def test_lines_round_trip(self):
+        cart = Cart(self.request)
+        cart.add(product=self.product, quantity=2)
+        cart.update(self.product.id, 3)
+
+        cart = Cart(self.request)
+        self.assertEqual(len(cart), 3)
+        self.assertEqual(cart.get_total_price(), Decimal('27.00'))
+        with self.assertNumQueries(1):
+            [line] = list(cart)
+            list(cart)
+        self.assertEqual((line.product, line.qty, line.price), (self.product, 3, Decimal('9.00')))
+        self.assertEqual((line.total, line.list_total), (Decimal('27.00'), Decimal('30.00')))
+
+        cart.delete(self.product.id)
+        self.assertEqual(len(Cart(self.request)), 0)
+
+    def test_reading_creates_no_session_state(self):
+        cart = Cart(self.request)
+        self.assertEqual(len(cart), 0)
+        cart.update(self.product.id, 2)
+        self.assertFalse(self.request.session.modified)
+        self.assertEqual(dict(self.request.session), {})
+
+
+@override_settings(CART_STORAGE='cart.storage.SessionCartStorage')
+class SessionCartStorageTest(CartStorageTestMixin, TestCase):
+
+    def test_iteration_leaves_the_session_untouched(self):
+        Cart(self.request).add(product=self.product, quantity=2)
+        stored = json.dumps(self.request.session[CART_SESSION_ID])
+        self.request.session.modified = False
+
+        list(Cart(self.request))
+        self.assertFalse(self.request.session.modified)
+        self.assertEqual(json.dumps(self.request.session[CART_SESSION_ID]), stored)
+
+    def test_legacy_session_format(self):
+        self.request.session[CART_SESSION_ID] = {str(self.product.id): {'qty': 2, 'price': '9.5'}}
+        [line] = Cart(self.request)
+        self.assertEqual((line.qty, line.added_price), (2, Decimal('9.50')))
+
+
+@skipUnless(redis_available(), 'Redis is not available')
+@override_settings(CART_STORAGE='cart.storage.RedisCartStorage')
+class RedisCartStorageTest(CartStorageTestMixin, TestCase):
+
+    def test_writes_leave_the_session_alone(self):
+        cart = Cart(self.request)
+        cart.add(product=self.product, quantity=1)
+        self.request.session.modified = False
+
+        cart.update(self.product.id, 4)
+        self.assertFalse(self.request.session.modified)
+        self.assertEqual(len(Cart(self.request)), 4)
+        Cart(self.request).clear()
+
+
+class LazyCartContextTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.category = Category.objects.create(name='Category 1')
+        self.product = ProductProxy.objects.create(
+            title='Example Product', slug='example-product', price=10.0, category=self.category)
+
+    def test_browsing_creates_no_session(self):
+        response = self.client.get(reverse('shop:products'))
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn(settings.SESSION_COOKIE_NAME, response.cookies)
+        self.assertFalse(Session.objects.exists())
+
+    def test_badge_count_is_cached(self):
+        self.client.post(reverse('cart:add-to-cart'), {
+            'action': 'post', 'product_id': self.product.id, 'product_qty': 3})
+        self.client.get(reverse('shop:products'))
+
+        request = RequestFactory().get('/')
+        request.session = self.client.session.__class__(self.client.session.session_key)
+        with self.assertNumQueries(0):
+            self.assertEqual(get_item_count(request), 3)
+
+        response = self.client.get(self.product.get_absolute_url())
+        self.assertEqual(len(response.context['cart']), 3)
+
+
+class CartBatchViewTest(TestCase):
+
+    def setUp(self):
+        self.category = Category.objects.create(name='Category 1')
+        self.first = ProductProxy.objects.create(title='First', slug='first', price=10.0, category=self.category)
+        self.second = ProductProxy.objects.create(title='Second', slug='second', price=5.0, category=self.category)
+
+    def post(self, *operations):
+        return self.client.post(reverse('cart:batch-cart'), {'operations': list(operations)},
+                                content_type='application/json')
+
+    def test_operations_apply_together(self):
+        response = self.post(
+            {'op': 'add', 'product_id': self.first.id, 'qty': 1},
+            {'op': 'add', 'product_id': self.second.id, 'qty': 2},
+            {'op': 'update', 'product_id': self.first.id, 'qty': 3},
+        )
+        self.assertEqual(response.json(), {'qty': 5, 'total': '40.00'})
+
+        response = self.post({'op': 'delete', 'product_id': self.second.id})
+        self.assertEqual(response.json(), {'qty': 3, 'total': '30.00'})
+
+    def test_invalid_batch_changes_nothing(self):
+        self.post({'op': 'add', 'product_id': self.first.id, 'qty': 1})
+        response = self.post(
+            {'op': 'update', 'product_id': self.first.id, 'qty': 4},
+            {'op': 'add', 'product_id': 0, 'qty': 1},
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.post({'op': 'delete', 'product_id': 0}).json()['qty'], 1)
+
+        self.assertEqual(self.post({'op': 'update', 'product_id': self.first.id, 'qty': 0}).status_code, 400)
+
+
+class CartPriceRevalidationTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.category = Category.objects.create(name='Category 1')
+        self.product = ProductProxy.objects.create(
+            title='Example Product', slug='example-product', price=10.0, category=self.category)
+        self.request = RequestFactory().get('/')
+        SessionMiddleware(lambda request: None).process_request(self.request)
+        Cart(self.request).add(product=self.product, quantity=2)
+
+    def test_lines_follow_price_changes(self):
+        self.product.discount = 50
+        self.product.save()
+
+        cart = Cart(self.request)
+        self.assertEqual(cart.get_total_price(), Decimal('10.00'))
+        [line] = cart
+        self.assertTrue(line.price_changed)
+        self.assertEqual((line.price, line.added_price, line.total), (Decimal('5.00'), Decimal('10.00'), Decimal('10.00')))
+
+    def test_total_reads_the_price_table(self):
+        Cart(self.request).get_total_price()
+        with self.assertNumQueries(0):
+            self.assertEqual(Cart(self.request).get_total_price(), Decimal('20.00'))
+        self.assertFalse(list(Cart(self.request))[0].price_changed)
+
+    def test_unavailable_products_are_left_out(self):
+        self.product.available = False
+        self.product.save()
+
+        cart = Cart(self.request)
+        self.assertEqual(cart.get_total_price(), Decimal('0.00'))
+        self.assertEqual(list(cart), [])
@@ -1,5 +1,5 @@
 from django.urls import path
-from .views import cart_view, cart_add, cart_delete, cart_update
+from .views import cart_view, cart_add, cart_batch, cart_delete, cart_update
 
 
 
@@ -10,5 +10,6 @@ urlpatterns = [
     path('add/', cart_add, name='add-to-cart'),
     path('delete/', cart_delete, name='delete-to-cart'),
     path('update/', cart_update, name='update-to-cart'),
+    path('batch/', cart_batch, name='batch-cart'),
     
 ]
\ No newline at end of file
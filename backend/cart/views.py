@@ -1,10 +1,16 @@
+import json
+
 from django.http import JsonResponse
 from django.shortcuts import get_object_or_404, render
+from django.views.decorators.http import require_POST
 
 from shop.models import ProductProxy
 
 from .cart import Cart
 
+CART_OPERATIONS = ('add', 'update', 'delete')
+MAX_BATCH_OPERATIONS = 100
+
 
 def cart_view(request):
     cart = Cart(request)
@@ -64,4 +70,59 @@ def cart_update(request):
 
         response = JsonResponse({'qty': cart_qty, 'total': cart_total})
 
-        return response
\ No newline at end of file
+        return response
+
+
+def parse_operations(payload):
+    """
+    Validates the operations of a batch request.
+
+    Args:
+        payload (dict): The decoded JSON body, {"operations": [{"op": "add",
+            "product_id": 1, "qty": 2}, ...]}. Deletions need no "qty".
+
+    Raises:
+        ValueError: If an operation is malformed.
+
+    Returns:
+        list: (operation, product_id, quantity) tuples.
+    """
+    operations = payload.get('operations') if isinstance(payload, dict) else None
+    if not isinstance(operations, list) or not 0 < len(operations) <= MAX_BATCH_OPERATIONS:
+        raise ValueError(f'Expected a list of 1 to {MAX_BATCH_OPERATIONS} operations.')
+
+    parsed = []
+    for operation in operations:
+        try:
+            op, product_id, qty = operation['op'], int(operation['product_id']), int(operation.get('qty', 0))
+        except (KeyError, TypeError, ValueError):
+            raise ValueError(f'Malformed operation: {operation!r}')
+        if op not in CART_OPERATIONS or (op != 'delete' and qty < 1):
+            raise ValueError(f'Invalid operation: {operation!r}')
+        parsed.append((op, product_id, qty))
+    return parsed
+
+
+@require_POST
+def cart_batch(request):
+    """
+    Applies a list of add, update and delete operations to the cart at once.
+
+    All products being added are fetched with one query, and nothing is
+    applied if any operation is invalid.
+    """
+    try:
+        operations = parse_operations(json.loads(request.body))
+    except ValueError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+
+    added = {product_id for op, product_id, _ in operations if op == 'add'}
+    products = ProductProxy.objects.only('id', 'price', 'discount').in_bulk(added)
+    missing = added - products.keys()
+    if missing:
+        return JsonResponse({'error': f'Unknown products: {sorted(missing)}'}, status=400)
+
+    cart = Cart(request)
+    cart.apply(operations, products)
+
+    return JsonResponse({'qty': len(cart), 'total': cart.get_total_price()})
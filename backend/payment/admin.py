@@ -1,69 +1,55 @@
-import csv
-import datetime
+import uuid
 
 from django.contrib import admin
-from django.http import HttpResponse
 from django.urls import reverse
+from django.utils import timezone
 from django.utils.html import format_html
 from django.utils.safestring import mark_safe
 
-from .models import Order, OrderItem, ShippingAddress
+from shop.pagination import EstimatedCountPaginator
+
+from .exports import changelist_filters, stream_orders_csv
+from .models import Order, OrderItem, OutboxEmail, ShippingAddress, StockReservation, WebhookEvent
+from .tasks import export_orders, render_invoices
 
 
 def export_paid_to_csv(modeladmin, request, queryset):
-    opts = modeladmin.model._meta
-    content_disposition = f"attachment; filename=Paid{opts.verbose_name}.csv"
-    response = HttpResponse(content_type="text/csv")
-    response["Content-Disposition"] = content_disposition
-    writer = csv.writer(response)
-    fields = [
-        field
-        for field in opts.get_fields()
-        if not field.many_to_many and not field.one_to_many 
-    ]
-    writer.writerow([field.verbose_name for field in fields])
-    for obj in queryset:
-        if not getattr(obj, "paid"):
-            continue
-        data_row = []
-        for field in fields:
-            value = getattr(obj, field.name)
-            if isinstance(value, datetime.datetime):
-                value = value.strftime("%d/%m/%Y")
-            data_row.append(value)
-        writer.writerow(data_row)
-    return response
+    return stream_orders_csv(queryset.filter(paid=True), 'PaidOrders.csv')
 
 
 export_paid_to_csv.short_description = "Export Paid to CSV"
 
 def export_not_paid_to_csv(modeladmin, request, queryset):
-    opts = modeladmin.model._meta
-    content_disposition = f"attachment; filename=NotPaid{opts.verbose_name}.csv"
-    response = HttpResponse(content_type="text/csv")
-    response["Content-Disposition"] = content_disposition
-    writer = csv.writer(response)
-    fields = [
-        field
-        for field in opts.get_fields()
-        if not field.many_to_many and not field.one_to_many 
-    ]
-    writer.writerow([field.verbose_name for field in fields])
-    for obj in queryset:
-        if getattr(obj, "paid"):
-            continue
-        data_row = []
-        for field in fields:
-            value = getattr(obj, field.name)
-            if isinstance(value, datetime.datetime):
-                value = value.strftime("%d/%m/%Y")
-            data_row.append(value)
-        writer.writerow(data_row)
-    return response
+    return stream_orders_csv(queryset.filter(paid=False), 'NotPaidOrders.csv')
 
 
 export_not_paid_to_csv.short_description = "Export Not Paid to CSV"
 
+def export_in_background(modeladmin, request, queryset):
+    name = f'orders-{timezone.now():%Y%m%d-%H%M%S}-{uuid.uuid4().hex[:8]}.csv.gz'
+    # A whole changelist is sent as its filters, so the message stays small
+    # however many orders match. A selection is at most a page of ids.
+    try:
+        if request.POST.get('select_across') != '1':
+            raise ValueError('Not the whole changelist')
+        filters = changelist_filters(request.GET)
+    except ValueError:
+        filters = {'pk__in': list(queryset.values_list('pk', flat=True))}
+    export_orders.delay(filters, name, request.user.pk, request.build_absolute_uri('/'))
+    modeladmin.message_user(
+        request, f'The export {name} is being prepared, a download link will be emailed to you.')
+
+
+export_in_background.short_description = "Export to compressed CSV in background"
+
+def generate_invoices_in_background(modeladmin, request, queryset):
+    order_ids = list(queryset.values_list('pk', flat=True))
+    render_invoices.delay(order_ids)
+    modeladmin.message_user(request, f'The invoices of {len(order_ids)} orders are being generated.')
+
+
+generate_invoices_in_background.short_description = "Generate PDF invoices in background"
+
 def order_pdf(obj):
     url = reverse('payment:admin_order_pdf', args=[obj.id])
     return mark_safe(f'<a href="{url}">PDF</a>')
@@ -74,7 +60,12 @@ class ShippingAdressAdmin(admin.ModelAdmin):
     list_display = ('full_name_bold','user', 'email', 'country', 'city', 'zip')
     empty_value_display = "-empty-"
     list_display_links = ('full_name_bold',)
-    list_filter = ('user', 'country', 'city')
+    list_filter = ('country',)
+    list_select_related = ('user',)
+    search_fields = ('full_name', 'email', 'user__username')
+    autocomplete_fields = ('user',)
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
 
     @admin.display(description="Full Name", empty_value="Noname")
     def full_name_bold(self, obj):
@@ -83,6 +74,10 @@ class ShippingAdressAdmin(admin.ModelAdmin):
 class OrderItemInline(admin.TabularInline):
     model = OrderItem
     extra = 0
+    autocomplete_fields = ['product', 'user']
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).select_related('product', 'user')
 
     def get_readonly_fields(self, request, obj=None):
         if obj:
@@ -90,17 +85,65 @@ class OrderItemInline(admin.TabularInline):
         return super().get_readonly_fields(request, obj)
 
 class OrderAdmin(admin.ModelAdmin):
-    list_display = ['id', 'user', 'shipping_address', 'amount',
+    list_display = ['id', 'user', 'shipping_address', 'amount', 'total', 'item_count',
                     'created', 'updated', 'paid', 'discount', order_pdf
 ]
-    list_filter = ['paid', 'updated','created',]
+    readonly_fields = ['subtotal', 'discount_amount', 'total']
+    list_filter = ['paid', 'out_of_stock', 'created',]
+    list_select_related = ['user', 'shipping_address']
+    search_fields = ['=id']
+    autocomplete_fields = ['user', 'shipping_address']
     inlines = [OrderItemInline]
     list_per_page = 15
     list_display_links = ['id', 'user']
-    actions = [export_paid_to_csv, export_not_paid_to_csv]
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    actions = [export_paid_to_csv, export_not_paid_to_csv, export_in_background,
+               generate_invoices_in_background]
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).with_item_count()
+
+    @admin.display(description='Items', ordering='item_count')
+    def item_count(self, obj):
+        return obj.item_count
+
+
+class OrderItemAdmin(admin.ModelAdmin):
+    list_display = ['id', 'order', 'product', 'price', 'quantity', 'user']
+    list_select_related = ['order', 'product', 'user']
+    autocomplete_fields = ['order', 'product', 'user']
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+
+class StockReservationAdmin(admin.ModelAdmin):
+    list_display = ['order', 'product', 'quantity', 'expires_at']
+    list_select_related = ['order', 'product']
+    autocomplete_fields = ['order', 'product']
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
 
 admin.site.register(Order, OrderAdmin)
-admin.site.register(OrderItem)
+admin.site.register(OrderItem, OrderItemAdmin)
+admin.site.register(StockReservation, StockReservationAdmin)
 admin.site.register(ShippingAddress, ShippingAdressAdmin)
 
 
+@admin.register(WebhookEvent)
+class WebhookEventAdmin(admin.ModelAdmin):
+    list_display = ('event_id', 'provider', 'event_type', 'received_at', 'processed_at')
+    list_filter = ('provider',)
+    search_fields = ('event_id',)
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+
+@admin.register(OutboxEmail)
+class OutboxEmailAdmin(admin.ModelAdmin):
+    list_display = ('subject', 'recipient', 'created', 'sent_at', 'attempts')
+    search_fields = ('recipient', 'key')
+    readonly_fields = ('created', 'sent_at', 'attempts', 'last_error')
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
@@ -0,0 +1,89 @@
+import json
+import random
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class FakeProviderHandler(BaseHTTPRequestHandler):
+    """
+    Answers the Stripe Checkout and YooKassa payment creation calls like the
+    real APIs do, returning the same payment for a repeated idempotency key.
+    YooKassa payments read back are reported as paid.
+    """
+
+    def do_GET(self):
+        payment_id = self.path.rsplit('/', 1)[-1]
+        payload = self.server.created.get(payment_id)
+        if '/payments/' not in self.path or payload is None:
+            return self.respond(404, {'type': 'error', 'code': 'not_found'})
+        self.respond(200, {'id': payment_id, 'status': 'succeeded', 'paid': True,
+                           'amount': payload.get('amount'), 'metadata': payload.get('metadata', {})})
+
+    def do_POST(self):
+        server = self.server
+        body = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+        if server.latency:
+            time.sleep(server.latency)
+        with server.lock:
+            server.requests += 1
+            failing = server.failures > 0 or random.random() < server.error_rate
+            server.failures = max(server.failures - 1, 0)
+        if failing:
+            return self.respond(503, {'error': {'message': 'Service unavailable'}})
+
+        key = self.headers.get('Idempotency-Key') or self.headers.get('Idempotence-Key') or uuid.uuid4().hex
+        payment_id = server.payments.setdefault(key, uuid.uuid4().hex)
+        url = f'http://{self.headers["Host"]}/pay/{payment_id}'
+        if self.path.endswith('/checkout/sessions'):
+            self.respond(200, {'id': f'cs_test_{payment_id}', 'object': 'checkout.session', 'url': url})
+        elif self.path.endswith('/payments'):
+            server.created.setdefault(payment_id, json.loads(body or b'{}'))
+            self.respond(200, {'id': payment_id, 'status': 'pending',
+                               'confirmation': {'type': 'redirect', 'confirmation_url': url}})
+        else:
+            self.respond(404, {'error': {'message': 'Unknown endpoint'}})
+
+    def respond(self, status, payload):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+
+def make_server(host='127.0.0.1', port=0, latency=0, error_rate=0, verbose=False):
+    """
+    Creates a fake payment provider server, for tests and load runs.
+
+    Point PAYMENT_STRIPE_API_BASE at http://<host>:<port> and
+    PAYMENT_YOOKASSA_API_BASE at http://<host>:<port>/v3 to use it.
+
+    Args:
+        host (str): The interface to listen on.
+        port (int): The port, 0 for any free one.
+        latency (float): Seconds to wait before every response.
+        error_rate (float): The share of requests answered with a 503.
+        verbose (bool): Whether to log every request.
+
+    Returns:
+        ThreadingHTTPServer: The server, not started yet. Setting its
+        failures attribute makes that many next requests fail.
+    """
+    server = ThreadingHTTPServer((host, port), FakeProviderHandler)
+    server.daemon_threads = True
+    server.latency = latency
+    server.error_rate = error_rate
+    server.verbose = verbose
+    server.failures = 0
+    server.requests = 0
+    server.payments = {}
+    server.created = {}
+    server.lock = threading.Lock()
+    return server
@@ -0,0 +1,206 @@
+from datetime import timedelta
+from decimal import Decimal
+from functools import lru_cache
+from typing import NamedTuple
+
+import requests
+import stripe
+from django.conf import settings
+from django.utils import timezone
+from django.utils.module_loading import import_string
+from requests.adapters import HTTPAdapter
+from urllib3 import Retry
+
+from shop.prices import to_cents
+
+stripe.api_key = settings.STRIPE_SECRET_KEY
+stripe.api_version = settings.STRIPE_API_VERSION
+stripe.api_base = settings.PAYMENT_STRIPE_API_BASE
+
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+# Stripe refuses Checkout sessions expiring less than 30 minutes after they are created.
+STRIPE_MIN_SESSION_DURATION = timedelta(minutes=31)
+# YooKassa charges in roubles, converted from the dollar prices at a fixed rate.
+YOOKASSA_RUB_RATE = 93
+
+
+class PaymentError(Exception):
+    """
+    Raised when a payment provider cannot be reached or refuses a payment.
+    """
+
+
+class PaymentLine(NamedTuple):
+    title: str
+    price: Decimal
+    quantity: int
+
+
+class Checkout(NamedTuple):
+    """
+    A payment created with a provider.
+
+    Attributes:
+        payment_id (str): The id of the payment at the provider.
+        url (str): The provider's page the customer pays on.
+    """
+    payment_id: str
+    url: str
+
+
+@lru_cache(maxsize=None)
+def get_http_session():
+    """
+    Returns the HTTP session shared by every call to a payment provider.
+
+    Its connection pool keeps provider connections open between checkouts.
+    Failed connections and throttled or failing responses are retried with
+    exponential backoff. POST requests are retried too, because every
+    payment is created with an idempotency key.
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(
+        pool_maxsize=settings.PAYMENT_HTTP_POOL_SIZE,
+        max_retries=Retry(
+            total=settings.PAYMENT_HTTP_RETRIES,
+            backoff_factor=settings.PAYMENT_HTTP_BACKOFF,
+            status_forcelist=RETRY_STATUSES,
+            allowed_methods=None,
+            raise_on_status=False,
+        ),
+    )
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+
+class BaseGateway:
+
+    def create_payment(self, order, lines, success_url, cancel_url):
+        """
+        Creates the payment of an order with the provider.
+
+        Args:
+            order (Order): The order to pay.
+            lines (list): The PaymentLine of every item of the order.
+            success_url (str): Where the provider sends the customer once paid.
+            cancel_url (str): Where the provider sends the customer otherwise.
+
+        Raises:
+            PaymentError: If the provider is unreachable or refuses the payment.
+
+        Returns:
+            Checkout: The created payment.
+        """
+        raise NotImplementedError
+
+
+class StripeGateway(BaseGateway):
+    """
+    Creates Stripe Checkout sessions through the Stripe SDK, whose HTTP calls
+    go through the shared session with the configured timeouts.
+
+    A session expires with the stock reservation of its order, or as soon as
+    Stripe allows after that, so it cannot be paid long after the stock was
+    given back.
+    """
+
+    def __init__(self):
+        session = get_http_session()
+        if getattr(stripe.default_http_client, '_session', None) is not session:
+            stripe.default_http_client = stripe.http_client.RequestsClient(
+                timeout=settings.PAYMENT_HTTP_TIMEOUT, session=session)
+
+    def create_payment(self, order, lines, success_url, cancel_url):
+        try:
+            session = stripe.checkout.Session.create(
+                mode='payment',
+                success_url=success_url,
+                cancel_url=cancel_url,
+                client_reference_id=order.id,
+                expires_at=int(max(
+                    order.created + settings.PAYMENT_RESERVATION_TIMEOUT,
+                    timezone.now() + STRIPE_MIN_SESSION_DURATION,
+                ).timestamp()),
+                line_items=[{
+                    'price_data': {
+                        'unit_amount': to_cents(line.price),
+                        'currency': 'usd',
+                        'product_data': {
+                            'name': line.title
+                        },
+                    },
+                    'quantity': line.quantity,
+                } for line in lines],
+                idempotency_key=f'order-{order.id}',
+            )
+        except stripe.error.StripeError as e:
+            raise PaymentError(str(e)) from e
+        return Checkout(session.id, session.url)
+
+
+class YooKassaGateway(BaseGateway):
+    """
+    Creates YooKassa payments with the REST API directly, since the YooKassa
+    SDK opens a new connection for every call and has no read timeout.
+    """
+
+    def create_payment(self, order, lines, success_url, cancel_url):
+        try:
+            response = get_http_session().post(
+                f'{settings.PAYMENT_YOOKASSA_API_BASE}/payments',
+                json={
+                    'amount': yookassa_amount(order.amount),
+                    'confirmation': {
+                        'type': 'redirect',
+                        'return_url': success_url,
+                    },
+                    'capture': True,
+                    'test': True,
+                    'description': 'Товары в корзине',
+                    'metadata': {'order_id': order.id},
+                },
+                auth=(settings.YOOKASSA_SHOP_ID, settings.YOOKASSA_SECRET_KEY),
+                headers={'Idempotence-Key': f'order-{order.id}'},
+                timeout=settings.PAYMENT_HTTP_TIMEOUT,
+            )
+            response.raise_for_status()
+            payment = response.json()
+            return Checkout(payment['id'], payment['confirmation']['confirmation_url'])
+        except (requests.RequestException, ValueError, KeyError) as e:
+            raise PaymentError(str(e)) from e
+
+    def get_payment(self, payment_id):
+        """
+        Returns a payment as the YooKassa API currently reports it.
+
+        Raises:
+            PaymentError: If the API is unreachable or does not know the payment.
+        """
+        try:
+            response = get_http_session().get(
+                f'{settings.PAYMENT_YOOKASSA_API_BASE}/payments/{payment_id}',
+                auth=(settings.YOOKASSA_SHOP_ID, settings.YOOKASSA_SECRET_KEY),
+                timeout=settings.PAYMENT_HTTP_TIMEOUT,
+            )
+            response.raise_for_status()
+            return response.json()
+        except (requests.RequestException, ValueError) as e:
+            raise PaymentError(str(e)) from e
+
+
+def yookassa_amount(amount):
+    """
+    Returns the YooKassa amount object of a dollar amount.
+    """
+    return {'value': str(amount * YOOKASSA_RUB_RATE), 'currency': 'RUB'}
+
+
+def get_gateway(provider):
+    """
+    Returns the gateway configured in PAYMENT_GATEWAYS for a provider.
+
+    Args:
+        provider (str): The provider name, "stripe" or "yookassa".
+    """
+    return import_string(settings.PAYMENT_GATEWAYS[provider])()
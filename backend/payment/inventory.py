@@ -0,0 +1,198 @@
+import logging
+from collections import Counter, defaultdict
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Case, F, IntegerField, Value, When
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from shop.models import Product
+
+from .models import Order, OrderItem, StockReservation
+
+logger = logging.getLogger(__name__)
+
+
+class OutOfStock(Exception):
+    """
+    Raised when a product has less stock left than the quantity ordered.
+
+    Attributes:
+        product_ids (list): The ids of the products that ran out.
+    """
+
+    def __init__(self, product_ids):
+        self.product_ids = product_ids
+        super().__init__(f'Not enough stock for products {product_ids}')
+
+
+def _by_product(quantities):
+    return Case(*[When(pk=product_id, then=Value(quantity))
+                  for product_id, quantity in quantities.items()],
+                output_field=IntegerField())
+
+
+def _lock_products(product_ids):
+    """
+    Locks the rows of the tracked products in primary key order, so that
+    concurrent checkouts of overlapping carts queue up instead of deadlocking.
+
+    Returns:
+        dict: The stock by product id of the tracked products.
+    """
+    return dict(Product.objects.select_for_update().filter(
+        pk__in=product_ids, stock__isnull=False,
+    ).order_by('pk').values_list('pk', 'stock'))
+
+
+def reserve_stock(order, quantities):
+    """
+    Takes the ordered quantities from the stock of the products and records
+    reservations that give it back unless the order is paid in time.
+
+    Must run in the transaction that creates the order. Only the rows of the
+    products being ordered are locked, and only until that transaction ends,
+    so buyers of other products never wait. Products whose stock is not
+    tracked are left alone.
+
+    Args:
+        order (Order): The order being placed.
+        quantities (dict): The ordered quantity by product id.
+
+    Raises:
+        OutOfStock: If a product has less stock left than ordered.
+
+    Returns:
+        list: The reservations.
+    """
+    stocks = _lock_products(quantities.keys())
+    short = [product_id for product_id, stock in stocks.items() if stock < quantities[product_id]]
+    if short:
+        raise OutOfStock(short)
+    if not stocks:
+        return []
+
+    reserved = {product_id: quantities[product_id] for product_id in stocks}
+    updated = Product.objects.filter(
+        pk__in=reserved, stock__gte=_by_product(reserved),
+    ).update(stock=F('stock') - _by_product(reserved))
+    if updated != len(reserved):
+        raise OutOfStock(list(reserved))
+
+    expires_at = timezone.now() + settings.PAYMENT_RESERVATION_TIMEOUT
+    return StockReservation.objects.bulk_create([
+        StockReservation(order=order, product_id=product_id, quantity=quantity, expires_at=expires_at)
+        for product_id, quantity in reserved.items()
+    ])
+
+
+def release_stock(reservations):
+    """
+    Gives the stock of reservations back to their products and deletes them.
+
+    Reservations locked by another release are skipped, so the beat job and
+    a failed payment never give the same stock back twice, and those of
+    orders paid in the meantime are kept.
+
+    Args:
+        reservations (QuerySet): The reservations to release.
+
+    Returns:
+        int: The number of reservations released.
+    """
+    with transaction.atomic():
+        rows = list(reservations.filter(order__paid=False).select_for_update(
+            skip_locked=True, of=('self',)).values_list('pk', 'product_id', 'quantity'))
+        if not rows:
+            return 0
+        quantities = Counter()
+        for _, product_id, quantity in rows:
+            quantities[product_id] += quantity
+
+        _lock_products(quantities.keys())
+        Product.objects.filter(pk__in=quantities, stock__isnull=False).update(
+            stock=F('stock') + _by_product(quantities))
+        StockReservation.objects.filter(pk__in=[pk for pk, _, _ in rows]).delete()
+    return len(rows)
+
+
+def release_order_stock(order_id):
+    """
+    Gives back the stock reserved for an unpaid order.
+    """
+    return release_stock(StockReservation.objects.filter(order_id=order_id))
+
+
+def release_expired_stock():
+    """
+    Gives back the stock of every reservation past its expiry.
+    """
+    return release_stock(StockReservation.objects.filter(expires_at__lte=timezone.now()))
+
+
+def restock(quantities):
+    """
+    Adds received quantities to the stock of products.
+
+    The quantities are added to the stored stock in SQL, so reservations made
+    meanwhile are kept. Products whose stock is not tracked yet start being
+    tracked, with the received quantity as their stock.
+
+    Args:
+        quantities (dict): The received quantity by product id.
+
+    Returns:
+        int: The number of products restocked.
+    """
+    with transaction.atomic():
+        list(Product.objects.select_for_update().filter(pk__in=quantities).order_by('pk').values_list('pk'))
+        return Product.objects.filter(pk__in=quantities).update(
+            stock=Coalesce(F('stock'), Value(0)) + _by_product(quantities))
+
+
+def retake_stock(order_ids):
+    """
+    Takes the stock of paid orders again when their reservations were
+    released before the payment arrived.
+
+    Must run in the transaction that marks the orders paid, before
+    commit_stock. The products are locked and taken from like in
+    reserve_stock; orders with a product short of stock take nothing and are
+    flagged out_of_stock instead, to be restocked or refunded.
+
+    Args:
+        order_ids (list): The ids of the orders just paid.
+
+    Returns:
+        list: The ids of the orders flagged.
+    """
+    released = set(order_ids) - set(
+        StockReservation.objects.filter(order_id__in=order_ids).values_list('order_id', flat=True))
+    quantities = defaultdict(Counter)
+    for order_id, product_id, quantity in OrderItem.objects.filter(
+            order_id__in=released, product__stock__isnull=False).values_list('order_id', 'product_id', 'quantity'):
+        quantities[order_id][product_id] += quantity
+    if not quantities:
+        return []
+
+    stocks = Counter(_lock_products(set().union(*quantities.values())))
+    taken, short = Counter(), []
+    for order_id, ordered in sorted(quantities.items()):
+        if all(stocks[product_id] - taken[product_id] >= quantity for product_id, quantity in ordered.items()):
+            taken.update(ordered)
+        else:
+            short.append(order_id)
+    if taken:
+        Product.objects.filter(pk__in=taken).update(stock=F('stock') - _by_product(taken))
+    if short:
+        Order.objects.filter(pk__in=short).update(out_of_stock=True)
+        logger.error('Orders %s were paid after their stock was released and sold', short)
+    return short
+
+
+def commit_stock(order_ids):
+    """
+    Keeps the stock of paid orders sold by dropping their reservations.
+    """
+    return StockReservation.objects.filter(order_id__in=order_ids).delete()[0]
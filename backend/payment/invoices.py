@@ -0,0 +1,123 @@
+import os
+import posixpath
+from functools import lru_cache
+
+import weasyprint
+from django.conf import settings
+from django.contrib.staticfiles import finders
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db.models import Prefetch
+from django.template.loader import render_to_string
+
+from .models import Order, OrderItem
+
+INVOICE_DIRECTORY = 'invoices'
+INVOICE_STYLESHEET = 'payment/css/pdf.css'
+INVOICE_TEMPLATE = 'payment/order/pdf/pdf_invoice.html'
+INVOICE_BATCH_SIZE = 50
+
+
+@lru_cache(maxsize=None)
+def get_stylesheet():
+    """
+    Returns the invoice stylesheet, parsed once per process.
+    """
+    path = finders.find(INVOICE_STYLESHEET) or os.path.join(settings.STATIC_ROOT, INVOICE_STYLESHEET)
+    return weasyprint.CSS(filename=path)
+
+
+def invoice_orders():
+    """
+    Returns the orders with everything their invoice shows, loaded in three
+    queries whatever the number of orders and items.
+    """
+    return Order.objects.select_related('user', 'shipping_address').prefetch_related(
+        Prefetch('items', queryset=OrderItem.objects.select_related('product')))
+
+
+def invoice_name(order):
+    """
+    Returns the storage name of the invoice of an order as last updated, so
+    that any change to the order makes a new invoice. The invoices of an
+    order share a directory, named after it, where store_invoice replaces
+    the earlier versions.
+    """
+    return f'{INVOICE_DIRECTORY}/{order.id}/{order.updated:%Y%m%d%H%M%S%f}.pdf'
+
+
+def render_invoice(order):
+    """
+    Renders the invoice of an order loaded by invoice_orders.
+
+    Returns:
+        bytes: The PDF document.
+    """
+    html = render_to_string(INVOICE_TEMPLATE, {'order': order})
+    return weasyprint.HTML(string=html).write_pdf(stylesheets=[get_stylesheet()])
+
+
+def store_invoice(order, content):
+    """
+    Stores the invoice of the current version of an order and deletes the
+    invoices of its earlier versions.
+
+    Args:
+        order (Order): The order, only its id and updated are read.
+        content (bytes): The PDF document.
+
+    Returns:
+        str: The storage name of the invoice.
+    """
+    name = default_storage.save(invoice_name(order), ContentFile(content))
+    directory, file_name = posixpath.split(invoice_name(order))
+    version = posixpath.splitext(file_name)[0]
+    for other in default_storage.listdir(directory)[1]:
+        # Versions are timestamps of a fixed width, so they compare by age.
+        # A later version stored meanwhile by another worker is kept.
+        if other[:len(version)] < version:
+            default_storage.delete(posixpath.join(directory, other))
+    return name
+
+
+def get_invoice(order):
+    """
+    Returns the storage name of the invoice of an order, rendering and
+    storing it first unless this version of the order already has one.
+
+    Args:
+        order (Order): The order, only its id and updated are read.
+    """
+    name = invoice_name(order)
+    if not default_storage.exists(name):
+        name = store_invoice(order, render_invoice(invoice_orders().get(pk=order.pk)))
+    return name
+
+
+def missing_invoices(order_ids):
+    """
+    Returns the ids of the orders, among the given ones, whose current
+    version has no invoice yet.
+    """
+    return [order.id for order in Order.objects.filter(pk__in=order_ids).only('id', 'updated')
+            if not default_storage.exists(invoice_name(order))]
+
+
+def generate_invoices(order_ids):
+    """
+    Renders and stores the missing invoices of several orders, loaded with
+    three queries. Batches of orders are spread over the Celery workers by
+    the render_invoices task.
+
+    Args:
+        order_ids (list): The ids of the orders.
+
+    Returns:
+        list: The storage names of the invoices rendered.
+    """
+    generated = []
+    for order in invoice_orders().filter(pk__in=order_ids):
+        name = invoice_name(order)
+        if not default_storage.exists(name):
+            generated.append(store_invoice(order, render_invoice(order)))
+    return generated
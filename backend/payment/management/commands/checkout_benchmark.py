@@ -0,0 +1,79 @@
+import statistics
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from cart.cart import CartLine
+from payment.inventory import OutOfStock
+from payment.models import Order
+from payment.services import place_order
+from shop.models import Category, Product
+
+
+class Command(BaseCommand):
+    help = ('Measures checkout throughput with many parallel buyers of the same '
+            'product and checks that its stock is never oversold')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--buyers', type=int, default=500, help='Number of checkouts')
+        parser.add_argument('--workers', type=int, default=32, help='Concurrent buyers')
+        parser.add_argument('--stock', type=int, default=200, help='Stock of the product on sale')
+        parser.add_argument('--qty', type=int, default=1, help='Quantity bought by every buyer')
+        parser.add_argument('--keep', action='store_true', help='Keep the product and orders')
+
+    def handle(self, *args, **options):
+        if not connection.features.has_select_for_update:
+            raise CommandError(f'{connection.vendor} has no row-level locking, use PostgreSQL.')
+        category = Category.objects.first()
+        if category is None:
+            raise CommandError('The database has no category, run fakeproducts first.')
+
+        product = Product.objects.create(
+            category=category, title='Checkout benchmark', brand='Benchmark',
+            slug=f'checkout-benchmark-{uuid.uuid4().hex[:8]}', price=10, stock=options['stock'])
+        qty = options['qty']
+        line = CartLine(product, qty, product.price, product.price * qty, product.price * qty,
+                        product.price, False)
+
+        def buyer(count):
+            results = []
+            try:
+                for _ in range(count):
+                    started = time.perf_counter()
+                    try:
+                        order_id = place_order([line], None).pk
+                    except OutOfStock:
+                        order_id = None
+                    results.append((order_id, (time.perf_counter() - started) * 1000))
+            finally:
+                connection.close()
+            return results
+
+        workers, buyers = options['workers'], options['buyers']
+        started = time.perf_counter()
+        with ThreadPoolExecutor(workers) as pool:
+            chunks = pool.map(buyer, [buyers // workers + (index < buyers % workers) for index in range(workers)])
+            results = [result for chunk in chunks for result in chunk]
+        elapsed = time.perf_counter() - started
+
+        order_ids = [order_id for order_id, _ in results if order_id is not None]
+        timings = sorted(timing for _, timing in results)
+        product.refresh_from_db(fields=['stock'])
+        expected = options['stock'] - len(order_ids) * qty
+
+        self.stdout.write(f'{buyers} checkouts by {workers} buyers in {elapsed:.2f}s '
+                          f'({buyers / elapsed:,.0f} checkouts/s)')
+        self.stdout.write(f'Orders placed: {len(order_ids)}, rejected: {buyers - len(order_ids)}, '
+                          f'stock left: {product.stock}')
+        self.stdout.write(f'Latency: median {statistics.median(timings):.1f} ms, '
+                          f'p95 {timings[min(len(timings) - 1, round(0.95 * (len(timings) - 1)))]:.1f} ms')
+
+        if not options['keep']:
+            Order.objects.filter(pk__in=order_ids).delete()
+            product.delete()
+
+        if product.stock != expected or expected < 0:
+            raise CommandError(f'Stock is inconsistent: expected {expected}, found {product.stock}.')
@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand
+
+from payment.fake_provider import make_server
+
+
+class Command(BaseCommand):
+    help = 'Runs a local fake of the Stripe and YooKassa payment APIs for tests and load runs'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='127.0.0.1')
+        parser.add_argument('--port', type=int, default=8010)
+        parser.add_argument('--latency', type=float, default=0, help='Seconds before every response')
+        parser.add_argument('--error-rate', type=float, default=0, help='Share of requests failing with 503')
+        parser.add_argument('--verbose', action='store_true', help='Log every request')
+
+    def handle(self, *args, **options):
+        server = make_server(options['host'], options['port'], options['latency'],
+                             options['error_rate'], options['verbose'])
+        host, port = server.server_address
+        self.stdout.write(f'Fake payment provider on http://{host}:{port}\n'
+                          f'  PAYMENT_STRIPE_API_BASE=http://{host}:{port}\n'
+                          f'  PAYMENT_YOOKASSA_API_BASE=http://{host}:{port}/v3')
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
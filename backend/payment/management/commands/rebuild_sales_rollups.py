@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+
+from payment.rollups import rebuild_sales_rollups
+
+
+class Command(BaseCommand):
+    help = 'Recomputes the daily and per-product sales rollups from the paid orders'
+
+    def handle(self, *args, **options):
+        self.stdout.write(f'Sales of {rebuild_sales_rollups()} days rolled up')
@@ -0,0 +1,44 @@
+# Generated by Django 4.2.4 on 2026-10-18 06:25
+
+from decimal import Decimal
+
+from django.db import migrations, models
+from django.db.models import ExpressionWrapper, F, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce, Round
+
+
+def populate_order_totals(apps, schema_editor):
+    Order = apps.get_model('payment', 'Order')
+    OrderItem = apps.get_model('payment', 'OrderItem')
+    money = models.DecimalField(max_digits=9, decimal_places=2)
+    subtotal = OrderItem.objects.filter(order=OuterRef('pk')).order_by().values('order').annotate(
+        subtotal=ExpressionWrapper(Sum(F('price') * F('quantity')), output_field=money)).values('subtotal')
+    Order.objects.update(subtotal=Coalesce(Subquery(subtotal), Value(Decimal(0))))
+    discount_amount = Round(ExpressionWrapper(F('subtotal') * F('discount') * Value(Decimal('0.01')), output_field=money), 2)
+    Order.objects.update(discount_amount=discount_amount, total=F('subtotal') - discount_amount)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payment', '0008_webhookevent'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='discount_amount',
+            field=models.DecimalField(decimal_places=2, default=0, editable=False, max_digits=9),
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='subtotal',
+            field=models.DecimalField(decimal_places=2, default=0, editable=False, max_digits=9),
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='total',
+            field=models.DecimalField(decimal_places=2, default=0, editable=False, max_digits=9),
+        ),
+        migrations.RunPython(populate_order_totals, migrations.RunPython.noop),
+    ]
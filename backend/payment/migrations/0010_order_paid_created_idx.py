@@ -0,0 +1,17 @@
+# Generated by Django 4.2.4 on 2026-10-18 06:32
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payment', '0009_order_totals'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['paid', '-created'], name='payment_order_paid_created_idx'),
+        ),
+    ]
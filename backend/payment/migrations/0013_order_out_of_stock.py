@@ -0,0 +1,18 @@
+# Generated by Django 4.2.4 on 2026-10-18 06:58
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payment', '0012_outboxemail'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='out_of_stock',
+            field=models.BooleanField(default=False),
+        ),
+    ]
@@ -1,9 +1,12 @@
-from decimal import Decimal
+from decimal import ROUND_HALF_UP, Decimal
 
 from django.contrib.auth import get_user_model
 from django.core.validators import MaxValueValidator, MinValueValidator
 from django.db import models
+from django.db.models import Value
+from django.db.models.functions import Coalesce, Round
 from django.urls import reverse
+from django.utils import timezone
 
 from shop.models import Product
 
@@ -41,7 +44,55 @@ class ShippingAddress(models.Model):
         return shipping_address
 
 
+def _money(expression):
+    return models.ExpressionWrapper(expression, output_field=models.DecimalField(max_digits=9, decimal_places=2))
+
+
+class OrderQuerySet(models.QuerySet):
+
+    def update_totals(self):
+        """
+        Recomputes the stored totals of the orders from their items in SQL,
+        with two UPDATEs whatever the number of orders. updated is touched
+        too, so that cached invoices of the orders are rendered again.
+        """
+        subtotal = OrderItem.objects.filter(order=models.OuterRef('pk')).order_by().values('order').annotate(
+            subtotal=_money(models.Sum(models.F('price') * models.F('quantity')))).values('subtotal')
+        self.update(subtotal=Coalesce(models.Subquery(subtotal), Value(Decimal(0))), updated=timezone.now())
+        self.apply_discount()
+
+    def apply_discount(self):
+        """
+        Recomputes discount_amount and total from the stored subtotal.
+        """
+        discount_amount = Round(_money(models.F('subtotal') * models.F('discount') * Value(Decimal('0.01'))), 2)
+        self.update(discount_amount=discount_amount, total=models.F('subtotal') - discount_amount)
+
+    def with_item_count(self):
+        """
+        Annotates every order with item_count, computed in the database by a
+        correlated subquery. Unlike a JOIN and GROUP BY it is left out of
+        values() and values_list() that do not ask for it, so exports of an
+        annotated queryset stay plain scans.
+        """
+        items = OrderItem.objects.filter(order=models.OuterRef('pk')).order_by().values('order')
+        return self.annotate(
+            item_count=Coalesce(models.Subquery(items.annotate(count=models.Count('pk')).values('count')), 0),
+        )
+
+
 class Order(models.Model):
+    """
+    A customer's order.
+
+    subtotal is the sum of the item costs, maintained from the items by
+    payment.signals and set directly by bulk creators such as place_order.
+    discount_amount and total follow from it and discount, and are kept up
+    to date on every save.
+
+    out_of_stock flags paid orders whose reservation was released before the
+    payment arrived and whose stock could not be taken again.
+    """
     user = models.ForeignKey(
         User, on_delete=models.CASCADE, blank=True, null=True)
     shipping_address = models.ForeignKey(
@@ -50,8 +101,16 @@ class Order(models.Model):
     created = models.DateTimeField(auto_now_add=True)
     updated = models.DateTimeField(auto_now=True)
     paid = models.BooleanField(default=False)
+    out_of_stock = models.BooleanField(default=False)
     discount = models.IntegerField(
         default=0, validators=[MinValueValidator(0), MaxValueValidator(100)])
+    subtotal = models.DecimalField(max_digits=9, decimal_places=2, default=0, editable=False)
+    discount_amount = models.DecimalField(max_digits=9, decimal_places=2, default=0, editable=False)
+    total = models.DecimalField(max_digits=9, decimal_places=2, default=0, editable=False)
+
+    objects = OrderQuerySet.as_manager()
+
+    TOTAL_FIELDS = ('subtotal', 'discount_amount', 'total')
 
     class Meta:
         verbose_name = "Order"
@@ -59,6 +118,8 @@ class Order(models.Model):
         ordering = ['-created']
         indexes = [
             models.Index(fields=['-created']),
+            models.Index(fields=['paid', '-created'], name='payment_order_paid_created_idx'),
+            models.Index(fields=['updated'], name='payment_order_updated_idx'),
         ]
         constraints = [
             models.CheckConstraint(check=models.Q(
@@ -71,18 +132,41 @@ class Order(models.Model):
     def get_absolute_url(self):
         return reverse("payment:order_detail", kwargs={"pk": self.pk})
 
+    def save(self, *args, **kwargs):
+        if self._state.adding:
+            self.discount_amount, self.total = self.compute_totals(self.subtotal, self.discount)
+            return super().save(*args, **kwargs)
+
+        # The stored totals may have changed since this instance was loaded,
+        # so they are left out of the write and recomputed in SQL.
+        if kwargs.get('update_fields') is None:
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name not in self.TOTAL_FIELDS
+            ]
+        super().save(*args, **kwargs)
+        Order.objects.filter(pk=self.pk).apply_discount()
+
+    @staticmethod
+    def compute_totals(subtotal, discount):
+        """
+        Returns:
+            tuple: The discount amount and the total of a subtotal, in cents
+            rounded half up like the database rounds.
+        """
+        discount_amount = (Decimal(subtotal) * discount / Decimal(100)).quantize(
+            Decimal('0.01'), rounding=ROUND_HALF_UP)
+        return discount_amount, Decimal(subtotal) - discount_amount
+
     def get_total_cost_before_discount(self):
-        return sum(item.get_cost() for item in self.items.all())
+        return self.subtotal
 
     @property
     def get_discount(self):
-        if (total_cost := self.get_total_cost_before_discount()) and self.discount:
-            return total_cost * (self.discount / Decimal(100))
-        return Decimal(0)
+        return self.discount_amount
 
     def get_total_cost(self):
-        total_cost = self.get_total_cost_before_discount()
-        return total_cost - self.get_discount
+        return self.total
 
 
 class OrderItem(models.Model):
@@ -116,8 +200,197 @@ class OrderItem(models.Model):
 
     @classmethod
     def get_total_quantity_for_product(cls, product):
-        return cls.objects.filter(product=product).aggregate(total_quantity=models.Sum('quantity'))['total_quantity'] or 0
+        """
+        Returns the units of a product sold in paid orders, read from its
+        ProductSales rollup row.
+        """
+        return ProductSales.objects.filter(product=product).values_list('units', flat=True).first() or 0
 
     @staticmethod
     def get_average_price():
-        return OrderItem.objects.aggregate(average_price=models.Avg('price'))['average_price']
+        """
+        Returns the average unit price of the items of paid orders, summed
+        from the DailySales rollups, one row per day.
+        """
+        totals = DailySales.objects.aggregate(items=models.Sum('items'), price_sum=models.Sum('price_sum'))
+        if not totals['items']:
+            return None
+        return totals['price_sum'] / totals['items']
+
+
+class StockReservation(models.Model):
+    """
+    Stock taken from a product for an order awaiting payment.
+
+    The stock is decremented when the order is placed; the reservation gives
+    it back if the payment fails or does not complete before expires_at, and
+    is deleted without giving it back once the order is paid.
+    """
+    order = models.ForeignKey(
+        Order, on_delete=models.CASCADE, related_name='reservations')
+    product = models.ForeignKey(
+        Product, on_delete=models.CASCADE, related_name='reservations')
+    quantity = models.PositiveIntegerField()
+    expires_at = models.DateTimeField(db_index=True)
+
+    class Meta:
+        verbose_name = "Stock Reservation"
+        verbose_name_plural = "Stock Reservations"
+        ordering = ['expires_at']
+
+    def __str__(self):
+        return f"Reservation of {self.quantity} x {self.product_id} for order {self.order_id}"
+
+
+class WebhookEvent(models.Model):
+    """
+    A notification received from a payment provider.
+
+    Every delivery is stored once per provider event id, whatever the number
+    of retries, and marked processed by payment.webhooks.apply_webhook_events.
+    """
+    STRIPE = 'stripe'
+    YOOKASSA = 'yookassa'
+    PROVIDER_CHOICES = [
+        (STRIPE, 'Stripe'),
+        (YOOKASSA, 'YooKassa'),
+    ]
+
+    provider = models.CharField(max_length=20, choices=PROVIDER_CHOICES)
+    event_id = models.CharField(max_length=255)
+    event_type = models.CharField(max_length=100)
+    payload = models.JSONField()
+    received_at = models.DateTimeField(auto_now_add=True)
+    processed_at = models.DateTimeField(blank=True, null=True)
+
+    class Meta:
+        verbose_name = "Webhook Event"
+        verbose_name_plural = "Webhook Events"
+        ordering = ['-received_at']
+        constraints = [
+            models.UniqueConstraint(fields=['provider', 'event_id'], name='payment_webhookevent_unique'),
+        ]
+        indexes = [
+            models.Index(fields=['received_at'], condition=models.Q(processed_at__isnull=True),
+                         name='payment_webhookevent_pending'),
+        ]
+
+    def __str__(self):
+        return f"{self.provider} {self.event_type} {self.event_id}"
+
+
+class DailySales(models.Model):
+    """
+    The paid orders placed on a day, maintained by payment.rollups.
+
+    Attributes:
+        date (date): The day the orders were placed, in TIME_ZONE.
+        orders (int): The number of paid orders.
+        items (int): The number of their items.
+        units (int): The quantity of products sold.
+        revenue (Decimal): The sum of the order totals, discounts deducted.
+        price_sum (Decimal): The sum of the unit prices of the items.
+    """
+    date = models.DateField(unique=True)
+    orders = models.PositiveIntegerField(default=0)
+    items = models.PositiveIntegerField(default=0)
+    units = models.PositiveIntegerField(default=0)
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    price_sum = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+
+    class Meta:
+        verbose_name = "Daily Sales"
+        verbose_name_plural = "Daily Sales"
+        ordering = ['-date']
+
+    def __str__(self):
+        return f"Sales of {self.date}"
+
+
+class ProductDailySales(models.Model):
+    """
+    The sales of a product in the paid orders placed on a day, maintained
+    by payment.rollups. revenue is before order discounts.
+    """
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='daily_sales')
+    date = models.DateField()
+    units = models.PositiveIntegerField(default=0)
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+
+    class Meta:
+        verbose_name = "Product Daily Sales"
+        verbose_name_plural = "Product Daily Sales"
+        ordering = ['-date']
+        constraints = [
+            models.UniqueConstraint(fields=['product', 'date'], name='payment_productdailysales_unique'),
+        ]
+        indexes = [
+            models.Index(fields=['date'], name='payment_productdailysales_date'),
+        ]
+
+    def __str__(self):
+        return f"Sales of {self.product_id} on {self.date}"
+
+
+class ProductSales(models.Model):
+    """
+    The all-time sales of a product in paid orders, summed from its
+    ProductDailySales by payment.rollups.
+    """
+    product = models.OneToOneField(Product, on_delete=models.CASCADE, primary_key=True, related_name='sales')
+    units = models.PositiveIntegerField(default=0)
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+
+    class Meta:
+        verbose_name = "Product Sales"
+        verbose_name_plural = "Product Sales"
+        indexes = [
+            models.Index(fields=['-units'], name='payment_productsales_units'),
+        ]
+
+    def __str__(self):
+        return f"Sales of {self.product_id}"
+
+
+class RollupWatermark(models.Model):
+    """
+    How far an incremental rollup job got: the rows changed since value
+    have yet to be rolled up, all of them while value is None.
+    """
+    name = models.CharField(max_length=50, unique=True)
+    value = models.DateTimeField(blank=True, null=True)
+
+    def __str__(self):
+        return f"{self.name} rolled up to {self.value}"
+
+
+class OutboxEmail(models.Model):
+    """
+    An email queued by payment.outbox, sent in batches by send_outbox.
+
+    key, when given, identifies what the email is about, e.g. the
+    confirmation of an order, so that it is queued once whatever the number
+    of retries of the code queuing it.
+    """
+    key = models.CharField(max_length=100, unique=True, blank=True, null=True)
+    subject = models.CharField(max_length=255)
+    body = models.TextField()
+    from_email = models.CharField(max_length=254)
+    recipient = models.EmailField(max_length=254)
+    created = models.DateTimeField(auto_now_add=True)
+    send_after = models.DateTimeField(default=timezone.now)
+    sent_at = models.DateTimeField(blank=True, null=True)
+    attempts = models.PositiveIntegerField(default=0)
+    last_error = models.TextField(blank=True)
+
+    class Meta:
+        verbose_name = "Outbox Email"
+        verbose_name_plural = "Outbox Emails"
+        ordering = ['-created']
+        indexes = [
+            models.Index(fields=['send_after'], condition=models.Q(sent_at__isnull=True),
+                         name='payment_outboxemail_pending'),
+        ]
+
+    def __str__(self):
+        return f"{self.subject} to {self.recipient}"
@@ -0,0 +1,146 @@
+import logging
+import smtplib
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.mail import EmailMessage, get_connection
+from django.db import transaction
+from django.utils import timezone
+
+from .models import Order, OutboxEmail
+
+logger = logging.getLogger(__name__)
+
+OUTBOX_BATCH_SIZE = 100
+OUTBOX_MAX_ATTEMPTS = 5
+OUTBOX_RETRY_DELAY = timedelta(minutes=1)
+OUTBOX_STATS_KEY = 'payment:outbox:stats'
+# Refusals of one message. Any other error leaves the connection unusable.
+MESSAGE_ERRORS = (smtplib.SMTPRecipientsRefused, smtplib.SMTPSenderRefused, smtplib.SMTPDataError)
+
+
+def queue_emails(emails):
+    """
+    Adds emails to the outbox, with one INSERT. Emails whose key is already
+    in the outbox are dropped.
+
+    Args:
+        emails (list): Unsaved OutboxEmail instances, whose from_email
+            defaults to EMAIL_HOST_USER.
+    """
+    for email in emails:
+        email.from_email = email.from_email or settings.EMAIL_HOST_USER
+    return OutboxEmail.objects.bulk_create(emails, ignore_conflicts=True)
+
+
+def queue_email(subject, body, recipient, key=None):
+    """
+    Adds an email to the outbox.
+    """
+    return queue_emails([OutboxEmail(key=key, subject=subject, body=body, recipient=recipient)])
+
+
+def queue_order_confirmations(order_ids):
+    """
+    Queues the payment confirmation of orders, sent to the email of the
+    address each order ships to, or to its user's for orders without one.
+    """
+    orders = Order.objects.filter(pk__in=order_ids).select_related('shipping_address', 'user')
+    emails = []
+    for order in orders:
+        recipient = order.shipping_address.email if order.shipping_address else getattr(order.user, 'email', '')
+        if not recipient:
+            logger.warning('Order %s has no email to confirm its payment to', order.pk)
+            continue
+        emails.append(OutboxEmail(
+            key=f'order-confirmation:{order.pk}',
+            subject=f'Order {order.pk} payment Confirmation',
+            body=f'Your order and payment has been confirmed. Your order number is {order.pk}.',
+            recipient=recipient,
+        ))
+    return queue_emails(emails)
+
+
+def _failed(email, error, now):
+    email.attempts += 1
+    email.last_error = str(error)
+    email.send_after = now + OUTBOX_RETRY_DELAY * 2 ** (email.attempts - 1)
+    if email.attempts >= OUTBOX_MAX_ATTEMPTS:
+        logger.error('Giving up on email %s to %s after %d attempts: %s',
+                     email.pk, email.recipient, email.attempts, error)
+
+
+def send_outbox(batch_size=OUTBOX_BATCH_SIZE):
+    """
+    Sends the emails due in the outbox, one batch per transaction, all over
+    a single connection to the mail server.
+
+    An email the server refuses is retried later with exponential backoff,
+    up to OUTBOX_MAX_ATTEMPTS times. When the connection itself fails, the
+    run stops and the emails not sent yet are left as they were, for the
+    next run. Emails locked by a concurrent run are left to it. The counts
+    and the send rate of the run are logged and kept under OUTBOX_STATS_KEY.
+
+    Returns:
+        dict: The number of emails sent and failed, the duration in seconds
+        and the rate in emails per second.
+    """
+    started = time.perf_counter()
+    sent = failed = 0
+    connection = None
+    connected = True
+    try:
+        while connected:
+            with transaction.atomic():
+                now = timezone.now()
+                emails = list(OutboxEmail.objects.select_for_update(skip_locked=True).filter(
+                    sent_at__isnull=True, send_after__lte=now, attempts__lt=OUTBOX_MAX_ATTEMPTS,
+                ).order_by('send_after')[:batch_size])
+                if not emails:
+                    break
+                tried = []
+                try:
+                    if connection is None:
+                        connection = get_connection()
+                        connection.open()
+                    for email in emails:
+                        message = EmailMessage(email.subject, email.body, email.from_email, [email.recipient])
+                        try:
+                            connection.send_messages([message])
+                        except MESSAGE_ERRORS as e:
+                            _failed(email, e, now)
+                            failed += 1
+                        else:
+                            email.sent_at = now
+                            sent += 1
+                        tried.append(email)
+                except (smtplib.SMTPException, OSError):
+                    logger.exception('Lost the connection to the mail server, %d emails left for the next run',
+                                     len(emails) - len(tried))
+                    connected = False
+                OutboxEmail.objects.bulk_update(tried, ['sent_at', 'attempts', 'last_error', 'send_after'])
+    finally:
+        if connection is not None:
+            connection.close()
+
+    seconds = time.perf_counter() - started
+    stats = {'sent': sent, 'failed': failed, 'seconds': round(seconds, 3),
+             'rate': round(sent / seconds, 1) if sent else 0.0}
+    if sent or failed:
+        logger.info('Outbox: %(sent)d emails sent, %(failed)d failed in %(seconds)ss (%(rate)s/s)', stats)
+        cache.set(OUTBOX_STATS_KEY, {**stats, 'finished': timezone.now()}, None)
+    return stats
+
+
+def outbox_stats():
+    """
+    Returns the number of emails waiting in the outbox and the stats of the
+    last run of send_outbox that sent anything.
+    """
+    return {
+        'pending': OutboxEmail.objects.filter(
+            sent_at__isnull=True, attempts__lt=OUTBOX_MAX_ATTEMPTS).count(),
+        'last_run': cache.get(OUTBOX_STATS_KEY),
+    }
@@ -0,0 +1,162 @@
+import datetime
+
+from django.db import transaction
+from django.db.models import Count, DecimalField, F, Q, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from .models import DailySales, Order, OrderItem, ProductDailySales, ProductSales, RollupWatermark
+
+SALES_WATERMARK = 'sales'
+# Orders committed by transactions that started before a run are caught by the next one.
+ROLLUP_OVERLAP = datetime.timedelta(minutes=5)
+ROLLUP_DAYS_PER_BATCH = 31
+ROLLUP_PRODUCTS_PER_BATCH = 1000
+
+_REVENUE = DecimalField(max_digits=14, decimal_places=2)
+
+
+def _placed_on(days, prefix=''):
+    """
+    Returns the condition on created for the given local days, as ranges
+    the index on created serves.
+    """
+    condition = Q()
+    for day in days:
+        start = timezone.make_aware(datetime.datetime.combine(day, datetime.time.min))
+        end = timezone.make_aware(datetime.datetime.combine(day + datetime.timedelta(days=1), datetime.time.min))
+        condition |= Q(**{f'{prefix}created__gte': start, f'{prefix}created__lt': end})
+    return condition
+
+
+def changed_days(since):
+    """
+    Returns the days on which the orders changed since a moment were placed.
+
+    Args:
+        since (datetime): The moment, or None for the days of every order.
+    """
+    orders = Order.objects.order_by()
+    if since is not None:
+        orders = orders.filter(updated__gte=since)
+    return sorted(orders.annotate(day=TruncDate('created')).values_list('day', flat=True).distinct())
+
+
+def roll_up_days(days):
+    """
+    Recomputes the DailySales and ProductDailySales of some days from the
+    paid orders placed on them, then the ProductSales of their products.
+
+    Only the orders and items of those days are read, through the index on
+    created, and recomputing a day twice gives the same rows.
+    """
+    orders = Order.objects.filter(_placed_on(days), paid=True).order_by()
+    items = OrderItem.objects.filter(_placed_on(days, 'order__'), order__paid=True).order_by().annotate(
+        day=TruncDate('order__created'))
+
+    daily = {
+        row['day']: DailySales(date=row['day'], orders=row['orders'], revenue=row['revenue'])
+        for row in orders.annotate(day=TruncDate('created')).values('day').annotate(
+            orders=Count('id'), revenue=Sum('total'))
+    }
+    for row in items.values('day').annotate(items=Count('id'), units=Sum('quantity'), price_sum=Sum('price')):
+        sales = daily.setdefault(row['day'], DailySales(date=row['day']))
+        sales.items, sales.units, sales.price_sum = row['items'], row['units'], row['price_sum']
+    product_daily = [
+        ProductDailySales(product_id=row['product_id'], date=row['day'], units=row['units'], revenue=row['revenue'])
+        for row in items.filter(product__isnull=False).values('day', 'product_id').annotate(
+            units=Sum('quantity'), revenue=Sum(F('price') * F('quantity'), output_field=_REVENUE))
+    ]
+
+    product_ids = set(ProductDailySales.objects.filter(date__in=days).values_list('product_id', flat=True))
+    product_ids.update(sales.product_id for sales in product_daily)
+    DailySales.objects.filter(date__in=days).delete()
+    ProductDailySales.objects.filter(date__in=days).delete()
+    DailySales.objects.bulk_create(daily.values())
+    ProductDailySales.objects.bulk_create(product_daily, batch_size=1000)
+    roll_up_products(product_ids)
+
+
+def roll_up_products(product_ids):
+    """
+    Recomputes the ProductSales of some products from their ProductDailySales.
+    """
+    product_ids = list(product_ids)
+    for i in range(0, len(product_ids), ROLLUP_PRODUCTS_PER_BATCH):
+        batch = product_ids[i:i + ROLLUP_PRODUCTS_PER_BATCH]
+        totals = ProductDailySales.objects.filter(product_id__in=batch).order_by().values('product_id').annotate(
+            units=Sum('units'), revenue=Sum('revenue'))
+        ProductSales.objects.filter(product_id__in=batch).delete()
+        ProductSales.objects.bulk_create([ProductSales(**row) for row in totals])
+
+
+def update_sales_rollups():
+    """
+    Rolls up the orders changed since the last run.
+
+    Runs are serialized by a lock on the watermark, which moves to the start
+    of the run, less ROLLUP_OVERLAP, once the days of the changed orders are
+    recomputed. Deleted orders are only accounted for once their day is
+    recomputed for another reason, or by rebuild_sales_rollups.
+
+    Returns:
+        int: The number of days recomputed.
+    """
+    started = timezone.now()
+    with transaction.atomic():
+        watermark, _ = RollupWatermark.objects.select_for_update().get_or_create(name=SALES_WATERMARK)
+        days = changed_days(watermark.value)
+        for i in range(0, len(days), ROLLUP_DAYS_PER_BATCH):
+            roll_up_days(days[i:i + ROLLUP_DAYS_PER_BATCH])
+        watermark.value = started - ROLLUP_OVERLAP
+        watermark.save(update_fields=['value'])
+    return len(days)
+
+
+def rebuild_sales_rollups():
+    """
+    Recomputes every sales rollup, e.g. after orders were deleted or
+    imported with past timestamps.
+
+    Returns:
+        int: The number of days with orders.
+    """
+    with transaction.atomic():
+        RollupWatermark.objects.filter(name=SALES_WATERMARK).delete()
+        DailySales.objects.all().delete()
+        ProductDailySales.objects.all().delete()
+        ProductSales.objects.all().delete()
+        return update_sales_rollups()
+
+
+def get_daily_sales(days=30):
+    """
+    Returns the DailySales of the last days, oldest first, with a row for
+    every day, whether it had sales or not.
+    """
+    today = timezone.localdate()
+    first = today - datetime.timedelta(days=days - 1)
+    sales = {row.date: row for row in DailySales.objects.filter(date__gte=first)}
+    return [sales.get(first + datetime.timedelta(days=i), DailySales(date=first + datetime.timedelta(days=i)))
+            for i in range(days)]
+
+
+def get_best_sellers(days=None, limit=10):
+    """
+    Returns the products that sold the most units.
+
+    Args:
+        days (int): The number of last days to consider, None for all time.
+        limit (int): The number of products.
+
+    Returns:
+        list: dicts with the product_id, product__title, units and revenue.
+    """
+    if days is None:
+        rows = ProductSales.objects.all()
+    else:
+        rows = ProductDailySales.objects.filter(
+            date__gte=timezone.localdate() - datetime.timedelta(days=days - 1),
+        ).values('product_id', 'product__title').annotate(units=Sum('units'), revenue=Sum('revenue'))
+    return list(rows.order_by('-units', 'product_id').values(
+        'product_id', 'product__title', 'units', 'revenue')[:limit])
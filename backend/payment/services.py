@@ -0,0 +1,104 @@
+from django.core.cache import cache
+from django.db import transaction
+
+from .gateways import PaymentError, PaymentLine, get_gateway
+from .inventory import release_order_stock, reserve_stock
+from .models import Order, OrderItem
+
+CHECKOUT_TIMEOUT = 60 * 60
+
+
+def place_order(cart, shipping_address, user=None):
+    """
+    Creates an order and all of its items from the cart in one transaction.
+
+    The amount is summed from the cart lines, which are already priced at
+    the current prices, so the order costs two INSERTs whatever its size and
+    a failure leaves no partial order behind. The stock of the products is
+    reserved in the same transaction.
+
+    Args:
+        cart (Cart): The cart of the customer.
+        shipping_address (ShippingAddress): The address to ship the order to,
+            saved with the order if it is not saved yet.
+        user (User): The customer, or None for a guest checkout.
+
+    Raises:
+        ValueError: If the cart has no line that can be ordered.
+        OutOfStock: If a product has less stock left than ordered.
+
+    Returns:
+        Order: The created order.
+    """
+    lines = list(cart)
+    if not lines:
+        raise ValueError('The cart is empty.')
+
+    with transaction.atomic():
+        if shipping_address is not None and shipping_address._state.adding:
+            shipping_address.save()
+        subtotal = sum(line.total for line in lines)
+        order = Order.objects.create(
+            user=user, shipping_address=shipping_address, amount=subtotal, subtotal=subtotal)
+        OrderItem.objects.bulk_create([
+            OrderItem(order=order, product=line.product, price=line.price, quantity=line.qty, user=user)
+            for line in lines
+        ])
+        reserve_stock(order, {line.product.pk: line.qty for line in lines})
+    return order
+
+
+def start_payment(provider, order, lines, success_url, cancel_url):
+    """
+    Creates the payment of a placed order with a provider, giving the
+    reserved stock back if the provider fails.
+
+    Args:
+        provider (str): The provider name, "stripe" or "yookassa".
+        order (Order): The placed order.
+        lines (list): The PaymentLine of every item of the order.
+        success_url (str): Where the provider sends the customer once paid.
+        cancel_url (str): Where the provider sends the customer otherwise.
+
+    Raises:
+        PaymentError: If the provider is unreachable or refuses the payment.
+
+    Returns:
+        Checkout: The created payment.
+    """
+    try:
+        return get_gateway(provider).create_payment(order, lines, success_url, cancel_url)
+    except PaymentError:
+        release_order_stock(order.id)
+        raise
+
+
+def _checkout_key(order_id):
+    return f'payment:checkout:{order_id}'
+
+
+def start_payment_for_order(provider, order_id, success_url, cancel_url):
+    """
+    Creates the payment of a placed order outside the request and stores the
+    outcome for get_checkout_status.
+    """
+    order = Order.objects.get(pk=order_id)
+    lines = [PaymentLine(*values) for values in order.items.values_list('product__title', 'price', 'quantity')]
+    try:
+        checkout = start_payment(provider, order, lines, success_url, cancel_url)
+        status = {'status': 'ready', 'url': checkout.url}
+    except PaymentError:
+        status = {'status': 'failed'}
+    cache.set(_checkout_key(order_id), status, CHECKOUT_TIMEOUT)
+    return status
+
+
+def get_checkout_status(order_id):
+    """
+    Returns the outcome of a payment created by start_payment_for_order.
+
+    Returns:
+        dict: {"status": "pending"}, {"status": "failed"} or
+        {"status": "ready", "url": <the provider's page>}.
+    """
+    return cache.get(_checkout_key(order_id), {'status': 'pending'})
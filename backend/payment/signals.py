@@ -1,9 +1,9 @@
 
 from django.contrib.auth import get_user_model
-from django.db.models.signals import post_save
+from django.db.models.signals import post_delete, post_save
 from django.dispatch import receiver
 
-from .models import ShippingAddress
+from .models import Order, OrderItem, ShippingAddress
 
 User = get_user_model()
 
@@ -11,4 +11,11 @@ User = get_user_model()
 def create_default_shipping_address(sender, instance, created, **kwargs):
     if created:
         if not ShippingAddress.objects.filter(user=instance).exists():
-            ShippingAddress.create_default_shipping_address(user=instance)
\ No newline at end of file
+            ShippingAddress.create_default_shipping_address(user=instance)
+
+
+@receiver(post_save, sender=OrderItem)
+@receiver(post_delete, sender=OrderItem)
+def order_item_changed(sender, instance, **kwargs):
+    if instance.order_id:
+        Order.objects.filter(pk=instance.order_id).update_totals()
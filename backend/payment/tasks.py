@@ -1,20 +1,108 @@
-from celery import shared_task
-from django.conf import settings
-from django.core.mail import send_mail
+from celery import group, shared_task
+from django.contrib.auth import get_user_model
+from django.urls import reverse
 
-from .models import Order, ShippingAddress
+from .exports import write_orders_csv_gz
+from .inventory import release_expired_stock
+from .invoices import INVOICE_BATCH_SIZE, generate_invoices, missing_invoices
+from .models import Order
+from .outbox import queue_email, queue_order_confirmations, send_outbox
+from .rollups import update_sales_rollups
+from .services import start_payment_for_order
+from .webhooks import apply_webhook_events
+
+
+@shared_task
+def process_webhook_events():
+    """
+    Applies the webhook events received since the last run.
+    """
+    return apply_webhook_events()
+
+
+@shared_task
+def create_payment(provider, order_id, success_url, cancel_url):
+    """
+    Creates the payment of an order with its provider, so that a slow
+    provider holds a Celery worker instead of a web worker.
+    """
+    return start_payment_for_order(provider, order_id, success_url, cancel_url)
+
+
+@shared_task
+def release_expired_reservations():
+    """
+    Gives back the stock of orders left unpaid past PAYMENT_RESERVATION_TIMEOUT.
+    """
+    return release_expired_stock()
+
+
+@shared_task
+def export_orders(filters, name, user_id, base_url):
+    """
+    Writes the orders of an admin selection to a gzipped CSV file and emails
+    the staff member who asked for it a link to download it.
+
+    Args:
+        filters (dict): The lookups selecting the orders to export, from
+            exports.changelist_filters or {"pk__in": ids} for a few orders.
+        name (str): The name of the file to write.
+        user_id (int): The id of the staff member to notify.
+        base_url (str): The scheme and host the link points to.
+    """
+    path = write_orders_csv_gz(Order.objects.filter(**filters), name)
+    url = base_url.rstrip('/') + reverse('payment:admin-order-export', args=[path.rsplit('/', 1)[-1]])
+    user = get_user_model().objects.get(pk=user_id)
+    if user.email:
+        queue_email(f'Order export {name} is ready',
+                    f'Your order export is ready, download it at {url}', user.email)
+    return path
+
+
+@shared_task
+def roll_up_sales():
+    """
+    Brings the sales rollups up to date with the orders changed since the last run.
+    """
+    return update_sales_rollups()
+
+
+@shared_task
+def render_invoices(order_ids):
+    """
+    Renders and stores the missing invoices of several orders in parallel,
+    one render_invoice_batch subtask per INVOICE_BATCH_SIZE orders, since
+    rendering a PDF is CPU bound.
+
+    Returns:
+        int: The number of batches queued.
+    """
+    missing = missing_invoices(order_ids)
+    batches = [missing[i:i + INVOICE_BATCH_SIZE] for i in range(0, len(missing), INVOICE_BATCH_SIZE)]
+    if batches:
+        group([render_invoice_batch.s(batch) for batch in batches]).apply_async()
+    return len(batches)
+
+
+@shared_task
+def render_invoice_batch(order_ids):
+    """
+    Renders and stores the missing invoices of a batch of orders.
+    """
+    return generate_invoices(order_ids)
+
+
+@shared_task
+def send_outbox_emails():
+    """
+    Sends the emails waiting in the outbox.
+    """
+    return send_outbox()
 
 
 @shared_task()
 def send_order_confirmation(order_id):
-    
-    order = Order.objects.get(id=order_id)
-    subject = f'Order {order.id} payment Confirmation'
-    receipent_data = ShippingAddress.objects.get(user=order.user)
-    receipent_email = receipent_data.email
-    message = f'Your order and payment has been confirmed. Your order number is {order.id}.'
-
-    mail_to_sender = send_mail(
-        subject,message=message,from_email=settings.EMAIL_HOST_USER, recipient_list=[receipent_email],
-    )
-    return mail_to_sender
\ No newline at end of file
+    """
+    Queues the payment confirmation of an order in the outbox.
+    """
+    return len(queue_order_confirmations([order_id]))
@@ -1,3 +1,816 @@
-from django.test import TestCase
+import csv
+import datetime
+import gzip
+import hashlib
+import hmac
+import json
+import os
+import re
+import smtplib
+import tempfile
+import threading
+import time
+from datetime import timedelta
+from decimal import Decimal
+from types import SimpleNamespace
+from unittest import mock
 
-# Create your tests here.
+import stripe
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.sessions.middleware import SessionMiddleware
+from django.core import mail
+from django.core.mail import get_connection
+from django.core.cache import cache
+from django.core.files.storage import default_storage
+from django.db import connection
+from django.test import RequestFactory, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from cart.cart import Cart
+from shop.models import Category, ProductProxy
+
+from .exports import stream_orders_csv
+from .fake_provider import make_server
+from .gateways import PaymentError, PaymentLine, get_gateway, get_http_session
+from .inventory import OutOfStock, commit_stock, release_expired_stock, restock
+from .invoices import generate_invoices, get_invoice, get_stylesheet, invoice_name, invoice_orders, render_invoice
+from .models import (DailySales, Order, OrderItem, OutboxEmail, ProductDailySales, RollupWatermark,
+                     ShippingAddress, StockReservation, WebhookEvent)
+from .outbox import OUTBOX_MAX_ATTEMPTS, outbox_stats, queue_email, queue_order_confirmations, send_outbox
+from .rollups import get_best_sellers, rebuild_sales_rollups, update_sales_rollups
+from .services import get_checkout_status, place_order, start_payment_for_order
+from .tasks import export_orders, process_webhook_events, release_expired_reservations, render_invoices
+
+User = get_user_model()
+
+
+class PlaceOrderTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        category = Category.objects.create(name='Category 1')
+        self.products = [
+            ProductProxy.objects.create(title=f'Product {index}', slug=f'product-{index}',
+                                        price=10, discount=index * 10, category=category)
+            for index in range(3)
+        ]
+        self.user = User.objects.create_user('customer', 'customer@example.com', 'password')
+        self.address = ShippingAddress.objects.get(user=self.user)
+        self.request = RequestFactory().get('/')
+        SessionMiddleware(lambda request: None).process_request(self.request)
+        self.cart = Cart(self.request)
+        for product in self.products:
+            self.cart.add(product=product, quantity=2)
+
+    def test_order_and_items_in_two_inserts(self):
+        cart = Cart(self.request)
+        list(cart)
+        with self.assertNumQueries(5):
+            order = place_order(cart, self.address, self.user)
+
+        self.assertEqual(order.amount, Decimal('54.00'))
+        self.assertEqual(
+            sorted(order.items.values_list('product_id', 'price', 'quantity', 'user_id')),
+            [(product.pk, product.get_discounted_price(), 2, self.user.pk) for product in self.products])
+
+    def test_failure_leaves_no_partial_order(self):
+        with mock.patch.object(OrderItem.objects, 'bulk_create', side_effect=RuntimeError):
+            with self.assertRaises(RuntimeError):
+                place_order(Cart(self.request), self.address, self.user)
+        self.assertFalse(Order.objects.exists())
+
+    def test_empty_cart(self):
+        self.cart.clear()
+        with self.assertRaises(ValueError):
+            place_order(Cart(self.request), self.address, self.user)
+
+    def test_complete_order_with_stripe(self):
+        self.client.force_login(self.user)
+        for product in self.products:
+            self.client.post(reverse('cart:add-to-cart'), {
+                'action': 'post', 'product_id': product.pk, 'product_qty': 1})
+
+        session = SimpleNamespace(id='cs_test', url='https://checkout.invalid/session')
+        with mock.patch('stripe.checkout.Session.create', return_value=session) as create:
+            response = self.client.post(reverse('payment:complete-order'), {'stripe-payment': 'stripe-payment'})
+
+        self.assertRedirects(response, session.url, fetch_redirect_response=False)
+        order = Order.objects.get()
+        self.assertEqual((order.amount, order.items.count()), (Decimal('27.00'), 3))
+        self.assertEqual(create.call_args.kwargs['client_reference_id'], order.id)
+        self.assertGreaterEqual(create.call_args.kwargs['expires_at'],
+                                (timezone.now() + timedelta(minutes=30)).timestamp())
+        self.assertEqual(sorted(item['price_data']['unit_amount'] for item in create.call_args.kwargs['line_items']),
+                         [800, 900, 1000])
+
+    def test_guest_checkout_form(self):
+        values = {'full_name': 'Guest', 'email': 'guest@example.com', 'street_address': 'Street',
+                  'apartment_address': '1', 'country': 'Country', 'zip': '12345'}
+        page = self.client.get(reverse('payment:checkout')).content.decode()
+        form = re.search(r'<form id="form".*?</form>', page, re.DOTALL).group()
+        names = re.findall(r'<input[^>]* name="(\w+)"', form)
+        self.assertEqual(set(names) - {'csrfmiddlewaretoken'}, set(values))
+        data = {'stripe-payment': 'stripe-payment', **{name: values[name] for name in names if name in values}}
+
+        response = self.client.post(reverse('payment:complete-order'), {**data, 'email': 'not an email'})
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'class="errorlist"')
+        response = self.client.post(reverse('payment:complete-order'), data)
+        self.assertRedirects(response, reverse('cart:cart-view'), fetch_redirect_response=False)
+        self.assertFalse(ShippingAddress.objects.filter(user=None).exists())
+
+        self.client.post(reverse('cart:add-to-cart'), {
+            'action': 'post', 'product_id': self.products[0].pk, 'product_qty': 1})
+        session = SimpleNamespace(id='cs_test', url='https://checkout.invalid/session')
+        with mock.patch('stripe.checkout.Session.create', return_value=session):
+            response = self.client.post(reverse('payment:complete-order'), data)
+        self.assertRedirects(response, session.url, fetch_redirect_response=False)
+        address = Order.objects.get().shipping_address
+        self.assertEqual({name: getattr(address, name) for name in values}, values)
+
+
+class StockReservationTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        category = Category.objects.create(name='Category 1')
+        self.product = ProductProxy.objects.create(
+            title='Limited', slug='limited', price=10, stock=3, category=category)
+        self.untracked = ProductProxy.objects.create(
+            title='Untracked', slug='untracked', price=5, category=category)
+        self.request = RequestFactory().get('/')
+        SessionMiddleware(lambda request: None).process_request(self.request)
+
+    def order(self, quantity):
+        cart = Cart(self.request)
+        cart.clear()
+        cart.add(product=self.product, quantity=quantity)
+        cart.add(product=self.untracked, quantity=1)
+        return place_order(Cart(self.request), None)
+
+    def stock(self):
+        self.product.refresh_from_db(fields=['stock'])
+        return self.product.stock
+
+    def test_reservation_takes_stock(self):
+        order = self.order(2)
+        self.assertEqual(self.stock(), 1)
+        self.assertEqual(list(order.reservations.values_list('product_id', 'quantity')), [(self.product.pk, 2)])
+        self.untracked.refresh_from_db(fields=['stock'])
+        self.assertIsNone(self.untracked.stock)
+
+        with self.assertRaises(OutOfStock) as raised:
+            self.order(2)
+        self.assertEqual(raised.exception.product_ids, [self.product.pk])
+        self.assertEqual((Order.objects.count(), self.stock()), (1, 1))
+
+    def test_expired_reservations_are_released(self):
+        paid = self.order(1)
+        Order.objects.filter(pk=paid.pk).update(paid=True)
+        self.order(1)
+        StockReservation.objects.update(expires_at=timezone.now() - timedelta(seconds=1))
+
+        self.assertEqual(release_expired_reservations(), 1)
+        self.assertEqual(self.stock(), 2)
+        self.assertEqual(release_expired_stock(), 0)
+        self.assertEqual(commit_stock([paid.pk]), 1)
+        self.assertFalse(StockReservation.objects.exists())
+
+    def test_failed_payment_releases_stock(self):
+        self.client.post(reverse('cart:add-to-cart'), {
+            'action': 'post', 'product_id': self.product.pk, 'product_qty': 3})
+        session = SimpleNamespace(id='cs_test', url='https://checkout.invalid/session')
+        with mock.patch('stripe.checkout.Session.create', return_value=session) as create:
+            self.client.post(reverse('payment:complete-order'), {
+                'stripe-payment': 'stripe-payment', 'full_name': 'Guest', 'email': 'guest@example.com',
+                'street_address': 'Street', 'apartment_address': '1'})
+        self.assertEqual(self.stock(), 0)
+
+        cancel_url = create.call_args.kwargs['cancel_url']
+        self.client.get(cancel_url.replace('order=', 'order=forged'))
+        self.assertEqual(self.stock(), 0)
+        self.client.get(cancel_url)
+        self.assertEqual(self.stock(), 3)
+        self.assertFalse(StockReservation.objects.exists())
+
+    def test_saves_and_restocks_keep_reservations(self):
+        loaded = ProductProxy.objects.get(pk=self.product.pk)
+        self.order(2)
+        loaded.title = 'Renamed'
+        loaded.save()
+        self.assertEqual(self.stock(), 1)
+
+        self.assertEqual(restock({self.product.pk: 4}), 1)
+        self.assertEqual(self.stock(), 5)
+
+    def test_restock_starts_tracking_stock(self):
+        self.assertEqual(restock({self.untracked.pk: 2}), 1)
+        self.untracked.refresh_from_db(fields=['stock'])
+        self.assertEqual(self.untracked.stock, 2)
+
+        order = self.order(1)
+        self.assertEqual(sorted(order.reservations.values_list('product_id', 'quantity')),
+                         sorted([(self.product.pk, 1), (self.untracked.pk, 1)]))
+        self.untracked.refresh_from_db(fields=['stock'])
+        self.assertEqual(self.untracked.stock, 1)
+
+    def test_admin_restock(self):
+        self.client.force_login(User.objects.create_superuser('admin', 'admin@example.com', 'password'))
+        change_url = reverse('admin:shop_product_change', args=[self.product.pk])
+        self.assertNotContains(self.client.get(change_url), 'name="stock"')
+
+        url = reverse('admin:shop_product_changelist')
+        data = {'action': 'restock_products', '_selected_action': [self.product.pk]}
+        self.assertContains(self.client.post(url, data), 'name="quantity"')
+        self.assertEqual(self.stock(), 3)
+        response = self.client.post(url, {**data, 'apply': 'Restock', 'quantity': 2})
+        self.assertRedirects(response, url)
+        self.assertEqual(self.stock(), 5)
+
+
+@override_settings(PAYMENT_HTTP_BACKOFF=0)
+class PaymentGatewayTest(TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        get_http_session.cache_clear()
+        cls.server = make_server()
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+        cls.url = f'http://{cls.server.server_address[0]}:{cls.server.server_address[1]}'
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+        get_http_session.cache_clear()
+        super().tearDownClass()
+
+    def setUp(self):
+        cache.clear()
+        self.server.failures = 0
+        category = Category.objects.create(name='Category 1')
+        self.product = ProductProxy.objects.create(
+            title='Example Product', slug='example-product', price=10, stock=5, category=category)
+        self.order = Order.objects.create(amount=Decimal('20.00'))
+        self.order.items.create(product=self.product, price=Decimal('10.00'), quantity=2)
+        self.lines = [PaymentLine('Example Product', Decimal('10.00'), 2)]
+
+    def create_payment(self, provider):
+        with mock.patch.object(stripe, 'api_base', self.url), \
+                override_settings(PAYMENT_YOOKASSA_API_BASE=f'{self.url}/v3'):
+            return get_gateway(provider).create_payment(
+                self.order, self.lines, 'http://testserver/success/', 'http://testserver/failed/')
+
+    def test_providers_through_the_pooled_session(self):
+        for provider in ('stripe', 'yookassa'):
+            with self.subTest(provider=provider):
+                checkout = self.create_payment(provider)
+                self.assertTrue(checkout.url.startswith(f'{self.url}/pay/'))
+                self.assertEqual(self.create_payment(provider), checkout)
+
+    def test_yookassa_payment_is_read_back(self):
+        checkout = self.create_payment('yookassa')
+        with override_settings(PAYMENT_YOOKASSA_API_BASE=f'{self.url}/v3'):
+            payment = get_gateway('yookassa').get_payment(checkout.payment_id)
+            self.assertEqual(payment['amount'], {'value': '1860.00', 'currency': 'RUB'})
+            self.assertEqual(payment['metadata'], {'order_id': self.order.id})
+            with self.assertRaises(PaymentError):
+                get_gateway('yookassa').get_payment('unknown')
+
+    def test_failures_are_retried_then_reported(self):
+        self.server.failures = 2
+        self.assertTrue(self.create_payment('yookassa').payment_id)
+
+        for provider in ('stripe', 'yookassa'):
+            with self.subTest(provider=provider):
+                self.server.failures = 3
+                with self.assertRaises(PaymentError):
+                    self.create_payment(provider)
+
+    def test_async_checkout(self):
+        self.server.failures = 3
+        with override_settings(PAYMENT_YOOKASSA_API_BASE=f'{self.url}/v3'):
+            status = start_payment_for_order('yookassa', self.order.id, 'http://testserver/success/', '')
+        self.assertEqual(status, {'status': 'failed'})
+
+        order = Order.objects.create(amount=Decimal('10.00'))
+        self.assertEqual(get_checkout_status(order.id), {'status': 'pending'})
+        with mock.patch.object(stripe, 'api_base', self.url):
+            start_payment_for_order('stripe', order.id, 'http://testserver/success/', '')
+        self.assertEqual(get_checkout_status(order.id)['status'], 'ready')
+
+    @override_settings(PAYMENT_ASYNC=True)
+    def test_complete_order_redirects_to_the_pending_page(self):
+        self.client.post(reverse('cart:add-to-cart'), {
+            'action': 'post', 'product_id': self.product.pk, 'product_qty': 1})
+        with mock.patch('payment.views.create_payment.delay') as delay, \
+                self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(reverse('payment:complete-order'), {
+                'stripe-payment': 'stripe-payment', 'full_name': 'Guest', 'email': 'guest@example.com',
+                'street_address': 'Street', 'apartment_address': '1'})
+
+        self.assertTrue(response.url.startswith(reverse('payment:payment-pending')))
+        self.assertEqual(delay.call_args.args[:2], ('stripe', Order.objects.latest('id').id))
+        status_url = response.url.replace(reverse('payment:payment-pending'), reverse('payment:payment-status'))
+        self.assertEqual(self.client.get(status_url).json(), {'status': 'pending'})
+        self.assertEqual(self.client.get(reverse('payment:payment-status') + '?order=1').status_code, 404)
+
+
+class WebhookTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        category = Category.objects.create(name='Category 1')
+        product = ProductProxy.objects.create(
+            title='Limited', slug='limited', price=10, stock=1, category=category)
+        address = ShippingAddress.objects.create(
+            full_name='Guest', email='guest@example.com', street_address='Street', apartment_address='1')
+        self.order = Order.objects.create(amount=Decimal('10.00'), shipping_address=address)
+        StockReservation.objects.create(order=self.order, product=product, quantity=1,
+                                        expires_at=timezone.now())
+
+    def post_stripe(self, event_id, order_id):
+        payload = json.dumps({
+            'id': event_id, 'object': 'event', 'type': 'checkout.session.completed',
+            'data': {'object': {'object': 'checkout.session', 'mode': 'payment',
+                                'payment_status': 'paid', 'client_reference_id': str(order_id)}},
+        })
+        timestamp = int(time.time())
+        signature = hmac.new(settings.STRIPE_WEBHOOK_SECRET.encode(), f'{timestamp}.{payload}'.encode(),
+                             hashlib.sha256).hexdigest()
+        return self.client.post(reverse('payment:webhook-stripe'), payload, content_type='application/json',
+                                HTTP_STRIPE_SIGNATURE=f't={timestamp},v1={signature}')
+
+    @mock.patch('payment.webhooks._enqueue')
+    def test_deliveries_are_stored_once(self, enqueue):
+        with self.captureOnCommitCallbacks(execute=True):
+            for _ in range(2):
+                self.assertEqual(self.post_stripe('evt_1', self.order.id).status_code, 200)
+        self.assertEqual(WebhookEvent.objects.count(), 1)
+        enqueue.assert_called_once()
+        self.assertFalse(Order.objects.get().paid)
+
+        response = self.client.post(reverse('payment:webhook-stripe'), '{}', content_type='application/json',
+                                    HTTP_STRIPE_SIGNATURE='t=1,v1=forged')
+        self.assertEqual(response.status_code, 400)
+
+    def post_yookassa(self, payment_id, order_id, **extra):
+        return self.client.post(reverse('payment:webhook-yookassa'), {
+            'type': 'notification', 'event': 'payment.succeeded',
+            'object': {'id': payment_id, 'status': 'succeeded', 'metadata': {'order_id': order_id}},
+        }, content_type='application/json', **extra)
+
+    def yookassa_payment(self, status='succeeded', amount='930.00'):
+        return {'id': 'payment-1', 'status': status, 'amount': {'value': amount, 'currency': 'RUB'},
+                'metadata': {'order_id': str(self.order.id)}}
+
+    @mock.patch('payment.webhooks._enqueue')
+    def test_yookassa_is_trusted_by_the_proxied_address_only(self, enqueue):
+        # 185.71.76.1 is one of the addresses YooKassa sends notifications from.
+        with override_settings(PAYMENT_TRUSTED_PROXIES=0):
+            response = self.post_yookassa('payment-1', self.order.id, HTTP_X_FORWARDED_FOR='185.71.76.1')
+            self.assertEqual(response.status_code, 400)
+        response = self.post_yookassa('payment-1', self.order.id, HTTP_X_FORWARDED_FOR='185.71.76.1, 203.0.113.7')
+        self.assertEqual(response.status_code, 400)
+        response = self.post_yookassa('payment-1', self.order.id, HTTP_X_FORWARDED_FOR='185.71.76.1')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(WebhookEvent.objects.count(), 1)
+
+    @override_settings(PAYMENT_YOOKASSA_VERIFY_IP=False)
+    @mock.patch('payment.webhooks._enqueue')
+    def test_yookassa_payments_are_confirmed_with_the_api(self, enqueue):
+        self.post_yookassa('payment-1', self.order.id)
+        with mock.patch('payment.gateways.YooKassaGateway.get_payment', side_effect=PaymentError('down')), \
+                self.assertLogs('payment.webhooks', 'ERROR'):
+            self.assertEqual(process_webhook_events(), 0)
+        self.assertFalse(WebhookEvent.objects.get().processed_at)
+
+        # The API is called before the batch transaction opens, so no row lock
+        # is held while waiting on YooKassa.
+        savepoints = len(connection.savepoint_ids)
+        def get_payment(payment_id):
+            self.assertEqual(len(connection.savepoint_ids), savepoints)
+            return self.yookassa_payment()
+        with mock.patch('payment.gateways.YooKassaGateway.get_payment', side_effect=get_payment), \
+                self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(process_webhook_events(), 1)
+        self.assertTrue(Order.objects.get().paid)
+        Order.objects.update(paid=False)
+
+        for payment in (self.yookassa_payment(status='pending'), self.yookassa_payment(amount='1.00')):
+            WebhookEvent.objects.update(processed_at=None)
+            with mock.patch('payment.gateways.YooKassaGateway.get_payment', return_value=payment), \
+                    self.assertLogs('payment.webhooks', 'WARNING'):
+                self.assertEqual(process_webhook_events(), 1)
+            self.assertFalse(Order.objects.get().paid)
+
+    @override_settings(PAYMENT_YOOKASSA_VERIFY_IP=False)
+    @mock.patch('payment.webhooks._enqueue')
+    def test_events_are_applied_once_per_order(self, enqueue):
+        self.post_stripe('evt_1', self.order.id)
+        self.post_stripe('evt_2', self.order.id)
+        self.post_yookassa('payment-1', self.order.id)
+
+        with self.captureOnCommitCallbacks(execute=True), \
+                mock.patch('payment.gateways.YooKassaGateway.get_payment', return_value=self.yookassa_payment()):
+            self.assertEqual(process_webhook_events(), 3)
+        self.assertTrue(Order.objects.get().paid)
+        self.assertFalse(StockReservation.objects.exists())
+        self.assertEqual(OutboxEmail.objects.get().recipient, 'guest@example.com')
+
+        self.post_stripe('evt_1', self.order.id)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(process_webhook_events(), 0)
+        self.assertEqual(OutboxEmail.objects.count(), 1)
+
+    @mock.patch('payment.webhooks._enqueue')
+    def test_payments_after_release_take_stock_again(self, enqueue):
+        product = StockReservation.objects.get().product
+        StockReservation.objects.all().delete()
+        orders = [self.order, Order.objects.create(amount=Decimal('10.00'))]
+        for order in orders:
+            order.items.create(product=product, price=Decimal('10.00'), quantity=1)
+            self.post_stripe(f'evt_{order.id}', order.id)
+
+        with self.assertLogs('payment.inventory', 'ERROR'):
+            self.assertEqual(process_webhook_events(), 2)
+        product.refresh_from_db()
+        self.assertEqual(product.stock, 0)
+        self.assertEqual(list(Order.objects.filter(paid=True).order_by('pk').values_list('out_of_stock', flat=True)),
+                         [False, True])
+
+
+class OrderTotalsTest(TestCase):
+
+    def setUp(self):
+        category = Category.objects.create(name='Category 1')
+        self.product = ProductProxy.objects.create(title='Product', slug='product', price=10, category=category)
+        self.order = Order.objects.create(amount=0)
+
+    def assertTotals(self, subtotal, discount_amount, total):
+        order = Order.objects.get(pk=self.order.pk)
+        self.assertEqual((order.subtotal, order.discount_amount, order.total),
+                         (Decimal(subtotal), Decimal(discount_amount), Decimal(total)))
+
+    def test_totals_follow_items_and_discount(self):
+        item = self.order.items.create(product=self.product, price=Decimal('10.05'), quantity=2)
+        self.order.items.create(product=self.product, price=Decimal('3.00'), quantity=1)
+        self.assertTotals('23.10', '0', '23.10')
+
+        stale = Order.objects.get(pk=self.order.pk)
+        item.quantity = 3
+        item.save()
+        stale.discount = 15
+        stale.save()
+        self.assertTotals('33.15', '4.97', '28.18')
+
+        item.delete()
+        self.assertTotals('3.00', '0.45', '2.55')
+
+    def test_listing_annotations(self):
+        self.order.items.create(product=self.product, price=Decimal('10.00'), quantity=2)
+        empty = Order.objects.create(amount=0)
+        with self.assertNumQueries(1):
+            orders = {order.pk: order.item_count for order in Order.objects.with_item_count()}
+        self.assertEqual(orders, {self.order.pk: 1, empty.pk: 0})
+
+
+class OrderExportTest(TestCase):
+
+    def setUp(self):
+        self.staff = User.objects.create_superuser('admin', 'admin@example.com', 'password')
+        address = ShippingAddress.objects.create(
+            full_name='Buyer', email='buyer@example.com', street_address='Street', apartment_address='1')
+        user = User.objects.create_user('buyer', 'buyer@example.com', 'password')
+        self.paid = [Order.objects.create(user=user, shipping_address=address, amount=10, paid=True)
+                     for _ in range(3)]
+        Order.objects.create(amount=5)
+
+    def test_stream_filters_in_sql(self):
+        response = stream_orders_csv(Order.objects.with_item_count().filter(paid=True), 'Paid.csv')
+        with self.assertNumQueries(1):
+            rows = list(csv.reader(b''.join(response.streaming_content).decode().splitlines()))
+        self.assertEqual(rows[0][:3], ['ID', 'User', 'Full name'])
+        self.assertEqual([row[:4] for row in rows[1:]],
+                         [[str(order.pk), 'buyer', 'Buyer', 'buyer@example.com'] for order in self.paid])
+
+    def test_admin_action(self):
+        self.client.force_login(self.staff)
+        response = self.client.post(reverse('admin:payment_order_changelist'), {
+            'action': 'export_not_paid_to_csv', 'select_across': 1, 'index': 0,
+            '_selected_action': [order.pk for order in self.paid]})
+        self.assertEqual(response['Content-Type'], 'text/csv')
+        self.assertEqual(len(b''.join(response.streaming_content).decode().splitlines()), 2)
+
+        with mock.patch('payment.admin.export_orders.delay') as delay:
+            self.client.post(reverse('admin:payment_order_changelist'), {
+                'action': 'export_in_background', 'index': 0,
+                '_selected_action': [order.pk for order in self.paid[:2]]})
+            self.assertEqual(sorted(delay.call_args.args[0]['pk__in']), [order.pk for order in self.paid[:2]])
+
+            self.client.post(reverse('admin:payment_order_changelist') + '?paid__exact=1&o=1', {
+                'action': 'export_in_background', 'select_across': 1, 'index': 0,
+                '_selected_action': [self.paid[0].pk]})
+            self.assertEqual(delay.call_args.args[0], {'paid__exact': '1'})
+
+            self.client.post(reverse('admin:payment_order_changelist') + f'?q={self.paid[0].pk}', {
+                'action': 'export_in_background', 'select_across': 1, 'index': 0,
+                '_selected_action': [self.paid[0].pk]})
+            self.assertEqual(delay.call_args.args[0], {'pk__in': [self.paid[0].pk]})
+
+    def test_background_export(self):
+        with tempfile.TemporaryDirectory() as media_root, self.settings(MEDIA_ROOT=media_root):
+            path = export_orders({'paid__exact': '0'}, 'orders.csv.gz', self.staff.pk, 'http://testserver/')
+            with gzip.open(os.path.join(media_root, path), 'rt') as export:
+                self.assertEqual(len(export.read().splitlines()), 2)
+            send_outbox()
+            self.assertEqual(mail.outbox[0].to, ['admin@example.com'])
+            url = mail.outbox[0].body.split()[-1]
+            self.assertEqual(url, 'http://testserver' + reverse('payment:admin-order-export', args=['orders.csv.gz']))
+
+            self.client.force_login(self.staff)
+            response = self.client.get(url)
+            self.assertEqual(gzip.decompress(b''.join(response.streaming_content)).decode().count('\n'), 2)
+            self.assertEqual(self.client.get(reverse(
+                'payment:admin-order-export', args=['missing.csv.gz'])).status_code, 404)
+
+
+@mock.patch('payment.invoices.weasyprint')
+class InvoiceTest(TestCase):
+
+    def setUp(self):
+        get_stylesheet.cache_clear()
+        self.media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(self.media_root.cleanup)
+        media = self.settings(MEDIA_ROOT=self.media_root.name)
+        media.enable()
+        self.addCleanup(media.disable)
+
+        category = Category.objects.create(name='Category 1')
+        self.orders = [Order.objects.create(amount=10) for _ in range(2)]
+        for index, order in enumerate(self.orders):
+            product = ProductProxy.objects.create(
+                title=f'Product {index}', slug=f'product-{index}', price=10, category=category)
+            order.items.create(product=product, price=Decimal('10.00'), quantity=1)
+            order.items.create(product=product, price=Decimal('5.00'), quantity=2)
+        self.staff = User.objects.create_superuser('admin', 'admin@example.com', 'password')
+
+    def test_render_loads_the_order_with_two_queries(self, weasyprint):
+        weasyprint.HTML.return_value.write_pdf.return_value = b'%PDF'
+        with self.assertNumQueries(2):
+            self.assertEqual(render_invoice(invoice_orders().get(pk=self.orders[0].pk)), b'%PDF')
+        html = weasyprint.HTML.call_args.kwargs['string']
+        self.assertIn('Product 0', html)
+
+    def test_admin_pdf_is_rendered_once_per_version(self, weasyprint):
+        weasyprint.HTML.return_value.write_pdf.return_value = b'%PDF'
+        self.client.force_login(self.staff)
+        url = reverse('payment:admin_order_pdf', args=[self.orders[0].pk])
+        for _ in range(2):
+            response = self.client.get(url)
+            self.assertEqual(b''.join(response.streaming_content), b'%PDF')
+        self.assertEqual(weasyprint.HTML.call_count, 1)
+        self.assertEqual(weasyprint.CSS.call_count, 1)
+
+        self.orders[0].items.first().delete()
+        self.client.get(url)
+        self.assertEqual(weasyprint.HTML.call_count, 2)
+
+    def test_earlier_versions_are_deleted(self, weasyprint):
+        weasyprint.HTML.return_value.write_pdf.return_value = b'%PDF'
+        order = self.orders[0]
+        get_invoice(order)
+        other = get_invoice(self.orders[1])
+        order.save()
+        self.assertEqual(generate_invoices([order.pk]), [invoice_name(order)])
+        self.assertEqual(default_storage.listdir(os.path.dirname(invoice_name(order)))[1],
+                         [os.path.basename(invoice_name(order))])
+        self.assertTrue(default_storage.exists(other))
+
+    def test_generate_invoices(self, weasyprint):
+        weasyprint.HTML.return_value.write_pdf.return_value = b'%PDF'
+        order_ids = [order.pk for order in self.orders]
+        names = generate_invoices(order_ids)
+        self.assertEqual(sorted(names), sorted(invoice_name(order) for order in Order.objects.filter(pk__in=order_ids)))
+        self.assertEqual(generate_invoices(order_ids), [])
+        self.assertEqual(weasyprint.CSS.call_count, 1)
+
+    def test_invoices_are_rendered_in_batches(self, weasyprint):
+        weasyprint.HTML.return_value.write_pdf.return_value = b'%PDF'
+        order_ids = sorted(order.pk for order in self.orders)
+        with mock.patch('payment.tasks.INVOICE_BATCH_SIZE', 1), mock.patch('payment.tasks.group') as group:
+            self.assertEqual(render_invoices(order_ids), 2)
+        batches = group.call_args.args[0]
+        self.assertEqual(sorted(batch.args[0] for batch in batches), [[order_id] for order_id in order_ids])
+
+        names = [name for batch in batches for name in batch.apply().get()]
+        self.assertEqual(sorted(names), sorted(invoice_name(order) for order in Order.objects.filter(pk__in=order_ids)))
+        self.assertEqual(render_invoices(order_ids), 0)
+
+
+class AdminQueryCountTest(TestCase):
+
+    def setUp(self):
+        self.staff = User.objects.create_superuser('admin', 'admin@example.com', 'password')
+        self.client.force_login(self.staff)
+        self.category = Category.objects.create(name='Category 1')
+
+    def create_orders(self, count):
+        for _ in range(count):
+            index = Order.objects.count()
+            user = User.objects.create(username=f'buyer-{index}', email='buyer@example.com')
+            address = ShippingAddress.objects.create(
+                user=user, full_name='Buyer', email='buyer@example.com',
+                street_address='Street', apartment_address='1')
+            product = ProductProxy.objects.create(
+                title=f'Product {index}', slug=f'product-{index}', price=10,
+                category=self.category)
+            order = Order.objects.create(user=user, shipping_address=address, amount=10)
+            order.items.create(product=product, user=user, price=Decimal('10.00'), quantity=1)
+            StockReservation.objects.create(order=order, product=product, quantity=1, expires_at=timezone.now())
+            WebhookEvent.objects.create(provider=WebhookEvent.STRIPE, event_id=f'evt_{index}',
+                                        event_type='checkout.session.completed', payload={})
+        return order
+
+    def assertQueriesDoNotGrow(self, url, budget, add_rows):
+        add_rows()
+        self.client.get(url)
+        with CaptureQueriesContext(connection) as captured:
+            self.assertEqual(self.client.get(url).status_code, 200)
+        self.assertLessEqual(len(captured), budget)
+        for _ in range(5):
+            add_rows()
+        with self.assertNumQueries(len(captured)):
+            self.client.get(url)
+
+    def assertChangelistQueries(self, model_name, budget):
+        self.assertQueriesDoNotGrow(
+            reverse(f'admin:payment_{model_name}_changelist'), budget, lambda: self.create_orders(2))
+
+    def test_order_changelist(self):
+        self.assertChangelistQueries('order', 5)
+
+    def test_order_item_changelist(self):
+        self.assertChangelistQueries('orderitem', 5)
+
+    def test_shipping_address_changelist(self):
+        self.assertChangelistQueries('shippingaddress', 6)
+
+    def test_stock_reservation_changelist(self):
+        self.assertChangelistQueries('stockreservation', 5)
+
+    def test_webhook_event_changelist(self):
+        self.assertChangelistQueries('webhookevent', 5)
+
+    def test_outbox_email_changelist(self):
+        def add_emails():
+            for _ in range(2):
+                OutboxEmail.objects.create(subject='Order confirmation', body='Thanks',
+                                           from_email='shop@example.com', recipient='buyer@example.com')
+        self.assertQueriesDoNotGrow(reverse('admin:payment_outboxemail_changelist'), 5, add_emails)
+
+    def test_order_change_form(self):
+        order = self.create_orders(1)
+        product = order.items.get().product
+        self.assertQueriesDoNotGrow(
+            reverse('admin:payment_order_change', args=[order.pk]), 9,
+            lambda: order.items.create(product=product, price=Decimal('10.00'), quantity=1))
+
+
+class SalesRollupTest(TestCase):
+
+    def setUp(self):
+        category = Category.objects.create(name='Category 1')
+        self.products = [
+            ProductProxy.objects.create(title=f'Product {index}', slug=f'product-{index}', price=10,
+                                        category=category)
+            for index in range(2)
+        ]
+        self.today = timezone.localdate()
+        self.yesterday = self.today - timedelta(days=1)
+
+    def create_order(self, day, lines, paid=True):
+        order = Order.objects.create(amount=0, paid=paid)
+        for product, price, quantity in lines:
+            order.items.create(product=product, price=Decimal(price), quantity=quantity)
+        created = timezone.make_aware(datetime.datetime.combine(day, datetime.time(12)))
+        Order.objects.filter(pk=order.pk).update(created=created)
+        return order
+
+    def test_rollups_and_accessors(self):
+        first, second = self.products
+        self.create_order(self.yesterday, [(first, '10.00', 2), (second, '4.00', 1)])
+        self.create_order(self.today, [(first, '10.00', 1)])
+        self.create_order(self.today, [(second, '4.00', 5)], paid=False)
+        self.assertEqual(update_sales_rollups(), 2)
+
+        yesterday = DailySales.objects.get(date=self.yesterday)
+        self.assertEqual((yesterday.orders, yesterday.items, yesterday.units, yesterday.revenue),
+                         (1, 2, 3, Decimal('24.00')))
+        self.assertEqual(DailySales.objects.get(date=self.today).units, 1)
+        with self.assertNumQueries(1):
+            self.assertEqual(OrderItem.get_total_quantity_for_product(first), 3)
+        with self.assertNumQueries(1):
+            self.assertEqual(OrderItem.get_average_price(), Decimal('8.00'))
+        self.assertEqual([row['product_id'] for row in get_best_sellers()], [first.pk, second.pk])
+
+    def test_only_changed_days_are_recomputed(self):
+        first, second = self.products
+        unpaid = self.create_order(self.yesterday, [(second, '4.00', 3)], paid=False)
+        self.create_order(self.today, [(first, '10.00', 1)])
+        update_sales_rollups()
+        self.assertEqual(update_sales_rollups(), 2)  # changes within ROLLUP_OVERLAP are rolled up again
+
+        RollupWatermark.objects.update(value=timezone.now())
+        self.assertEqual(update_sales_rollups(), 0)
+        RollupWatermark.objects.update(value=timezone.now())
+        Order.objects.filter(pk=unpaid.pk).update(paid=True, updated=timezone.now())
+        self.assertEqual(update_sales_rollups(), 1)
+        self.assertEqual(OrderItem.get_total_quantity_for_product(second), 3)
+        self.assertEqual(ProductDailySales.objects.get(product=second).date, self.yesterday)
+
+        Order.objects.all().delete()
+        rebuild_sales_rollups()
+        self.assertFalse(DailySales.objects.exists())
+        self.assertEqual(OrderItem.get_total_quantity_for_product(second), 0)
+
+    def test_dashboard(self):
+        self.create_order(self.today, [(self.products[0], '10.00', 2)])
+        update_sales_rollups()
+        self.client.force_login(User.objects.create_superuser('admin', 'admin@example.com', 'password'))
+        url = reverse('payment:sales-dashboard')
+        self.client.get(url)
+        with CaptureQueriesContext(connection) as captured:
+            response = self.client.get(url)
+        self.assertContains(response, 'Product 0')
+        self.create_order(self.yesterday, [(self.products[1], '4.00', 1)])
+        update_sales_rollups()
+        with self.assertNumQueries(len(captured)):
+            self.client.get(url)
+
+
+class OutboxTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        user = User.objects.create(username='buyer', email='account@example.com')
+        address = ShippingAddress.objects.create(user=user, full_name='Buyer', email='address@example.com',
+                                                 street_address='Street', apartment_address='1')
+        self.orders = [
+            Order.objects.create(user=user, shipping_address=address, amount=10),
+            Order.objects.create(user=user, amount=10),
+        ]
+
+    def test_confirmations_are_sent_over_one_connection(self):
+        queue_order_confirmations([order.pk for order in self.orders])
+        queue_order_confirmations([self.orders[0].pk])
+        self.assertEqual(OutboxEmail.objects.count(), 2)
+
+        with mock.patch('payment.outbox.get_connection', wraps=get_connection) as connect:
+            stats = send_outbox(batch_size=1)
+        connect.assert_called_once_with()
+        self.assertEqual((stats['sent'], stats['failed']), (2, 0))
+        self.assertEqual(sorted(message.to[0] for message in mail.outbox),
+                         ['account@example.com', 'address@example.com'])
+        self.assertEqual(send_outbox()['sent'], 0)
+        self.assertEqual(outbox_stats()['pending'], 0)
+        self.assertEqual(outbox_stats()['last_run']['sent'], 2)
+
+    def test_failures_are_retried_with_backoff(self):
+        queue_email('Subject', 'Body', 'buyer@example.com')
+        with mock.patch('django.core.mail.backends.locmem.EmailBackend.send_messages',
+                        side_effect=smtplib.SMTPRecipientsRefused({})):
+            self.assertEqual(send_outbox()['failed'], 1)
+            self.assertEqual(send_outbox()['failed'], 0)
+        email = OutboxEmail.objects.get()
+        self.assertEqual(email.attempts, 1)
+        self.assertGreater(email.send_after, timezone.now())
+
+        OutboxEmail.objects.update(send_after=timezone.now())
+        self.assertEqual(send_outbox()['sent'], 1)
+        self.assertEqual(len(mail.outbox), 1)
+
+        queue_email('Subject', 'Body', 'buyer@example.com')
+        OutboxEmail.objects.filter(sent_at__isnull=True).update(attempts=OUTBOX_MAX_ATTEMPTS - 1)
+        with mock.patch('django.core.mail.backends.locmem.EmailBackend.send_messages',
+                        side_effect=smtplib.SMTPRecipientsRefused({})), \
+                self.assertLogs('payment.outbox', 'ERROR'):
+            self.assertEqual(send_outbox()['failed'], 1)
+        self.assertEqual(send_outbox()['sent'], 0)
+
+    def test_connection_errors_stop_the_run(self):
+        for index in range(3):
+            queue_email('Subject', 'Body', f'buyer{index}@example.com')
+        with mock.patch('django.core.mail.backends.locmem.EmailBackend.send_messages',
+                        side_effect=[1, smtplib.SMTPServerDisconnected('gone')]), \
+                self.assertLogs('payment.outbox', 'ERROR'):
+            stats = send_outbox()
+        self.assertEqual((stats['sent'], stats['failed']), (1, 0))
+        self.assertEqual(list(OutboxEmail.objects.filter(sent_at__isnull=True).values_list('attempts', 'last_error')),
+                         [(0, ''), (0, '')])
+
+        self.assertEqual(send_outbox()['sent'], 2)
@@ -1,28 +1,30 @@
-import uuid
-from decimal import Decimal
-
-import stripe
-import weasyprint
 from django.conf import settings
+from django.contrib import admin, messages
 from django.contrib.admin.views.decorators import staff_member_required
 from django.contrib.auth.decorators import login_required
-from django.http import Http404, HttpResponse
+from django.core import signing
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.http import FileResponse, Http404, JsonResponse
 from django.shortcuts import get_object_or_404, redirect, render
-from django.template.loader import render_to_string
-from django.templatetags.static import static
 from django.urls import reverse
-from yookassa import Configuration, Payment
 
 from cart.cart import Cart
+from shop.models import ProductProxy
 
+from .exports import EXPORT_DIRECTORY
 from .forms import ShippingAddressForm
-from .models import Order, OrderItem, ShippingAddress
-
-stripe.api_key = settings.STRIPE_SECRET_KEY
-stripe.api_version = settings.STRIPE_API_VERSION
+from .gateways import PaymentError, PaymentLine
+from .inventory import OutOfStock, release_order_stock
+from .invoices import get_invoice
+from .models import Order, RollupWatermark, ShippingAddress
+from .outbox import outbox_stats
+from .rollups import SALES_WATERMARK, get_best_sellers, get_daily_sales
+from .services import get_checkout_status, place_order, start_payment
+from .tasks import create_payment
 
-Configuration.account_id = settings.YOOKASSA_SHOP_ID
-Configuration.secret_key = settings.YOOKASSA_SECRET_KEY
+ORDER_SIGNING_SALT = 'payment.order'
+SALES_DASHBOARD_DAYS = 30
 
 
 @login_required(login_url='account:login')
@@ -56,143 +58,129 @@ def complete_order(request):
     if request.method == 'POST':
         payment_type = request.POST.get('stripe-payment', 'yookassa-payment')
 
-        name = request.POST.get('name')
-        email = request.POST.get('email')
-        street_address = request.POST.get('street_address')
-        apartment_address = request.POST.get('apartment_address')
-        country = request.POST.get('country')
-        zip = request.POST.get('zip')
+        user = request.user if request.user.is_authenticated else None
+        if user is not None:
+            shipping_address, _ = ShippingAddress.objects.get_or_create(user=user, defaults={
+                'full_name': request.POST.get('full_name'),
+                'email': request.POST.get('email'),
+                'street_address': request.POST.get('street_address'),
+                'apartment_address': request.POST.get('apartment_address'),
+                'country': request.POST.get('country'),
+                'zip': request.POST.get('zip'),
+            })
+        else:
+            # The guest's address is saved by place_order, along with the order.
+            form = ShippingAddressForm(request.POST)
+            if not form.is_valid():
+                return render(request, 'payment/checkout.html', {'form': form, 'shipping_address': form.instance})
+            shipping_address = form.save(commit=False)
+
         cart = Cart(request)
-        total_price = cart.get_total_price()
+        try:
+            order = place_order(cart, shipping_address, user)
+        except OutOfStock as e:
+            titles = ProductProxy.objects.filter(pk__in=e.product_ids).values_list('title', flat=True)
+            messages.error(request, f'Not enough stock left for: {", ".join(titles)}')
+            return redirect('cart:cart-view')
+        except ValueError:
+            return redirect('cart:cart-view')
+
+        provider = 'stripe' if payment_type == 'stripe-payment' else 'yookassa'
+        token = signing.dumps(order.id, salt=ORDER_SIGNING_SALT)
+        success_url = request.build_absolute_uri(reverse('payment:payment-success'))
+        cancel_url = request.build_absolute_uri(f"{reverse('payment:payment-failed')}?order={token}")
+
+        if settings.PAYMENT_ASYNC:
+            transaction.on_commit(lambda: create_payment.delay(provider, order.id, success_url, cancel_url))
+            return redirect(f"{reverse('payment:payment-pending')}?order={token}")
+
+        lines = [PaymentLine(item.product.title, item.price, item.qty) for item in cart]
+        try:
+            checkout = start_payment(provider, order, lines, success_url, cancel_url)
+        except PaymentError:
+            messages.error(request, 'The payment provider is unavailable, please try again.')
+            return redirect('payment:checkout')
+        return redirect(checkout.url, code=303)
+
+
+def _order_from_token(request):
+    try:
+        return signing.loads(request.GET.get('order', ''), salt=ORDER_SIGNING_SALT)
+    except signing.BadSignature:
+        return None
+
+
+def payment_pending(request):
+    """
+    Waits for the payment being created by a Celery worker, then sends the
+    customer on to the provider.
+    """
+    if _order_from_token(request) is None:
+        raise Http404
+    return render(request, 'payment/payment-pending.html', {'token': request.GET['order']})
+
+
+def payment_status(request):
+    order_id = _order_from_token(request)
+    if order_id is None:
+        raise Http404
+    return JsonResponse(get_checkout_status(order_id))
 
-        shipping_address, _ = ShippingAddress.objects.get_or_create(
-                    user=request.user,
-                    defaults={
-                        'name': name,
-                        'email': email,
-                        'street_address': street_address,
-                        'apartment_address': apartment_address,
-                        'country': country,
-                        'zip': zip
-                    }
-                )
-
-        match payment_type:
-            case "stripe-payment":
-                
-                session_data = {
-                    'mode': 'payment',
-                    'success_url': request.build_absolute_uri(reverse('payment:payment-success')),
-                    'cancel_url': request.build_absolute_uri(reverse('payment:payment-failed')),
-                    'line_items': []
-                }
-
-                if request.user.is_authenticated:
-                    order = Order.objects.create(
-                        user=request.user, shipping_address=shipping_address, amount=total_price)
-
-                    for item in cart:
-                        OrderItem.objects.create(
-                            order=order, product=item['product'], price=item['price'], quantity=item['qty'], user=request.user)
-
-                        session_data['line_items'].append({
-                            'price_data': {
-                                'unit_amount': int(item['price'] * Decimal(100)),
-                                'currency': 'usd',
-                                'product_data': {
-                                    'name': item['product']
-                                },
-                            },
-                            'quantity': item['qty'],
-                        })
-                    session_data['client_reference_id'] = order.id
-                    session = stripe.checkout.Session.create(**session_data)
-                    return redirect(session.url, code=303)
-                
-                else:
-                    order = Order.objects.create(
-                        shipping_address=shipping_address, amount=total_price)
-
-                    for item in cart:
-                        OrderItem.objects.create(
-                            order=order, product=item['product'], price=item['price'], quantity=item['qty'])
-                        
-                        session_data['line_items'].append({
-                            'price_data': {
-                                'unit_amount': int(item['price'] * Decimal(100)),
-                                'currency': 'usd',
-                                'product_data': {
-                                    'name': item['product']
-                                },
-                            },
-                            'quantity': item['qty'],
-                        })
-                    session_data['client_reference_id'] = order.id
-                    session = stripe.checkout.Session.create(**session_data)
-                    return redirect(session.url, code=303)
-            
-            # case "yookassa-payment":
-            case "yookassa-payment":
-                idempotence_key = uuid.uuid4()
-                
-                currency = 'RUB'
-                description = 'Товары в корзине'
-                payment = Payment.create({
-                    "amount": {
-                        "value": str(total_price * 93),
-                        "currency": currency
-                    },
-                    "confirmation": {
-                        "type": "redirect",
-                        "return_url": request.build_absolute_uri(reverse('payment:payment-success')),
-                    },
-                    "capture": True,
-                    "test": True,
-                    "description": description,
-                }, idempotence_key)
-
-                confirmation_url = payment.confirmation.confirmation_url
-
-                if request.user.is_authenticated:
-                    order = Order.objects.create(
-                        user=request.user, shipping_address=shipping_address, amount=total_price)
-
-                    for item in cart:
-                        OrderItem.objects.create(
-                            order=order, product=item['product'], price=item['price'], quantity=item['qty'], user=request.user)
-                    
-                    return redirect(confirmation_url)
-                
-                else:
-                    order = Order.objects.create(
-                        shipping_address=shipping_address, amount=total_price)
-
-                    for item in cart:
-                        OrderItem.objects.create(
-                            order=order, product=item['product'], price=item['price'], quantity=item['qty'])
 
 def payment_success(request):
-    for key in list(request.session.keys()):
-        if key == 'session_key':
-            del request.session[key]
+    Cart(request).clear()
     return render(request, 'payment/payment-success.html')
 
 
 def payment_failed(request):
+    # The signed order id comes back from the payment page; the stock reserved
+    # for the order is given back at once instead of when it expires.
+    order_id = _order_from_token(request)
+    if order_id is not None:
+        release_order_stock(order_id)
     return render(request, 'payment/payment-failed.html')
 
 @staff_member_required
 def admin_order_pdf(request, order_id):
     try:
-        order = Order.objects.select_related('user', 'shipping_address').get(id=order_id)
+        order = Order.objects.only('id', 'updated').get(id=order_id)
     except Order.DoesNotExist:
-        raise Http404('Заказ не найден')
-    html = render_to_string('payment/order/pdf/pdf_invoice.html',
-                            {'order': order})
-    response = HttpResponse(content_type='application/pdf')
-    response['Content-Disposition'] = f'filename=order_{order.id}.pdf'
-    css_path = static('payment/css/pdf.css').lstrip('/')
-    # css_path = 'static/payment/css/pdf.css'
-    stylesheets = [weasyprint.CSS(css_path)]
-    weasyprint.HTML(string=html).write_pdf(response, stylesheets=stylesheets)
-    return response
+        raise Http404('Заказ не найден')
+    return FileResponse(default_storage.open(get_invoice(order)), filename=f'order_{order.id}.pdf',
+                        content_type='application/pdf')
+
+
+@staff_member_required
+def admin_order_export(request, name):
+    """
+    Serves an order export written by the export_orders task.
+    """
+    if not name.endswith('.csv.gz'):
+        raise Http404('Export not found')
+    try:
+        export = default_storage.open(f'{EXPORT_DIRECTORY}/{name}')
+    except FileNotFoundError:
+        raise Http404('Export not found')
+    return FileResponse(export, as_attachment=True, filename=name, content_type='application/gzip')
+
+
+@staff_member_required
+def sales_dashboard(request):
+    """
+    Shows the sales of the last SALES_DASHBOARD_DAYS days and the best
+    sellers, read from the sales rollups only.
+    """
+    daily_sales = get_daily_sales(SALES_DASHBOARD_DAYS)
+    return render(request, 'payment/sales-dashboard.html', {
+        **admin.site.each_context(request),
+        'title': 'Sales',
+        'days': SALES_DASHBOARD_DAYS,
+        'daily_sales': daily_sales,
+        'orders': sum(sales.orders for sales in daily_sales),
+        'units': sum(sales.units for sales in daily_sales),
+        'revenue': sum(sales.revenue for sales in daily_sales),
+        'best_sellers': get_best_sellers(days=SALES_DASHBOARD_DAYS),
+        'all_time_best_sellers': get_best_sellers(),
+        'outbox': outbox_stats(),
+        'rolled_up_to': RollupWatermark.objects.filter(name=SALES_WATERMARK).values_list('value', flat=True).first(),
+    })
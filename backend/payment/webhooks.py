@@ -1,111 +1,209 @@
+import json
+import logging
+
 import stripe
 from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Q
 from django.http import HttpResponse
+from django.utils import timezone
 from django.views.decorators.csrf import csrf_exempt
-from yookassa import Configuration, Payment, Webhook
+from django.views.decorators.http import require_POST
+from kombu.exceptions import OperationalError
 from yookassa.domain.common import SecurityHelper
-from yookassa.domain.notification import (WebhookNotificationEventType,
-                                          WebhookNotificationFactory)
 
-from .models import Order
-from .tasks import send_order_confirmation
+from .gateways import PaymentError, get_gateway, yookassa_amount
+from .inventory import commit_stock, retake_stock
+from .models import Order, WebhookEvent
+from .outbox import queue_order_confirmations
+
+logger = logging.getLogger(__name__)
+
+WEBHOOK_BATCH_DELAY = 2
+WEBHOOK_BATCH_SIZE = 500
+_SCHEDULED_KEY = 'payment:webhooks:scheduled'
+
+
+def record_event(provider, event_id, event_type, payload):
+    """
+    Stores a webhook delivery and schedules its processing.
+
+    Redeliveries of an event hit the unique constraint and are dropped by the
+    INSERT itself, without a lookup first.
+    """
+    WebhookEvent.objects.bulk_create([WebhookEvent(
+        provider=provider, event_id=event_id, event_type=event_type, payload=payload,
+    )], ignore_conflicts=True)
+    schedule_processing()
+
+
+def schedule_processing():
+    """
+    Queues process_webhook_events a moment from now, once for all the events
+    arriving meanwhile, so that a burst of deliveries is handled in batches.
+    """
+    if cache.add(_SCHEDULED_KEY, 1, WEBHOOK_BATCH_DELAY * 5):
+        transaction.on_commit(_enqueue)
+
+
+def _enqueue():
+    from .tasks import process_webhook_events
+
+    # The event is stored, so the beat job processes it even if queuing fails.
+    try:
+        process_webhook_events.apply_async(countdown=WEBHOOK_BATCH_DELAY)
+    except OperationalError:
+        cache.delete(_SCHEDULED_KEY)
+        logger.exception('Could not queue the processing of webhook events')
+
+
+def paid_order_id(event):
+    """
+    Returns the id of the order an event reports as paid, or None.
+    """
+    payload = event.payload
+    try:
+        if event.provider == WebhookEvent.STRIPE and event.event_type == 'checkout.session.completed':
+            session = payload['data']['object']
+            if session.get('mode') == 'payment' and session.get('payment_status') == 'paid':
+                return int(session['client_reference_id'])
+        elif event.provider == WebhookEvent.YOOKASSA and event.event_type == 'payment.succeeded':
+            return int(payload['object']['metadata']['order_id'])
+    except (KeyError, TypeError, ValueError):
+        logger.warning('Webhook event %s has no valid order id', event.event_id)
+    return None
+
+
+def _yookassa_payment_matches(payment, order_id, amount):
+    return (payment.get('status') == 'succeeded'
+            and str(payment.get('metadata', {}).get('order_id')) == str(order_id)
+            and payment.get('amount') == yookassa_amount(amount))
+
+
+def confirm_events(events, unconfirmed):
+    """
+    Returns the id of the order each event proves paid, by event pk.
+
+    YooKassa notifications are not signed, so each one is only trusted once
+    the API confirms the payment succeeded, for the order and its amount.
+    Events the API could not be asked about are added to unconfirmed.
+    """
+    claims = [(event, order_id) for event, order_id in zip(events, map(paid_order_id, events)) if order_id]
+    amounts = dict(Order.objects.filter(pk__in=[
+        order_id for event, order_id in claims if event.provider == WebhookEvent.YOOKASSA
+    ]).values_list('pk', 'amount'))
+
+    confirmed = {}
+    for event, order_id in claims:
+        if event.provider == WebhookEvent.YOOKASSA:
+            if order_id not in amounts:
+                continue
+            try:
+                payment = get_gateway(WebhookEvent.YOOKASSA).get_payment(event.payload['object']['id'])
+            except PaymentError:
+                logger.exception('Could not confirm the payment of webhook event %s', event.event_id)
+                unconfirmed.add(event.pk)
+                continue
+            if not _yookassa_payment_matches(payment, order_id, amounts[order_id]):
+                logger.warning('Webhook event %s does not match payment %s', event.event_id, payment.get('id'))
+                continue
+        confirmed[event.pk] = order_id
+    return confirmed
+
+
+def apply_webhook_events(batch_size=WEBHOOK_BATCH_SIZE):
+    """
+    Applies the unprocessed webhook events, one batch per transaction.
+
+    The payments of a batch are confirmed with the providers first, outside
+    any transaction, so a slow provider holds no locks. Then the events are
+    locked, skipping those a concurrent run holds, and orders are marked
+    paid with one UPDATE. Only the orders that were still unpaid have their
+    stock committed, or taken again if their reservation expired meanwhile,
+    and a confirmation queued in the outbox, in the same transaction.
+    Retried deliveries and several events for the same order therefore have
+    no further effect. Events whose payment could not be confirmed are left
+    for the next run.
+
+    Returns:
+        int: The number of events processed.
+    """
+    cache.delete(_SCHEDULED_KEY)
+    processed = 0
+    after = Q()
+    while True:
+        # Each batch starts after the previous one, so events left unprocessed
+        # are not read again by this run.
+        events = list(WebhookEvent.objects.filter(after, processed_at__isnull=True).order_by(
+            'received_at', 'pk')[:batch_size])
+        if not events:
+            return processed
+        last = events[-1]
+        after = Q(received_at__gt=last.received_at) | Q(received_at=last.received_at, pk__gt=last.pk)
+
+        unconfirmed = set()
+        confirmed = confirm_events(events, unconfirmed)
+        with transaction.atomic():
+            locked = list(WebhookEvent.objects.select_for_update(skip_locked=True).filter(
+                pk__in=[event.pk for event in events if event.pk not in unconfirmed],
+                processed_at__isnull=True,
+            ).values_list('pk', flat=True))
+            order_ids = {confirmed[pk] for pk in locked if pk in confirmed}
+            paid = list(Order.objects.select_for_update().filter(
+                pk__in=order_ids, paid=False).values_list('pk', flat=True))
+            if paid:
+                Order.objects.filter(pk__in=paid).update(paid=True, updated=timezone.now())
+                retake_stock(paid)
+                commit_stock(paid)
+                queue_order_confirmations(paid)
+            WebhookEvent.objects.filter(pk__in=locked).update(processed_at=timezone.now())
+        processed += len(locked)
 
 
 @csrf_exempt
+@require_POST
 def stripe_webhook(request):
-    payload = request.body
-    sig_header = request.META['HTTP_STRIPE_SIGNATURE']
-    event = None
-
     try:
         event = stripe.Webhook.construct_event(
-            payload, sig_header, settings.STRIPE_WEBHOOK_SECRET
+            request.body, request.META.get('HTTP_STRIPE_SIGNATURE', ''), settings.STRIPE_WEBHOOK_SECRET
         )
-    except ValueError as e:
-        # Invalid payload
+    except (ValueError, stripe.error.SignatureVerificationError):
         return HttpResponse(status=400)
-    except stripe.error.SignatureVerificationError as e:
-        # Invalid signature
-        return HttpResponse(status=400)
-
-    # Handle the checkout.session.completed event
-    if event['type'] == 'checkout.session.completed':
-        session = event['data']['object']
-
-        # Fulfill the purchase...
-        if session.mode ==  "payment" and session.payment_status == "paid":
-            try:
-                order_id = session.client_reference_id
-            except Order.DoesNotExist:
-                return HttpResponse(status=404) 
-            
-            send_order_confirmation.delay(order_id)
-            order = Order.objects.get(id=order_id)
-            order.paid = True
-            order.save() 
 
+    record_event(WebhookEvent.STRIPE, event['id'], event['type'], json.loads(request.body))
     return HttpResponse(status=200)
 
+
 def get_client_ip(request):
-    x_forwarded_for = request.META.get('HTTP_X_FORWARDED_FOR')
-    if x_forwarded_for:
-        ip = x_forwarded_for.split(',')[0]
-    else:
-        ip = request.META.get('REMOTE_ADDR')
-    return ip
+    """
+    Returns the address of the client, as seen by the first of the
+    PAYMENT_TRUSTED_PROXIES proxies in front of Django.
+
+    Each proxy appends the address it got the request from to
+    X-Forwarded-For, so only that many entries from the right can be trusted,
+    anything before them is whatever the client sent.
+    """
+    proxies = settings.PAYMENT_TRUSTED_PROXIES
+    if proxies:
+        forwarded = [ip.strip() for ip in request.META.get('HTTP_X_FORWARDED_FOR', '').split(',') if ip.strip()]
+        if len(forwarded) >= proxies:
+            return forwarded[-proxies]
+    return request.META.get('REMOTE_ADDR')
+
 
+@csrf_exempt
+@require_POST
 def yookassa_webhook(request):
-    webhook = Webhook(request.body, request.headers['Content-Type'])
-    event = webhook.parse()
-    
-    # Обработка события оплаты
-    if event.type == 'payment.succeeded':
-        
-        return HttpResponse(status=200)
-    
-    return HttpResponse(status=200) 
-    
-    #2Второй вариант
-    ip = get_client_ip(request)  # Получите IP запроса
-    if not SecurityHelper().is_ip_trusted(ip):
+    # YooKassa does not sign its notifications, they are trusted by source IP.
+    if settings.PAYMENT_YOOKASSA_VERIFY_IP and not SecurityHelper().is_ip_trusted(get_client_ip(request)):
         return HttpResponse(status=400)
-
-    # Извлечение JSON объекта из тела запроса
-    event_json = json.loads(request.body)
     try:
-        # Создание объекта класса уведомлений в зависимости от события
-        notification_object = WebhookNotificationFactory().create(event_json)
-        response_object = notification_object.object
-        if notification_object.event == WebhookNotificationEventType.PAYMENT_SUCCEEDED:
-            some_data = {
-                'paymentId': response_object.id,
-                'paymentStatus': response_object.status,
-            }
-            # Специфичная логика
-            # ...
-
-        elif notification_object.event == WebhookNotificationEventType.PAYMENT_CANCELED:
-            some_data = {
-                'paymentId': response_object.id,
-                'paymentStatus': response_object.status,
-            }
-        else:
-            # Обработка ошибок
-            return HttpResponse(status=400)  # Сообщаем кассе об ошибке
-
-        Configuration.configure('XXXXXX', 'test_XXXXXXXX')
-        # Получим актуальную информацию о платеже
-        payment_info = Payment.find_one(some_data['paymentId'])
-        if payment_info:
-            payment_status = payment_info.status
-            # Специфичная логика
-            # ...
-        else:
-            # Обработка ошибок
-            return HttpResponse(status=400)  # Сообщаем кассе об ошибке
-
-    except Exception:
-        # Обработка ошибок
-        return HttpResponse(status=400)  # Сообщаем кассе об ошибке
-
-    return HttpResponse(status=200)  # Сообщаем кассе, что все хорошо
\ No newline at end of file
+        payload = json.loads(request.body)
+        event_type, payment_id = payload['event'], payload['object']['id']
+    except (ValueError, KeyError, TypeError):
+        return HttpResponse(status=400)
+
+    # A YooKassa payment reaches each status once, so the pair identifies the event.
+    record_event(WebhookEvent.YOOKASSA, f'{payment_id}:{event_type}', event_type, payload)
+    return HttpResponse(status=200)
@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class RecommendConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'recommend'
+
+    def ready(self):
+        import recommend.signals
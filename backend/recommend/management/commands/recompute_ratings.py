@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from recommend.ratings import recompute_ratings
+
+
+class Command(BaseCommand):
+    help = 'Recomputes the denormalized product ratings from the reviews'
+
+    def handle(self, *args, **options):
+        updated = recompute_ratings()
+        self.stdout.write(f'Ratings recomputed for {updated} products')
@@ -22,5 +22,18 @@ class Review(models.Model):
     class Meta:
         ordering = ["-created_at"]
 
+    _original = None
+
     def __str__(self):
-        return f"{self.created_by} on Product: {self.product}"
\ No newline at end of file
+        return f"{self.created_by} on Product: {self.product}"
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        """
+        Remembers the loaded product and rating, so the signals can apply
+        the difference to the product's denormalized rating.
+        """
+        instance = super().from_db(db, field_names, values)
+        if 'product_id' in instance.__dict__ and 'rating' in instance.__dict__:
+            instance._original = (instance.product_id, instance.rating)
+        return instance
\ No newline at end of file
@@ -0,0 +1,56 @@
+from django.db.models import (Count, DecimalField, F, FloatField, OuterRef,
+                              Subquery, Sum, Value)
+from django.db.models.functions import Cast, Coalesce, NullIf
+
+from shop.models import Product
+
+from .models import Review
+
+
+def rating_average(rating_sum, rating_count):
+    """
+    Builds the SQL expression of the average rating, 0 for unrated products.
+    """
+    return Coalesce(
+        Cast(rating_sum, FloatField()) / NullIf(rating_count, 0),
+        Value(0),
+        output_field=DecimalField(max_digits=3, decimal_places=2),
+    )
+
+
+def apply_review(product_id, rating_delta, count_delta):
+    """
+    Adjusts the denormalized rating of a product by a single UPDATE.
+
+    Args:
+        product_id (int): The id of the reviewed product.
+        rating_delta (int): The change of the sum of the ratings.
+        count_delta (int): The change of the number of reviews.
+    """
+    rating_sum = F('rating_sum') + rating_delta
+    rating_count = F('rating_count') + count_delta
+    Product.objects.filter(pk=product_id).update(
+        rating_sum=rating_sum,
+        rating_count=rating_count,
+        rating_avg=rating_average(rating_sum, rating_count),
+    )
+
+
+def recompute_ratings(products=None):
+    """
+    Recomputes the ratings of the given products from their reviews in one
+    set-based UPDATE.
+
+    Returns:
+        int: The number of updated products.
+    """
+    if products is None:
+        products = Product.objects.all()
+    reviews = Review.objects.filter(product=OuterRef('pk')).order_by().values('product')
+    rating_count = Coalesce(Subquery(reviews.annotate(count=Count('pk')).values('count')), 0)
+    rating_sum = Coalesce(Subquery(reviews.annotate(total=Sum('rating')).values('total')), 0)
+    return products.update(
+        rating_count=rating_count,
+        rating_sum=rating_sum,
+        rating_avg=rating_average(rating_sum, rating_count),
+    )
@@ -0,0 +1,28 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from shop.models import Product
+
+from .models import Review
+from .ratings import apply_review, recompute_ratings
+
+
+@receiver(post_save, sender=Review)
+def review_saved(sender, instance, created, **kwargs):
+    original = instance._original
+    current = (instance.product_id, int(instance.rating))
+    if created:
+        apply_review(instance.product_id, current[1], 1)
+    elif original is None:
+        recompute_ratings(Product.objects.filter(pk=instance.product_id))
+    elif original != current:
+        apply_review(original[0], -original[1], -1)
+        apply_review(current[0], current[1], 1)
+    instance._original = current
+
+
+@receiver(post_delete, sender=Review)
+def review_deleted(sender, instance, **kwargs):
+    if instance._original is not None:
+        product_id, rating = instance._original
+        apply_review(product_id, -rating, -1)
@@ -1,3 +1,53 @@
+from decimal import Decimal
+from io import StringIO
+
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
 from django.test import TestCase
 
-# Create your tests here.
+from shop.models import Category, Product
+
+from .models import Review
+
+User = get_user_model()
+
+
+class ProductRatingTest(TestCase):
+    def setUp(self):
+        category = Category.objects.create(name='Category', slug='category')
+        self.product = Product.objects.create(title='Product', slug='product', category=category)
+        self.alice = User.objects.create_user(username='alice', password='secret')
+        self.bob = User.objects.create_user(username='bob', password='secret')
+
+    def assertRating(self, avg, count):
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.rating_avg, Decimal(avg))
+        self.assertEqual(self.product.rating_count, count)
+
+    def test_create_edit_delete(self):
+        review = Review.objects.create(
+            product=self.product, created_by=self.alice, rating=5, content='Great')
+        Review.objects.create(product=self.product, created_by=self.bob, rating=2, content='Meh')
+        self.assertRating('3.50', 2)
+
+        review = Review.objects.get(pk=review.pk)
+        review.rating = 4
+        review.save()
+        self.assertRating('3.00', 2)
+
+        review.delete()
+        self.assertRating('2.00', 1)
+
+    def test_saving_a_loaded_product_keeps_its_rating(self):
+        loaded = Product.objects.get(pk=self.product.pk)
+        Review.objects.create(product=self.product, created_by=self.alice, rating=5, content='Great')
+        loaded.title = 'Renamed'
+        loaded.save()
+        self.assertRating('5.00', 1)
+        self.assertEqual(self.product.title, 'Renamed')
+
+    def test_recompute_ratings(self):
+        Review.objects.create(product=self.product, created_by=self.alice, rating=5, content='Great')
+        Product.objects.update(rating_avg=0, rating_count=0, rating_sum=0)
+        call_command('recompute_ratings', stdout=StringIO())
+        self.assertRating('5.00', 1)
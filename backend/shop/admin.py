@@ -1,11 +1,44 @@
+from django import forms
 from django.contrib import admin
+from django.contrib.admin.helpers import ACTION_CHECKBOX_NAME
+from django.shortcuts import render
+
+from payment.inventory import restock
 
 from .models import Category, Product
+from .navigation import get_category_names
+from .pagination import EstimatedCountPaginator
+
+
+class RestockForm(forms.Form):
+    quantity = forms.IntegerField(label='Quantity received', min_value=1)
+
+
+@admin.action(description='Restock selected products')
+def restock_products(modeladmin, request, queryset):
+    """
+    Asks for the quantity received, then adds it to the stock of the
+    selected products, starting to track the stock of those without one.
+    """
+    form = RestockForm(request.POST if 'apply' in request.POST else None)
+    if form.is_valid():
+        quantity = form.cleaned_data['quantity']
+        count = restock(dict.fromkeys(queryset.values_list('pk', flat=True), quantity))
+        modeladmin.message_user(request, f'{quantity} units added to the stock of {count} products.')
+        return None
+    return render(request, 'admin/shop/product/restock.html', {
+        **modeladmin.admin_site.each_context(request),
+        'title': 'Restock products',
+        'opts': modeladmin.model._meta,
+        'form': form,
+        'products': queryset,
+        'action_checkbox_name': ACTION_CHECKBOX_NAME,
+    })
 
 
 @admin.register(Category)
 class CategoryAdmin(admin.ModelAdmin):
-    list_display = ('name', 'parent', 'slug')
+    list_display = ('name', 'parent_path', 'slug')
     ordering = ('name',)
 
     def get_prepopulated_fields(self, request, obj=None):
@@ -13,15 +46,32 @@ class CategoryAdmin(admin.ModelAdmin):
             'slug': ('name',),
         }
 
+    @admin.display(description='Parent', ordering='path')
+    def parent_path(self, obj):
+        # Rendering the parent itself would query its ancestors for every row,
+        # so the path is read from the cached category tree instead.
+        return ' > '.join(get_category_names(obj.ancestor_ids)) or None
+
 
 @admin.register(Product)
 class ProductAdmin(admin.ModelAdmin):
     list_display = ('title', 'brand',  'price', "discount",
-                    'available', 'created_at', 'updated_at')
-    list_filter = ('available', 'created_at', 'updated_at')
+                    'available', 'stock', 'created_at', 'updated_at')
+    list_filter = ('available', 'created_at')
+    search_fields = ('title',)
     ordering = ('title',)
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    actions = [restock_products]
 
     def get_prepopulated_fields(self, request, obj=None):
         return {
             'slug': ('title',),
         }
+
+    def get_readonly_fields(self, request, obj=None):
+        # The stock of existing products only changes through restock_products,
+        # which also starts tracking it.
+        if obj:
+            return ['stock']
+        return super().get_readonly_fields(request, obj)
@@ -0,0 +1,240 @@
+import json
+import statistics
+import time
+import tracemalloc
+from io import StringIO
+from types import SimpleNamespace
+from typing import Callable, NamedTuple
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from .models import Category, Product
+
+User = get_user_model()
+
+BENCHMARK_USERNAME = 'benchmark'
+BENCHMARK_PASSWORD = 'benchmark-password'
+
+
+class Scenario(NamedTuple):
+    """
+    A storefront request to benchmark through the test client, so that the
+    middleware, context processors and templates are measured too.
+
+    Attributes:
+        name (str): The name used in reports and budgets.
+        budget (int): The maximum number of SQL queries of a warm request.
+        request (Callable): Issues the request, given the client and fixture.
+        login (bool): Whether the client is logged in.
+        prepare (Callable): Restores the state the request changes, untimed.
+    """
+    name: str
+    budget: int
+    request: Callable
+    login: bool = False
+    prepare: Callable = None
+
+
+def _post_cart(path):
+    def request(client, fixture):
+        return client.post(reverse(path), {
+            'action': 'post', 'product_id': fixture.product.pk, 'product_qty': 2})
+    return request
+
+
+def _cart_batch(op):
+    def request(client, fixture):
+        return client.post(reverse('cart:batch-cart'), {'operations': [
+            {'op': op, 'product_id': product.pk, 'qty': 2} for product in fixture.cart_products
+        ]}, content_type='application/json')
+    return request
+
+
+def _complete_order(client, fixture):
+    # The payment provider is stubbed, only our side of the checkout is measured.
+    session = SimpleNamespace(id='cs_test', url='https://checkout.invalid/session')
+    with mock.patch('stripe.checkout.Session.create', return_value=session):
+        return client.post(reverse('payment:complete-order'), {
+            'stripe-payment': 'stripe-payment', 'full_name': 'Benchmark',
+            'email': 'benchmark@example.com', 'street_address': 'Street',
+            'apartment_address': '1', 'country': 'RU', 'zip': '101000'})
+
+
+SCENARIOS = [
+    Scenario('shop-products', 3,
+             lambda client, fixture: client.get(reverse('shop:products'))),
+    Scenario('shop-products-scroll', 1,
+             lambda client, fixture: client.get(reverse('shop:products'), HTTP_HX_REQUEST='true')),
+    Scenario('shop-products-facets', 3,
+             lambda client, fixture: client.get(reverse('shop:products'), {
+                 'brand': fixture.product.brand, 'price': ['0-50', '50-100']})),
+    Scenario('shop-product-detail', 3,
+             lambda client, fixture: client.get(fixture.product.get_absolute_url())),
+    Scenario('shop-category-list', 3,
+             lambda client, fixture: client.get(fixture.category.get_absolute_url())),
+    Scenario('shop-search', 3,
+             lambda client, fixture: client.get(reverse('shop:search-products'), {'q': fixture.query})),
+    Scenario('cart-view', 2,
+             lambda client, fixture: client.get(reverse('cart:cart-view'))),
+    Scenario('cart-add', 5, _post_cart('cart:add-to-cart')),
+    Scenario('cart-update', 4, _post_cart('cart:update-to-cart')),
+    Scenario('cart-delete', 4, _post_cart('cart:delete-to-cart'),
+             prepare=_post_cart('cart:add-to-cart')),
+    Scenario('cart-batch', 5, _cart_batch('add'), prepare=_cart_batch('delete')),
+    # Reserving the stock of the cart takes an UPDATE and an INSERT.
+    Scenario('complete-order', 11, _complete_order, login=True),
+    Scenario('api-products', 2,
+             lambda client, fixture: client.get('/api/v1/products/')),
+    Scenario('api-products-facets', 2,
+             lambda client, fixture: client.get('/api/v1/products/', {
+                 'brand': fixture.product.brand, 'ordering': '-rating_avg'})),
+    Scenario('api-product-detail', 4,
+             lambda client, fixture: client.get(
+                 f'/api/v1/products/{fixture.product.pk}/',
+                 HTTP_AUTHORIZATION=f'Bearer {fixture.access_token}')),
+]
+
+
+def seed_dataset(count=0, seed=0):
+    """
+    Generates a catalog with fakeproducts if count is given and makes sure
+    the benchmark user exists.
+
+    Args:
+        count (int): The number of products to generate, 0 to reuse the data.
+        seed (int): The random seed of the generated data.
+
+    Returns:
+        SimpleNamespace: The product, cart content, category, user, search
+        query and API token the scenarios request.
+    """
+    from payment.models import ShippingAddress
+    from rest_framework_simplejwt.tokens import RefreshToken
+
+    if count:
+        call_command('fakeproducts', count=count, seed=seed, stdout=StringIO())
+    products = list(Product.objects.filter(available=True).select_related('category')
+                    .order_by('-rating_count', 'pk')[:3])
+    if not products:
+        raise ValueError('The database has no available products, pass a count to generate them.')
+
+    user = User.objects.filter(username=BENCHMARK_USERNAME).first()
+    if user is None:
+        user = User.objects.create_user(BENCHMARK_USERNAME, 'benchmark@example.com', BENCHMARK_PASSWORD)
+    ShippingAddress.objects.get_or_create(user=user, defaults={
+        'full_name': 'Benchmark', 'email': 'benchmark@example.com',
+        'street_address': 'Street', 'apartment_address': '1'})
+
+    product = products[0]
+    return SimpleNamespace(
+        product=product,
+        cart_products=products,
+        category=Category.objects.get(pk=product.category.ancestor_ids[0])
+        if product.category.ancestor_ids else product.category,
+        user=user,
+        query=product.title.split()[0],
+        access_token=str(RefreshToken.for_user(user).access_token),
+    )
+
+
+def _percentile(values, percent):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, round(percent / 100 * (len(ordered) - 1)))]
+
+
+def run_scenario(scenario, fixture, repeat=10):
+    """
+    Benchmarks a scenario: one warm-up request, then repeat timed requests
+    and a last one traced for allocations, which would skew the timings.
+
+    Returns:
+        dict: The measurements of the scenario.
+    """
+    client = Client()
+    if scenario.login:
+        client.force_login(fixture.user)
+    # Several cart lines make per-line queries show up in the cart and checkout.
+    for product in fixture.cart_products:
+        client.post(reverse('cart:add-to-cart'), {
+            'action': 'post', 'product_id': product.pk, 'product_qty': 1})
+
+    def prepare():
+        if scenario.prepare:
+            scenario.prepare(client, fixture)
+
+    prepare()
+    scenario.request(client, fixture)
+    timings, queries, status = [], 0, None
+    for _ in range(repeat):
+        prepare()
+        with CaptureQueriesContext(connection) as captured:
+            started = time.perf_counter()
+            response = scenario.request(client, fixture)
+            timings.append((time.perf_counter() - started) * 1000)
+        queries = max(queries, len(captured))
+        status = response.status_code
+
+    prepare()
+    tracemalloc.start()
+    try:
+        before = tracemalloc.take_snapshot()
+        scenario.request(client, fixture)
+        after = tracemalloc.take_snapshot()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    allocated = sum(stat.size_diff for stat in after.compare_to(before, 'filename') if stat.size_diff > 0)
+
+    return {
+        'name': scenario.name,
+        'status': status,
+        'queries': queries,
+        'budget': scenario.budget,
+        'over_budget': queries > scenario.budget,
+        'median_ms': round(statistics.median(timings), 3),
+        'p95_ms': round(_percentile(timings, 95), 3),
+        'allocated_kb': round(allocated / 1024, 1),
+        'peak_kb': round(peak / 1024, 1),
+    }
+
+
+def run_benchmarks(fixture, repeat=10, names=None):
+    """
+    Runs the scenarios, all of them or those named.
+
+    Returns:
+        list: The measurements of every scenario.
+    """
+    return [run_scenario(scenario, fixture, repeat) for scenario in SCENARIOS
+            if not names or scenario.name in names]
+
+
+def compare_results(results, baseline):
+    """
+    Returns the changes of queries and median time against a previous run.
+
+    Args:
+        results (list): The measurements of this run.
+        baseline (list): The measurements of the run to compare with.
+
+    Returns:
+        dict: The query and median time deltas by scenario name.
+    """
+    previous = {result['name']: result for result in baseline}
+    return {
+        result['name']: {
+            'queries': result['queries'] - previous[result['name']]['queries'],
+            'median_ms': round(result['median_ms'] - previous[result['name']]['median_ms'], 3),
+        }
+        for result in results if result['name'] in previous
+    }
+
+
+def dump_results(results, stream):
+    json.dump({'created': time.time(), 'results': results}, stream, indent=2)
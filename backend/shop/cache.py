@@ -0,0 +1,67 @@
+import time
+
+from django.core.cache import cache
+
+CATEGORY_TREE_VERSION_KEY = 'shop:category-tree:version'
+CATALOG_VERSION_KEY = 'shop:catalog:version'
+CARDS_VERSION_KEY = 'shop:cards:version'
+
+
+def product_version_key(product_id):
+    return f'shop:product:{product_id}:version'
+
+
+def get_version(key):
+    """
+    Returns the current value of a cache version counter.
+
+    The counter is seeded with a timestamp rather than 1, so a flushed cache
+    never hands out a version number that was already used before the flush.
+
+    Args:
+        key (str): The cache key of the counter.
+
+    Returns:
+        int: The current version.
+    """
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, time.time_ns(), timeout=None)
+        version = cache.get(key)
+    return version
+
+
+def bump_version(key):
+    """
+    Increments a cache version counter, invalidating every entry keyed on it.
+
+    Args:
+        key (str): The cache key of the counter.
+
+    Returns:
+        int: The new version.
+    """
+    try:
+        return cache.incr(key)
+    except ValueError:
+        get_version(key)
+        return cache.incr(key)
+
+
+def get_versions(keys):
+    """
+    Returns the current values of several version counters in one round trip,
+    seeding the missing ones.
+
+    Args:
+        keys (list): The cache keys of the counters.
+
+    Returns:
+        dict: The versions by key.
+    """
+    versions = cache.get_many(keys)
+    missing = {key: time.time_ns() for key in keys if key not in versions}
+    if missing:
+        cache.set_many(missing, timeout=None)
+        versions.update(missing)
+    return versions
@@ -1,16 +1,19 @@
-from .models import Category
+from django.utils.functional import SimpleLazyObject
 
+from .navigation import get_category_tree
 
 
 def categories(request):
     """
-    Retrieves all the categories that have no parent category.
+    Provides the category tree for the navbar.
+
+    The tree is resolved lazily, so templates that never render the navbar
+    don't even consult the cache.
 
     Args:
         request: The HTTP request object.
 
     Returns:
-        A dictionary containing the categories that have no parent category.
+        A dictionary containing the root nodes of the category tree.
     """
-    categories = Category.objects.filter(parent=None)
-    return {'categories': categories}
\ No newline at end of file
+    return {'categories': SimpleLazyObject(get_category_tree)}
@@ -0,0 +1,262 @@
+from collections import Counter
+from typing import NamedTuple
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Case, CharField, Count, F, Q, Sum, Value, When
+
+from .cache import CATALOG_VERSION_KEY, get_version
+from .fragments import invalidate_catalog
+from .models import FacetCount, Product
+
+FACETS_TIMEOUT = 60 * 60
+FACET_FIELDS = ('category_id', 'brand', 'price', 'discount', 'available')
+FACET_LABELS = {
+    FacetCount.BRAND: 'Brand',
+    FacetCount.PRICE: 'Price',
+    FacetCount.DISCOUNT: 'Discount',
+}
+
+
+class FacetOption(NamedTuple):
+    value: str
+    label: str
+    count: int
+    selected: bool
+
+
+class Facet(NamedTuple):
+    name: str
+    label: str
+    options: list
+
+
+def price_range_key(low, high):
+    return f'{low}-{"" if high is None else high}'
+
+
+def get_price_ranges():
+    """
+    Returns the configured price ranges keyed by their URL value, e.g. "50-100".
+    """
+    return {price_range_key(low, high): (low, high) for low, high in settings.SHOP_PRICE_RANGES}
+
+
+def get_price_range(price):
+    for key, (low, high) in get_price_ranges().items():
+        if price >= low and (high is None or price < high):
+            return key
+    return None
+
+
+def product_facets(values):
+    """
+    Returns the facet counters a product contributes to.
+
+    Args:
+        values (dict): The category_id, brand, price, discount and available
+            values of the product.
+
+    Returns:
+        list: (category_id, facet, value) tuples, empty for unavailable products.
+    """
+    if not values['available']:
+        return []
+    category_id = values['category_id']
+    facets = []
+    if values['brand']:
+        facets.append((category_id, FacetCount.BRAND, values['brand']))
+    price_range = get_price_range(values['price'])
+    if price_range:
+        facets.append((category_id, FacetCount.PRICE, price_range))
+    if values['discount']:
+        facets.append((category_id, FacetCount.DISCOUNT, '1'))
+    return facets
+
+
+def apply_facet_deltas(deltas):
+    """
+    Adds the given deltas to the facet counters, creating missing rows.
+
+    Args:
+        deltas (dict): The count deltas by (category_id, facet, value).
+    """
+    with transaction.atomic():
+        FacetCount.objects.bulk_create([
+            FacetCount(category_id=category_id, facet=facet, value=value)
+            for (category_id, facet, value), delta in deltas.items() if delta > 0
+        ], ignore_conflicts=True)
+        for (category_id, facet, value), delta in deltas.items():
+            FacetCount.objects.filter(
+                category_id=category_id, facet=facet, value=value,
+            ).update(count=F('count') + delta)
+
+
+def update_product_facets(product, deleted=False):
+    """
+    Moves a saved or deleted product between facet counters.
+
+    The previous values are those loaded by shop.signals before the write;
+    saves that change none of the faceted fields touch no counter.
+    """
+    loaded = product._loaded_values or {}
+    old = product_facets(loaded) if all(name in loaded for name in FACET_FIELDS) else []
+    new = [] if deleted else product_facets({name: getattr(product, name) for name in FACET_FIELDS})
+
+    deltas = Counter(new)
+    deltas.subtract(old)
+    deltas = {key: delta for key, delta in deltas.items() if delta}
+    if deltas:
+        apply_facet_deltas(deltas)
+    product.remember_values(*FACET_FIELDS)
+
+
+def count_facets():
+    """
+    Counts the facets of every available product with one GROUP BY per facet.
+
+    Returns:
+        Counter: The counts by (category_id, facet, value).
+    """
+    products = Product.objects.filter(available=True).order_by()
+    counts = Counter()
+    for category_id, brand, count in products.exclude(brand='').values_list(
+            'category_id', 'brand').annotate(Count('id')):
+        counts[(category_id, FacetCount.BRAND, brand)] = count
+
+    price_range = Case(*[
+        When(Q(price__gte=low) & (Q() if high is None else Q(price__lt=high)), then=Value(key))
+        for key, (low, high) in get_price_ranges().items()
+    ], output_field=CharField())
+    for category_id, key, count in products.annotate(price_range=price_range).values_list(
+            'category_id', 'price_range').annotate(Count('id')):
+        if key:
+            counts[(category_id, FacetCount.PRICE, key)] = count
+
+    for category_id, count in products.filter(discount__gt=0).values_list(
+            'category_id').annotate(Count('id')):
+        counts[(category_id, FacetCount.DISCOUNT, '1')] = count
+    return counts
+
+
+def rebuild_facets():
+    """
+    Recomputes the whole facet index, e.g. after bulk imports or updates
+    that bypassed the signals.
+
+    Returns:
+        int: The number of facet counters.
+    """
+    counts = count_facets()
+    with transaction.atomic():
+        FacetCount.objects.all().delete()
+        FacetCount.objects.bulk_create([
+            FacetCount(category_id=category_id, facet=facet, value=value, count=count)
+            for (category_id, facet, value), count in counts.items()
+        ], batch_size=1000)
+    invalidate_catalog()
+    return len(counts)
+
+
+def get_facet_counts(category=None):
+    """
+    Returns the facet counts of a category subtree or of the whole catalog.
+
+    They are summed from the facet index, whose size depends on the number
+    of categories and facet values rather than products, and cached until
+    the catalog changes.
+
+    Args:
+        category (Category): The category, or None for the whole catalog.
+
+    Returns:
+        dict: The counts by (facet, value).
+    """
+    key = f'shop:facets:{get_version(CATALOG_VERSION_KEY)}:{category.pk if category else "all"}'
+    counts = cache.get(key)
+    if counts is None:
+        rows = FacetCount.objects.filter(count__gt=0)
+        if category is not None:
+            rows = rows.filter(category__path__startswith=category.path)
+        counts = {
+            (facet, value): total
+            for facet, value, total in rows.values_list('facet', 'value')
+            .annotate(total=Sum('count')).order_by()
+        }
+        cache.set(key, counts, FACETS_TIMEOUT)
+    return counts
+
+
+def get_facets(params, category=None):
+    """
+    Returns the facets to display with their counts and selection.
+
+    The counts are those of the category, not narrowed by the other selected
+    facets, which is what lets them come from the precomputed index.
+
+    Args:
+        params (QueryDict): The request parameters.
+        category (Category): The category, or None for the whole catalog.
+
+    Returns:
+        list: The brand, price and discount facets.
+    """
+    counts = get_facet_counts(category)
+    brands = set(params.getlist('brand'))
+    prices = set(params.getlist('price'))
+
+    brand_counts = sorted(
+        ((value, count) for (facet, value), count in counts.items() if facet == FacetCount.BRAND),
+        key=lambda item: (-item[1], item[0]))
+    brand_options = [
+        FacetOption(value, value, count, value in brands)
+        for index, (value, count) in enumerate(brand_counts)
+        if index < settings.SHOP_FACET_BRAND_LIMIT or value in brands
+    ]
+    price_options = [
+        FacetOption(key, f'{low} – {high}' if high is not None else f'{low}+',
+                    counts.get((FacetCount.PRICE, key), 0), key in prices)
+        for key, (low, high) in get_price_ranges().items()
+    ]
+    discount_options = [
+        FacetOption('1', 'On discount', counts.get((FacetCount.DISCOUNT, '1'), 0),
+                    bool(params.get('discount'))),
+    ]
+    return [
+        Facet(FacetCount.BRAND, FACET_LABELS[FacetCount.BRAND], brand_options),
+        Facet(FacetCount.PRICE, FACET_LABELS[FacetCount.PRICE], price_options),
+        Facet(FacetCount.DISCOUNT, FACET_LABELS[FacetCount.DISCOUNT], discount_options),
+    ]
+
+
+def filter_products(queryset, params):
+    """
+    Narrows a product queryset by the selected facets.
+
+    Values of one facet are ORed and facets are ANDed. Unknown price ranges
+    are ignored.
+
+    Args:
+        queryset (QuerySet): The products.
+        params (QueryDict): The request parameters.
+
+    Returns:
+        QuerySet: The filtered products.
+    """
+    brands = [brand for brand in params.getlist('brand') if brand]
+    if brands:
+        queryset = queryset.filter(brand__in=brands)
+
+    price_ranges = get_price_ranges()
+    prices = Q()
+    for key in params.getlist('price'):
+        if key in price_ranges:
+            low, high = price_ranges[key]
+            prices |= Q(price__gte=low) & (Q() if high is None else Q(price__lt=high))
+    if prices:
+        queryset = queryset.filter(prices)
+
+    if params.get('discount'):
+        queryset = queryset.filter(discount__gt=0)
+    return queryset
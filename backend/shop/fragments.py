@@ -0,0 +1,119 @@
+import hashlib
+import threading
+from collections import Counter
+
+from django.core.cache import cache
+from django.template.loader import render_to_string
+from django.utils.safestring import mark_safe
+
+from .cache import (CARDS_VERSION_KEY, CATALOG_VERSION_KEY, bump_version,
+                    get_version, get_versions, product_version_key)
+
+FRAGMENT_TIMEOUT = 60 * 60 * 24
+CARD_TEMPLATE = 'shop/components/product_card.html'
+
+_stats = Counter()
+_stats_lock = threading.Lock()
+
+
+def _count(hits, misses):
+    with _stats_lock:
+        _stats['hits'] += hits
+        _stats['misses'] += misses
+
+
+def fragment_cache_stats():
+    """
+    Returns the hit and miss counters of this process.
+
+    Returns:
+        dict: The number of hits and misses and the hit ratio.
+    """
+    with _stats_lock:
+        hits, misses = _stats['hits'], _stats['misses']
+    total = hits + misses
+    return {'hits': hits, 'misses': misses, 'ratio': hits / total if total else 0.0}
+
+
+def render_product_cards(products):
+    """
+    Renders the cards of the given products, reusing cached fragments.
+
+    A card is keyed by the version of its product, so saving a product
+    invalidates its card only, and by the cards version, so changes made
+    without saving products, e.g. bulk updates followed by rebuild_facets,
+    reach the cards too. The catalog version is left out: every save bumps
+    it to refresh the listings, which would drop every card each time. The whole page costs at most three cache round
+    trips: versions, fragments and storing the misses.
+
+    Args:
+        products (iterable): The products to render.
+
+    Returns:
+        list: The rendered cards, in the order of the products.
+    """
+    products = list(products)
+    if not products:
+        return []
+    versions = get_versions([CARDS_VERSION_KEY] + [product_version_key(product.pk) for product in products])
+    cards_version = versions[CARDS_VERSION_KEY]
+    keys = [
+        f'shop:card:{product.pk}:{cards_version}:{versions[product_version_key(product.pk)]}'
+        for product in products
+    ]
+    cached = cache.get_many(keys)
+
+    cards, missed = [], {}
+    for product, key in zip(products, keys):
+        card = cached.get(key)
+        if card is None:
+            card = missed[key] = render_to_string(CARD_TEMPLATE, {'product': product})
+        cards.append(mark_safe(card))
+    if missed:
+        cache.set_many(missed, FRAGMENT_TIMEOUT)
+    _count(len(cached), len(missed))
+    return cards
+
+
+def listing_cache_key(request):
+    """
+    Returns the key of a rendered listing fragment for the current catalog
+    version and the full request URL, cursor and filters included.
+    """
+    digest = hashlib.md5(request.get_full_path().encode()).hexdigest()
+    return f'shop:listing:{get_version(CATALOG_VERSION_KEY)}:{digest}'
+
+
+def get_listing(key):
+    listing = cache.get(key)
+    _count(listing is not None, listing is None)
+    return listing
+
+
+def set_listing(key, content):
+    cache.set(key, content, FRAGMENT_TIMEOUT)
+
+
+def invalidate_product(product_id):
+    """
+    Invalidates the card of a product and every cached listing.
+    """
+    invalidate_products([product_id])
+
+
+def invalidate_products(product_ids):
+    """
+    Invalidates the cards of several products and, once, every cached listing.
+    """
+    for product_id in product_ids:
+        bump_version(product_version_key(product_id))
+    bump_version(CATALOG_VERSION_KEY)
+
+
+def invalidate_catalog():
+    """
+    Invalidates every card and every cached listing, after bulk changes that
+    bypassed the signals.
+    """
+    bump_version(CARDS_VERSION_KEY)
+    bump_version(CATALOG_VERSION_KEY)
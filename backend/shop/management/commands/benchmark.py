@@ -0,0 +1,50 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from shop.benchmarks import (compare_results, dump_results, run_benchmarks,
+                             seed_dataset)
+
+
+class Command(BaseCommand):
+    help = 'Benchmarks the storefront hot paths and checks their SQL query budgets'
+
+    def add_arguments(self, parser):
+        parser.add_argument('scenarios', nargs='*', help='Scenarios to run, all by default')
+        parser.add_argument('--count', type=int, default=0,
+                            help='Generate this many products first, 0 to use the current data')
+        parser.add_argument('--seed', type=int, default=0, help='Random seed of the generated data')
+        parser.add_argument('--repeat', type=int, default=10, help='Timed requests per scenario')
+        parser.add_argument('--output', help='Write the results as JSON to this file')
+        parser.add_argument('--compare', help='JSON results of a previous run to compare with')
+
+    def handle(self, *args, **options):
+        try:
+            fixture = seed_dataset(options['count'], options['seed'])
+        except ValueError as e:
+            raise CommandError(e)
+        results = run_benchmarks(fixture, options['repeat'], options['scenarios'])
+
+        deltas = {}
+        if options['compare']:
+            with open(options['compare']) as baseline:
+                deltas = compare_results(results, json.load(baseline)['results'])
+
+        self.stdout.write(f'{"scenario":<24}{"status":>7}{"queries":>9}{"budget":>8}'
+                          f'{"median ms":>11}{"p95 ms":>9}{"alloc KB":>10}{"peak KB":>9}')
+        for result in results:
+            line = (f'{result["name"]:<24}{result["status"]:>7}{result["queries"]:>9}{result["budget"]:>8}'
+                    f'{result["median_ms"]:>11.1f}{result["p95_ms"]:>9.1f}'
+                    f'{result["allocated_kb"]:>10.1f}{result["peak_kb"]:>9.1f}')
+            if result['name'] in deltas:
+                delta = deltas[result['name']]
+                line += f'  ({delta["queries"]:+d} queries, {delta["median_ms"]:+.1f} ms)'
+            self.stdout.write(self.style.ERROR(line) if result['over_budget'] else line)
+
+        if options['output']:
+            with open(options['output'], 'w') as output:
+                dump_results(results, output)
+
+        over_budget = [result['name'] for result in results if result['over_budget']]
+        if over_budget:
+            raise CommandError(f'Over the query budget: {", ".join(over_budget)}')
@@ -1,33 +1,306 @@
+import random
+import time
+from contextlib import contextmanager
+from datetime import timedelta
+from decimal import Decimal
+from itertools import accumulate
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
 from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Max
+from django.utils import timezone
+from django.utils.text import slugify
 from faker import Faker
 
+from payment.models import Order, OrderItem, ShippingAddress
+from payment.rollups import rebuild_sales_rollups
+from recommend.models import Review
+from recommend.ratings import recompute_ratings
+from shop.facets import rebuild_facets
+from shop.fragments import invalidate_catalog
 from shop.models import Category, Product
+from shop.navigation import invalidate_category_tree
+from shop.search import get_search_backend
+
+User = get_user_model()
+
+HISTORY_DAYS = 730
+RATING_WEIGHTS = [(1, 8), (2, 6), (3, 14), (4, 30), (5, 42)]
+
 
-fake = Faker()
+@contextmanager
+def explicit_timestamps(model, *names):
+    """
+    Lets bulk_create keep the given values of auto_now and auto_now_add
+    fields, so the generated rows can be spread over the past.
+    """
+    fields = [model._meta.get_field(name) for name in names]
+    flags = [(field.auto_now, field.auto_now_add) for field in fields]
+    for field in fields:
+        field.auto_now = field.auto_now_add = False
+    try:
+        yield
+    finally:
+        for field, (auto_now, auto_now_add) in zip(fields, flags):
+            field.auto_now, field.auto_now_add = auto_now, auto_now_add
+
+
+def zipf_weights(size, exponent):
+    """
+    Returns cumulative weights following Zipf's law, so that a few items are
+    picked far more often than the long tail, like best sellers are.
+    """
+    return list(accumulate(1 / (rank + 1) ** exponent for rank in range(size)))
 
 
 class Command(BaseCommand):
+    help = ('Generates a synthetic catalog with a category tree, users, reviews '
+            'and historical orders for load testing')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--count', type=int, default=30, help='Number of products')
+        parser.add_argument('--seed', type=int, default=None, help='Random seed for reproducible data')
+        parser.add_argument('--categories', type=int, default=None,
+                            help='Number of categories (default: one per 200 products)')
+        parser.add_argument('--depth', type=int, default=3, help='Depth of the category tree')
+        parser.add_argument('--brands', type=int, default=None,
+                            help='Number of brands (default: one per 50 products)')
+        parser.add_argument('--users', type=int, default=None, help='Number of users (default: count / 10)')
+        parser.add_argument('--reviews', type=int, default=None, help='Number of reviews (default: count)')
+        parser.add_argument('--orders', type=int, default=None, help='Number of orders (default: count / 2)')
+        parser.add_argument('--batch-size', type=int, default=5000, help='Rows per INSERT')
+        parser.add_argument('--skew', type=float, default=1.1,
+                            help='Zipf exponent of brand, product and customer popularity')
 
     def handle(self, *args, **options):
-        fake = Faker()
-        # Create 100 fake products
-        for _ in range(30):
-            product_title = fake.company()
-            product_brand = fake.company()
-            product_description = fake.paragraph(nb_sentences=2)
-            product_price = fake.pydecimal(
-                left_digits=3, right_digits=2, min_value=1, max_value=999.99)
-            product = Product(
-                category=Category.objects.first(),
-                title=product_title,
-                brand=product_brand,
-                description=product_description,
-                slug=fake.slug(),
-                price=product_price,
-                available=True,
-                created_at=fake.date_time(),
-                updated_at=fake.date_time(),
-                discount=fake.pyint(min_value=0, max_value=20),
-            )
-            product.save()
-        self.stdout.write(f'Products in DB: {Product.objects.count()}')
+        self.rng = random.Random(options['seed'])
+        self.fake = Faker()
+        self.fake.seed_instance(options['seed'])
+        self.batch_size = options['batch_size']
+        self.skew = options['skew']
+        self.now = timezone.now()
+
+        count = options['count']
+        categories = options['categories'] or max(count // 200, 5)
+        brands = options['brands'] or max(count // 50, 5)
+        users = options['users'] if options['users'] is not None else max(count // 10, 1)
+        reviews = options['reviews'] if options['reviews'] is not None else count
+        orders = options['orders'] if options['orders'] is not None else count // 2
+
+        started = time.perf_counter()
+        leaves = self.create_categories(categories, options['depth'])
+        products = self.create_products(count, leaves, brands)
+        user_ids = self.create_users(users)
+        if user_ids:
+            self.create_reviews(reviews, products, user_ids)
+            self.create_orders(orders, products, user_ids)
+        self.rebuild_indexes()
+        self.stdout.write(f'Done in {time.perf_counter() - started:.1f}s, '
+                          f'products in DB: {Product.objects.count()}')
+
+    def report(self, label, rows, started):
+        elapsed = time.perf_counter() - started
+        rate = rows / elapsed if elapsed else 0
+        self.stdout.write(f'{label}: {rows} rows in {elapsed:.1f}s ({rate:,.0f} rows/s)')
+
+    def bulk_create(self, model, objects):
+        """
+        Inserts the objects in batches, one transaction per batch.
+
+        Returns:
+            list: The created objects, with their primary keys.
+        """
+        created = []
+        for start in range(0, len(objects), self.batch_size):
+            with transaction.atomic():
+                created += model.objects.bulk_create(objects[start:start + self.batch_size])
+        return created
+
+    def past_datetime(self):
+        # Recent dates are likelier, as in a growing shop.
+        return self.now - timedelta(seconds=HISTORY_DAYS * 86400 * self.rng.random() ** 2)
+
+    def create_categories(self, count, depth):
+        """
+        Creates a tree of about the given size and depth, four children per
+        category, with materialized paths.
+
+        Returns:
+            list: The leaf categories.
+        """
+        started = time.perf_counter()
+        run = self.rng.getrandbits(32)
+        size = max(count // sum(4 ** level for level in range(depth)), 1)
+        parents, created, leaves = [None], 0, []
+        for level in range(depth):
+            if level:
+                size = min(len(parents) * 4, count - created)
+            if size <= 0:
+                break
+            categories = []
+            for index in range(size):
+                name = self.fake.word().capitalize()
+                categories.append(Category(
+                    name=name, parent=parents[index % len(parents)], depth=level,
+                    slug=slugify(f'{name}-{run:x}-{created + index}')))
+            categories = self.bulk_create(Category, categories)
+            for category in categories:
+                category.path = f'{category.parent.path if category.parent else ""}{category.pk}/'
+            Category.objects.bulk_update(categories, ['path'], batch_size=self.batch_size)
+
+            with_children = {category.parent_id for category in categories}
+            leaves += [parent for parent in parents
+                       if parent is not None and parent.pk not in with_children]
+            parents, created = categories, created + size
+        leaves += parents
+        self.report('Categories', created, started)
+        return leaves
+
+    def create_products(self, count, categories, brand_count):
+        """
+        Creates the products, spread over the leaf categories with popular
+        brands and categories holding most of them.
+
+        Returns:
+            list: The (id, price) of the created products, most popular first.
+        """
+        started = time.perf_counter()
+        offset = (Product.objects.aggregate(last=Max('id'))['last'] or 0) + 1
+        brands = list(dict.fromkeys(self.fake.company() for _ in range(brand_count)))
+        brand_weights = zipf_weights(len(brands), self.skew)
+        category_weights = zipf_weights(len(categories), self.skew / 2)
+        titles = [self.fake.catch_phrase() for _ in range(min(count, 5000))]
+        sentences = [self.fake.sentence() for _ in range(1000)]
+
+        products = []
+        with explicit_timestamps(Product, 'created_at', 'updated_at'):
+            for start in range(0, count, self.batch_size):
+                size = min(self.batch_size, count - start)
+                batch_brands = self.rng.choices(brands, cum_weights=brand_weights, k=size)
+                batch_categories = self.rng.choices(categories, cum_weights=category_weights, k=size)
+                batch = []
+                for index in range(size):
+                    title = self.rng.choice(titles)
+                    created_at = self.past_datetime()
+                    batch.append(Product(
+                        category=batch_categories[index],
+                        title=title,
+                        brand=batch_brands[index],
+                        description=' '.join(self.rng.sample(sentences, 2)),
+                        slug=f'{slugify(title)}-{offset + start + index}',
+                        price=Decimal(f'{min(max(self.rng.lognormvariate(4, 1), 1), 99999.99):.2f}'),
+                        available=self.rng.random() < 0.95,
+                        created_at=created_at,
+                        updated_at=created_at,
+                        discount=self.rng.choice([0, 0, 0, 5, 10, 15, 20]),
+                        stock=self.rng.randint(0, 200) if self.rng.random() < 0.9 else None,
+                    ))
+                products += [(product.pk, product.get_discounted_price())
+                             for product in self.bulk_create(Product, batch)]
+        self.rng.shuffle(products)
+        self.report('Products', count, started)
+        return products
+
+    def create_users(self, count):
+        started = time.perf_counter()
+        run = self.rng.getrandbits(32)
+        password = make_password('password')
+        users = self.bulk_create(User, [
+            User(username=f'user-{run:x}-{index}', email=f'user-{run:x}-{index}@example.com',
+                 password=password, date_joined=self.past_datetime())
+            for index in range(count)
+        ])
+        self.report('Users', count, started)
+        user_ids = [user.pk for user in users]
+        self.rng.shuffle(user_ids)
+        return user_ids
+
+    def create_reviews(self, count, products, user_ids):
+        started = time.perf_counter()
+        product_weights = zipf_weights(len(products), self.skew)
+        ratings, rating_weights = zip(*RATING_WEIGHTS)
+        contents = [self.fake.sentence() for _ in range(500)]
+        with explicit_timestamps(Review, 'created_at'):
+            for start in range(0, count, self.batch_size):
+                size = min(self.batch_size, count - start)
+                batch_products = self.rng.choices(products, cum_weights=product_weights, k=size)
+                batch_ratings = self.rng.choices(ratings, weights=rating_weights, k=size)
+                self.bulk_create(Review, [
+                    Review(product_id=batch_products[index][0],
+                           created_by_id=self.rng.choice(user_ids),
+                           rating=batch_ratings[index],
+                           content=self.rng.choice(contents),
+                           created_at=self.past_datetime())
+                    for index in range(size)
+                ])
+        self.report('Reviews', count, started)
+
+    def create_orders(self, count, products, user_ids):
+        """
+        Creates paid and unpaid orders of one to five lines, placed mostly by
+        returning customers and for best sellers.
+        """
+        started = time.perf_counter()
+        addresses = {
+            address.user_id: address.pk
+            for address in self.bulk_create(ShippingAddress, [
+                ShippingAddress(user_id=user_id, full_name=self.fake.name(),
+                                email=f'customer{user_id}@example.com',
+                                street_address=self.fake.street_address(),
+                                apartment_address=str(self.rng.randint(1, 300)),
+                                country=self.fake.country_code(), zip=self.fake.postcode(),
+                                city=self.fake.city())
+                for user_id in user_ids
+            ])
+        }
+        product_weights = zipf_weights(len(products), self.skew)
+        customer_weights = zipf_weights(len(user_ids), self.skew / 2)
+
+        items = 0
+        with explicit_timestamps(Order, 'created', 'updated'):
+            for start in range(0, count, self.batch_size):
+                size = min(self.batch_size, count - start)
+                customers = self.rng.choices(user_ids, cum_weights=customer_weights, k=size)
+                orders, lines = [], []
+                for user_id in customers:
+                    order_lines = [
+                        (product_id, price, self.rng.choice([1, 1, 1, 2, 3]))
+                        for product_id, price in self.rng.choices(
+                            products, cum_weights=product_weights, k=self.rng.randint(1, 5))
+                    ]
+                    created = self.past_datetime()
+                    amount = sum(price * quantity for _, price, quantity in order_lines)
+                    orders.append(Order(
+                        user_id=user_id, shipping_address_id=addresses[user_id],
+                        amount=amount, subtotal=amount, total=amount,
+                        created=created, updated=created, paid=self.rng.random() < 0.9))
+                    lines.append(order_lines)
+
+                orders = self.bulk_create(Order, orders)
+                order_items = [
+                    OrderItem(order_id=order.pk, product_id=product_id, price=price,
+                              quantity=quantity, user_id=order.user_id)
+                    for order, order_lines in zip(orders, lines)
+                    for product_id, price, quantity in order_lines
+                ]
+                self.bulk_create(OrderItem, order_items)
+                items += len(order_items)
+        self.report('Orders', count, started)
+        self.report('Order items', items, started)
+
+    def rebuild_indexes(self):
+        """
+        Brings the denormalized data up to date, since bulk_create skips the
+        signals that maintain it.
+        """
+        started = time.perf_counter()
+        get_search_backend().rebuild()
+        recompute_ratings()
+        rebuild_facets()
+        rebuild_sales_rollups()
+        invalidate_category_tree()
+        invalidate_catalog()
+        self.stdout.write(f'Search index, ratings, facets and sales rollups rebuilt in '
+                          f'{time.perf_counter() - started:.1f}s')
@@ -0,0 +1,58 @@
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import django
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from shop.fragments import invalidate_products
+from shop.models import Product
+from shop.thumbnails import generate_thumbnails
+
+
+def _init_worker():
+    django.setup()
+
+
+def _generate(image_name):
+    try:
+        return image_name, generate_thumbnails(image_name), None
+    except Exception as e:
+        return image_name, 0, str(e)
+
+
+class Command(BaseCommand):
+    help = 'Generates the missing thumbnails of every product image in a process pool'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=os.cpu_count(),
+                            help='Number of worker processes')
+
+    def handle(self, *args, **options):
+        image_names = list(
+            Product.objects.exclude(image='').order_by()
+            .values_list('image', flat=True).distinct())
+        # Forked workers must not share the parent's database connections.
+        connections.close_all()
+
+        started = time.perf_counter()
+        generated, failed, changed = 0, 0, []
+        with ProcessPoolExecutor(max_workers=options['workers'], initializer=_init_worker) as pool:
+            for image_name, count, error in pool.map(_generate, image_names, chunksize=16):
+                if error:
+                    failed += 1
+                    self.stderr.write(f'{image_name}: {error}')
+                elif count:
+                    generated += count
+                    changed.append(image_name)
+
+        for start in range(0, len(changed), 500):
+            invalidate_products(
+                Product.objects.filter(image__in=changed[start:start + 500])
+                .values_list('pk', flat=True))
+
+        elapsed = time.perf_counter() - started
+        self.stdout.write(
+            f'{generated} thumbnails generated for {len(image_names)} images '
+            f'in {elapsed:.1f}s ({failed} failed)')
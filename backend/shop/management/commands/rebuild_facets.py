@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+
+from shop.facets import rebuild_facets
+
+
+class Command(BaseCommand):
+    help = 'Recomputes the facet counts of the catalog'
+
+    def handle(self, *args, **options):
+        self.stdout.write(f'{rebuild_facets()} facet counters rebuilt')
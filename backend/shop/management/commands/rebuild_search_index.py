@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from shop.search import get_search_backend
+
+
+class Command(BaseCommand):
+    help = 'Re-indexes every product with the configured search backend'
+
+    def handle(self, *args, **options):
+        get_search_backend().rebuild()
+        self.stdout.write('Search index rebuilt')
@@ -0,0 +1,44 @@
+# Generated by Django 4.2.4 on 2026-10-18 05:50
+
+from django.db import migrations, models
+
+
+def populate_paths(apps, schema_editor):
+    Category = apps.get_model('shop', 'Category')
+    children_of = {}
+    for category in Category.objects.only('id', 'parent_id'):
+        children_of.setdefault(category.parent_id, []).append(category)
+
+    updated = []
+    level = [(category, '', 0) for category in children_of.get(None, [])]
+    while level:
+        next_level = []
+        for category, parent_path, depth in level:
+            category.path = f'{parent_path}{category.pk}/'
+            category.depth = depth
+            updated.append(category)
+            next_level.extend(
+                (child, category.path, depth + 1) for child in children_of.get(category.pk, []))
+        level = next_level
+    Category.objects.bulk_update(updated, ['path', 'depth'], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0005_alter_product_image'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='category',
+            name='depth',
+            field=models.PositiveSmallIntegerField(default=0, editable=False, verbose_name='Уровень'),
+        ),
+        migrations.AddField(
+            model_name='category',
+            name='path',
+            field=models.CharField(db_index=True, default='', editable=False, max_length=255, verbose_name='Путь'),
+        ),
+        migrations.RunPython(populate_paths, migrations.RunPython.noop),
+    ]
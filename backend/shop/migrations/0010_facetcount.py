@@ -0,0 +1,76 @@
+# Generated by Django 4.2.4 on 2026-10-18 06:01
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Case, Count, Q, Value, When
+import django.db.models.deletion
+
+
+def populate_facet_counts(apps, schema_editor):
+    FacetCount = apps.get_model('shop', 'FacetCount')
+    Product = apps.get_model('shop', 'Product')
+    products = Product.objects.filter(available=True).order_by()
+    price_range = Case(*[
+        When(Q(price__gte=low) & (Q() if high is None else Q(price__lt=high)),
+             then=Value(f'{low}-{"" if high is None else high}'))
+        for low, high in settings.SHOP_PRICE_RANGES
+    ], output_field=models.CharField())
+
+    rows = [
+        FacetCount(category_id=category_id, facet='brand', value=brand, count=count)
+        for category_id, brand, count in products.exclude(brand='').values_list(
+            'category_id', 'brand').annotate(Count('id'))
+    ]
+    rows += [
+        FacetCount(category_id=category_id, facet='price', value=key, count=count)
+        for category_id, key, count in products.annotate(price_range=price_range).values_list(
+            'category_id', 'price_range').annotate(Count('id'))
+        if key
+    ]
+    rows += [
+        FacetCount(category_id=category_id, facet='discount', value='1', count=count)
+        for category_id, count in products.filter(discount__gt=0).values_list(
+            'category_id').annotate(Count('id'))
+    ]
+    FacetCount.objects.bulk_create(rows, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0009_product_rating'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FacetCount',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('facet', models.CharField(choices=[('brand', 'Бренд'), ('price', 'Цена'), ('discount', 'Скидка')], max_length=20, verbose_name='Фасет')),
+                ('value', models.CharField(max_length=250, verbose_name='Значение')),
+                ('count', models.IntegerField(default=0, verbose_name='Количество')),
+            ],
+            options={
+                'verbose_name': 'Счётчик фасета',
+                'verbose_name_plural': 'Счётчики фасетов',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['brand'], name='shop_product_brand_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['price'], name='shop_product_price_idx'),
+        ),
+        migrations.AddField(
+            model_name='facetcount',
+            name='category',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='facet_counts', to='shop.category'),
+        ),
+        migrations.AddConstraint(
+            model_name='facetcount',
+            constraint=models.UniqueConstraint(fields=('category', 'facet', 'value'), name='shop_facetcount_unique'),
+        ),
+        migrations.RunPython(populate_facet_counts, migrations.RunPython.noop),
+    ]
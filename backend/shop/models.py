@@ -1,8 +1,13 @@
 import random
 import string
 
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVectorField
 from django.core.validators import MaxValueValidator, MinValueValidator
-from django.db import models
+from django.core.exceptions import ValidationError
+from django.db import models, transaction
+from django.db.models import DEFERRED, F, Value
+from django.db.models.functions import Concat, Substr
 from django.urls import reverse
 from django.utils.text import slugify
 
@@ -16,6 +21,8 @@ class Category(models.Model):
         parent (Category): The parent category.
         slug (str): The URL slug of the category.
         created_at (datetime): The date and time of creation.
+        path (str): The materialized path of ids from the root, e.g. "1/5/12/".
+        depth (int): The nesting level, 0 for root categories.
 
     """
     name = models.CharField("Категория", max_length=250, db_index=True)
@@ -24,6 +31,8 @@ class Category(models.Model):
     slug = models.SlugField('URL', max_length=250,
                             unique=True, null=False, editable=True)
     created_at = models.DateTimeField('Дата создания', auto_now_add=True)
+    path = models.CharField('Путь', max_length=255, db_index=True, editable=False, default='')
+    depth = models.PositiveSmallIntegerField('Уровень', default=0, editable=False)
 
     class Meta:
         unique_together = (['slug', 'parent'])
@@ -34,13 +43,41 @@ class Category(models.Model):
         """
         Returns a string representation of the object.
         """
-        full_path = [self.name]
-        k = self.parent
-        while k is not None:
-            full_path.append(k.name)
-            k = k.parent
-        return ' > '.join(full_path[::-1])
-    
+        full_path = list(self.get_ancestors().values_list('name', flat=True))
+        full_path.append(self.name)
+        return ' > '.join(full_path)
+
+    @property
+    def ancestor_ids(self):
+        """
+        Returns the ids of the ancestors from the root down, parsed from the path.
+        """
+        return [int(pk) for pk in self.path.split('/')[:-2]]
+
+    def get_ancestors(self):
+        """
+        Returns the ancestors ordered from the root down in a single query.
+        """
+        ancestor_ids = self.ancestor_ids
+        if not ancestor_ids:
+            return Category.objects.none()
+        return Category.objects.filter(pk__in=ancestor_ids).order_by('depth')
+
+    def get_descendants(self, include_self=True):
+        """
+        Returns the subtree of the category as a single indexed prefix lookup.
+        """
+        descendants = Category.objects.filter(path__startswith=self.path)
+        if not include_self:
+            descendants = descendants.exclude(pk=self.pk)
+        return descendants
+
+    def clean(self):
+        if self.path and self.parent_id:
+            parent_path = Category.objects.values_list('path', flat=True).get(pk=self.parent_id)
+            if parent_path.startswith(self.path):
+                raise ValidationError({'parent': 'Категория не может быть вложена сама в себя.'})
+
     @staticmethod
     def _rand_slug():
         """
@@ -59,7 +96,36 @@ class Category(models.Model):
 
         if not self.slug:
             self.slug = slugify(self._rand_slug() + '-pickBetter' + self.name)
-        super(Category, self).save(*args, **kwargs)
+
+        with transaction.atomic():
+            super(Category, self).save(*args, **kwargs)
+            self._update_path()
+
+    def _update_path(self):
+        """
+        Keeps the materialized path of the category and its subtree in sync.
+
+        A move rewrites the paths of the whole subtree with a single UPDATE.
+        """
+        old_path, old_depth = self.path, self.depth
+        if self.parent_id:
+            parent_path, parent_depth = Category.objects.values_list(
+                'path', 'depth').get(pk=self.parent_id)
+            if old_path and parent_path.startswith(old_path):
+                raise ValueError('A category cannot be moved into its own subtree.')
+            self.path, self.depth = f'{parent_path}{self.pk}/', parent_depth + 1
+        else:
+            self.path, self.depth = f'{self.pk}/', 0
+
+        if self.path == old_path:
+            return
+        if not old_path:
+            Category.objects.filter(pk=self.pk).update(path=self.path, depth=self.depth)
+            return
+        Category.objects.filter(path__startswith=old_path).update(
+            path=Concat(Value(self.path), Substr('path', len(old_path) + 1)),
+            depth=F('depth') + (self.depth - old_depth),
+        )
 
     def get_absolute_url(self):
         return reverse("shop:category-list", args=[str(self.slug)])
@@ -69,6 +135,15 @@ class Product(models.Model):
     """
     A model representing a product.
 
+    rating_avg, rating_count and rating_sum are denormalized from the product's
+    reviews and maintained incrementally by recommend.signals, with UPDATEs
+    that saving a product leaves alone, see save.
+
+    stock is the quantity left to sell, or None for products whose stock is
+    not tracked. Checkouts and restocks change it with UPDATEs relative to
+    the stored value, see payment.inventory, so saving a product only writes
+    it when it is new or listed in update_fields.
+
     """
     category = models.ForeignKey(
         Category, on_delete=models.CASCADE, related_name='products')
@@ -85,15 +160,73 @@ class Product(models.Model):
     updated_at = models.DateTimeField('Дата изменения', auto_now=True)
     discount = models.IntegerField(
         default=0, validators=[MinValueValidator(0), MaxValueValidator(100)])
+    stock = models.PositiveIntegerField("Остаток", null=True, blank=True)
+    search_vector = SearchVectorField(null=True, editable=False)
+    rating_avg = models.DecimalField(
+        "Рейтинг", max_digits=3, decimal_places=2, default=0, editable=False)
+    rating_count = models.PositiveIntegerField("Количество отзывов", default=0, editable=False)
+    rating_sum = models.PositiveIntegerField(default=0, editable=False)
     
     class Meta:
         verbose_name = 'Продукт'
         verbose_name_plural = 'Продукты'
-        ordering = ['-created_at']
+        ordering = ['-created_at', '-id']
+        indexes = [
+            models.Index(fields=['-created_at', '-id'], name='shop_product_created_id_idx'),
+            models.Index(fields=['-rating_avg', '-rating_count'], name='shop_product_rating_idx'),
+            models.Index(fields=['brand'], name='shop_product_brand_idx'),
+            models.Index(fields=['price'], name='shop_product_price_idx'),
+            GinIndex(fields=['search_vector'], name='shop_product_search_gin'),
+            GinIndex(fields=['title'], opclasses=['gin_trgm_ops'], name='shop_product_title_trgm'),
+        ]
+
+    # Updated in SQL while instances are held, see save.
+    STOCK_FIELDS = ('stock',)
+    RATING_FIELDS = ('rating_avg', 'rating_count', 'rating_sum')
+
+    _loaded_values = None
 
     def __str__(self):
         return self.title
 
+    def save(self, *args, **kwargs):
+        # The stored stock and ratings may have changed since this instance
+        # was loaded, so they are left out of the write unless asked for.
+        if not self._state.adding and kwargs.get('update_fields') is None:
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name not in self.STOCK_FIELDS + self.RATING_FIELDS
+            ]
+        super().save(*args, **kwargs)
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        """
+        Remembers the loaded field values, so the signals can tell what a
+        save has changed, e.g. to regenerate thumbnails only for a new image.
+        """
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_values = {
+            name: value for name, value in zip(field_names, values) if value is not DEFERRED}
+        return instance
+
+    def get_loaded_value(self, name, default=None):
+        """
+        Returns the value the field had when the product was loaded or last
+        saved, or default for a new product or a deferred field.
+        """
+        return (self._loaded_values or {}).get(name, default)
+
+    def remember_values(self, *names):
+        """
+        Records the current values of the given fields as the loaded ones.
+        """
+        if self._loaded_values is None:
+            self._loaded_values = {}
+        for name in names:
+            value = getattr(self, name)
+            self._loaded_values[name] = getattr(value, 'name', value)
+
     def get_absolute_url(self):
         return reverse("shop:product-detail", args=[str(self.slug)])
 
@@ -133,3 +266,40 @@ class ProductProxy(Product):
 
     class Meta:
         proxy = True
+
+
+class FacetCount(models.Model):
+    """
+    The number of available products of a category with a given facet value,
+    maintained incrementally by shop.signals and rebuilt by rebuild_facets.
+
+    Attributes:
+        category (Category): The category the products belong to directly.
+        facet (str): The facet, e.g. "brand".
+        value (str): The facet value, e.g. a brand or a price range key.
+        count (int): The number of products.
+
+    """
+    BRAND = 'brand'
+    PRICE = 'price'
+    DISCOUNT = 'discount'
+    FACET_CHOICES = [
+        (BRAND, 'Бренд'),
+        (PRICE, 'Цена'),
+        (DISCOUNT, 'Скидка'),
+    ]
+
+    category = models.ForeignKey(Category, on_delete=models.CASCADE, related_name='facet_counts')
+    facet = models.CharField('Фасет', max_length=20, choices=FACET_CHOICES)
+    value = models.CharField('Значение', max_length=250)
+    count = models.IntegerField('Количество', default=0)
+
+    class Meta:
+        verbose_name = 'Счётчик фасета'
+        verbose_name_plural = 'Счётчики фасетов'
+        constraints = [
+            models.UniqueConstraint(fields=['category', 'facet', 'value'], name='shop_facetcount_unique'),
+        ]
+
+    def __str__(self):
+        return f'{self.category_id} {self.facet}={self.value}: {self.count}'
@@ -0,0 +1,103 @@
+from typing import NamedTuple
+
+from django.core.cache import cache
+
+from .cache import CATEGORY_TREE_VERSION_KEY, bump_version, get_version
+from .models import Category
+
+
+class CategoryNode(NamedTuple):
+    """
+    An immutable node of the category tree used by the navbar.
+
+    Attributes:
+        id (int): The category id.
+        name (str): The category name.
+        slug (str): The URL slug of the category.
+        url (str): The precomputed absolute URL of the category.
+        children (tuple): The child nodes.
+    """
+    id: int
+    name: str
+    slug: str
+    url: str
+    children: tuple
+
+
+CATEGORY_TREE_TIMEOUT = 60 * 60 * 24
+
+_local_tree = (None, ())
+
+
+def build_category_tree():
+    """
+    Builds the full category tree from a single query.
+
+    Returns:
+        tuple: The root CategoryNode objects ordered by name.
+    """
+    children_of = {}
+    for category in Category.objects.order_by('name').only('id', 'name', 'slug', 'parent_id'):
+        children_of.setdefault(category.parent_id, []).append(category)
+
+    def build(parent_id):
+        return tuple(
+            CategoryNode(category.id, category.name, category.slug,
+                         category.get_absolute_url(), build(category.id))
+            for category in children_of.get(parent_id, ())
+        )
+
+    return build(None)
+
+
+def get_category_tree():
+    """
+    Returns the category tree, building it at most once per version.
+
+    The tree is memoized per process and shared between processes through the
+    cache, so a warm process renders the navbar without touching the database.
+
+    Returns:
+        tuple: The root CategoryNode objects.
+    """
+    global _local_tree
+
+    version = get_version(CATEGORY_TREE_VERSION_KEY)
+    local_version, tree = _local_tree
+    if local_version == version:
+        return tree
+
+    key = f'shop:category-tree:{version}'
+    tree = cache.get(key)
+    if tree is None:
+        tree = build_category_tree()
+        cache.set(key, tree, CATEGORY_TREE_TIMEOUT)
+    _local_tree = (version, tree)
+    return tree
+
+
+def get_category_names(category_ids):
+    """
+    Returns the names of a chain of categories from the cached tree.
+
+    Args:
+        category_ids (list): The ids of the categories from the root down, as
+            given by Category.ancestor_ids.
+
+    Returns:
+        list: The names of the categories, stopping at the first id missing
+        from the tree.
+    """
+    names = []
+    nodes = get_category_tree()
+    for category_id in category_ids:
+        node = next((node for node in nodes if node.id == category_id), None)
+        if node is None:
+            break
+        names.append(node.name)
+        nodes = node.children
+    return names
+
+
+def invalidate_category_tree():
+    bump_version(CATEGORY_TREE_VERSION_KEY)
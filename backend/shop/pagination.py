@@ -0,0 +1,119 @@
+import base64
+import binascii
+import json
+from datetime import datetime
+
+from django.core.paginator import Paginator
+from django.db import connections
+from django.db.models import Q, QuerySet
+from django.utils.functional import cached_property
+
+ESTIMATED_COUNT_THRESHOLD = 10000
+
+
+def encode_cursor(product):
+    """
+    Encodes the position of a product in the (-created_at, -id) ordering.
+
+    Args:
+        product (Product): The last product of a page.
+
+    Returns:
+        str: An opaque URL-safe continuation token.
+    """
+    payload = json.dumps([product.created_at.isoformat(), product.pk])
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+
+def decode_cursor(token):
+    """
+    Decodes a continuation token produced by encode_cursor.
+
+    Raises:
+        ValueError: If the token is malformed.
+
+    Returns:
+        tuple: The created_at and id of the last product of the previous page.
+    """
+    try:
+        payload = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+        created_at, pk = json.loads(payload)
+        return datetime.fromisoformat(created_at), int(pk)
+    except (binascii.Error, TypeError, UnicodeDecodeError, json.JSONDecodeError) as e:
+        raise ValueError(f'Invalid cursor: {token!r}') from e
+
+
+class KeysetPage:
+    """
+    A page of products fetched by seeking past the previous page.
+
+    Unlike Django's Paginator it never counts rows nor uses OFFSET, so every
+    page costs one indexed range scan of page_size + 1 rows no matter how
+    deep the visitor has scrolled.
+
+    Attributes:
+        object_list (list): The products of the page.
+        next_cursor (str): The token of the next page, or None on the last one.
+    """
+
+    def __init__(self, queryset, cursor, page_size):
+        if cursor:
+            created_at, pk = decode_cursor(cursor)
+            queryset = queryset.filter(
+                Q(created_at__lt=created_at) | Q(created_at=created_at, pk__lt=pk))
+        rows = list(queryset.order_by('-created_at', '-id')[:page_size + 1])
+        self.object_list = rows[:page_size]
+        self.next_cursor = encode_cursor(rows[page_size - 1]) if len(rows) > page_size else None
+
+    def has_next(self):
+        return self.next_cursor is not None
+
+
+def page_url(request, **params):
+    """
+    Returns the current URL with the given query parameters replaced,
+    keeping every other parameter such as the search query or filters.
+    """
+    query = request.GET.copy()
+    for name in ('page', 'cursor'):
+        query.pop(name, None)
+    for name, value in params.items():
+        query[name] = str(value)
+    return f'{request.path}?{query.urlencode()}'
+
+
+def estimated_count(model, using='default'):
+    """
+    Returns the number of rows of a model's table as estimated by the
+    PostgreSQL planner statistics, which costs nothing to read.
+
+    Returns:
+        int: The estimate, or None on other databases or before the table
+        was first analyzed.
+    """
+    connection = connections[using]
+    if connection.vendor != 'postgresql':
+        return None
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT reltuples FROM pg_class WHERE oid = %s::regclass', [model._meta.db_table])
+        row = cursor.fetchone()
+    return int(row[0]) if row and row[0] >= 0 else None
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    A Paginator that does not COUNT(*) a whole big table.
+
+    The unfiltered listing of a table estimated at ESTIMATED_COUNT_THRESHOLD
+    rows or more is counted from the planner statistics instead, so the last
+    page numbers are approximate. Filtered listings are counted exactly.
+    """
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        if isinstance(queryset, QuerySet) and not queryset.query.where:
+            estimate = estimated_count(queryset.model, queryset.db)
+            if estimate is not None and estimate >= ESTIMATED_COUNT_THRESHOLD:
+                return estimate
+        return super().count
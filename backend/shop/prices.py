@@ -0,0 +1,66 @@
+from decimal import Decimal
+
+from django.core.cache import cache
+
+from .cache import get_versions, product_version_key
+from .models import Product
+
+PRICE_TIMEOUT = 60 * 60
+UNAVAILABLE = -1
+
+
+def to_cents(price):
+    """
+    Converts a price to an integer number of cents.
+
+    Args:
+        price (Decimal | str): The price.
+
+    Returns:
+        int: The price in cents.
+    """
+    return int(Decimal(price).quantize(Decimal('0.01')) * 100)
+
+
+def from_cents(cents):
+    """
+    Converts an integer number of cents back to a two-place Decimal.
+    """
+    return Decimal(cents).scaleb(-2)
+
+
+def get_prices(product_ids):
+    """
+    Returns the current discounted prices of products from the price table.
+
+    The table is a cache entry per product keyed by the product's version,
+    which is bumped on every save, so a price or discount change is seen
+    at once. Looking up any number of products costs two cache round trips
+    and, for the products missing from the table, one query.
+
+    Args:
+        product_ids (iterable): The product ids.
+
+    Returns:
+        dict: The prices in cents by product id, for available products only.
+    """
+    product_ids = list(product_ids)
+    if not product_ids:
+        return {}
+    versions = get_versions([product_version_key(product_id) for product_id in product_ids])
+    keys = {
+        product_id: f'shop:price:{product_id}:{versions[product_version_key(product_id)]}'
+        for product_id in product_ids
+    }
+    cached = cache.get_many(keys.values())
+
+    prices = {product_id: cached[key] for product_id, key in keys.items() if key in cached}
+    missing = [product_id for product_id in product_ids if product_id not in prices]
+    if missing:
+        fresh = dict.fromkeys(missing, UNAVAILABLE)
+        for product in Product.objects.filter(pk__in=missing).only('id', 'price', 'discount', 'available'):
+            if product.available:
+                fresh[product.pk] = to_cents(product.get_discounted_price())
+        cache.set_many({keys[product_id]: cents for product_id, cents in fresh.items()}, PRICE_TIMEOUT)
+        prices.update(fresh)
+    return {product_id: cents for product_id, cents in prices.items() if cents != UNAVAILABLE}
@@ -0,0 +1,196 @@
+import difflib
+import re
+import threading
+from collections import defaultdict
+from functools import lru_cache
+
+from django.conf import settings
+from django.contrib.postgres.search import (SearchQuery, SearchRank,
+                                            SearchVector, TrigramSimilarity)
+from django.db.models import Case, F, OuterRef, Q, Subquery, Value, When
+from django.db.models.functions import Coalesce
+from django.utils.module_loading import import_string
+
+from .models import Category, Product, ProductProxy
+
+
+class BaseSearchBackend:
+    """
+    Interface of a product search backend.
+
+    A backend returns matching products as a queryset ordered by relevance
+    and is told about every product and category change, so it can keep its
+    index up to date.
+    """
+
+    def search(self, query):
+        """
+        Args:
+            query (str): The raw user query.
+
+        Returns:
+            QuerySet: Available products ordered by relevance.
+        """
+        raise NotImplementedError
+
+    def update(self, product):
+        """
+        Re-indexes a single product after it was saved.
+        """
+
+    def remove(self, product):
+        """
+        Drops a deleted product from the index.
+        """
+
+    def update_category(self, category):
+        """
+        Re-indexes the products of a category after it was renamed.
+        """
+
+    def rebuild(self):
+        """
+        Re-indexes the whole catalog.
+        """
+
+
+class PostgresSearchBackend(BaseSearchBackend):
+    """
+    Full-text search over a maintained tsvector column with a trigram fallback.
+
+    Titles, brands, category names and descriptions are weighted A, A, B and C.
+    Products that only match the title by trigram similarity are still found,
+    so a query with a typo doesn't come back empty.
+    """
+
+    def __init__(self, config=None):
+        self.config = config or settings.SHOP_SEARCH_CONFIG
+
+    def search_vector(self):
+        category_name = Subquery(
+            Category.objects.filter(pk=OuterRef('category_id')).values('name')[:1])
+        return (
+            SearchVector('title', weight='A', config=self.config)
+            + SearchVector('brand', weight='A', config=self.config)
+            + SearchVector(category_name, weight='B', config=self.config)
+            + SearchVector('description', weight='C', config=self.config)
+        )
+
+    def search(self, query):
+        search_query = SearchQuery(query, config=self.config, search_type='websearch')
+        rank = (
+            Coalesce(SearchRank(F('search_vector'), search_query), Value(0.0))
+            + TrigramSimilarity('title', query)
+        )
+        return (
+            ProductProxy.objects
+            .filter(Q(search_vector=search_query) | Q(title__trigram_similar=query))
+            .annotate(rank=rank)
+            .order_by('-rank', '-created_at')
+        )
+
+    def update(self, product):
+        Product.objects.filter(pk=product.pk).update(search_vector=self.search_vector())
+
+    def update_category(self, category):
+        Product.objects.filter(category=category).update(search_vector=self.search_vector())
+
+    def rebuild(self):
+        Product.objects.update(search_vector=self.search_vector())
+
+
+class InMemorySearchBackend(BaseSearchBackend):
+    """
+    A pure-Python inverted index, meant for tests and databases without
+    PostgreSQL full-text search.
+
+    Unknown query terms are replaced by their closest indexed terms, which
+    mimics the trigram fallback of the PostgreSQL backend.
+    """
+    WEIGHTS = {'title': 1.0, 'brand': 1.0, 'category': 0.4, 'description': 0.2}
+    TYPO_CUTOFF = 0.75
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._postings = defaultdict(dict)
+        self._documents = {}
+
+    @staticmethod
+    def tokenize(text):
+        return re.findall(r'\w+', (text or '').lower())
+
+    def _document(self, product, category_name):
+        weights = defaultdict(float)
+        fields = {
+            'title': product.title,
+            'brand': product.brand,
+            'category': category_name,
+            'description': product.description,
+        }
+        for field, text in fields.items():
+            for token in self.tokenize(text):
+                weights[token] += self.WEIGHTS[field]
+        return weights
+
+    def _index(self, product_id, document):
+        self._unindex(product_id)
+        self._documents[product_id] = document
+        for token, weight in document.items():
+            self._postings[token][product_id] = weight
+
+    def _unindex(self, product_id):
+        for token in self._documents.pop(product_id, ()):
+            postings = self._postings[token]
+            postings.pop(product_id, None)
+            if not postings:
+                del self._postings[token]
+
+    def search(self, query):
+        scores = defaultdict(float)
+        with self._lock:
+            for token in self.tokenize(query):
+                terms = [token] if token in self._postings else difflib.get_close_matches(
+                    token, self._postings.keys(), n=3, cutoff=self.TYPO_CUTOFF)
+                for term in terms:
+                    for product_id, weight in self._postings[term].items():
+                        scores[product_id] += weight
+
+        if not scores:
+            return ProductProxy.objects.none()
+        ranked = sorted(scores, key=lambda product_id: (-scores[product_id], -product_id))
+        order = Case(*[When(pk=product_id, then=position)
+                       for position, product_id in enumerate(ranked)])
+        return ProductProxy.objects.filter(pk__in=ranked).order_by(order)
+
+    def update(self, product):
+        category_name = Category.objects.values_list('name', flat=True).get(pk=product.category_id)
+        with self._lock:
+            self._index(product.pk, self._document(product, category_name))
+
+    def remove(self, product):
+        with self._lock:
+            self._unindex(product.pk)
+
+    def update_category(self, category):
+        for product in Product.objects.filter(category=category):
+            with self._lock:
+                self._index(product.pk, self._document(product, category.name))
+
+    def rebuild(self):
+        with self._lock:
+            self._postings.clear()
+            self._documents.clear()
+            for product in Product.objects.select_related('category').iterator():
+                self._index(product.pk, self._document(product, product.category.name))
+
+
+@lru_cache(maxsize=None)
+def _load_backend(path):
+    return import_string(path)()
+
+
+def get_search_backend():
+    """
+    Returns the process-wide instance of the backend named by SHOP_SEARCH_BACKEND.
+    """
+    return _load_backend(settings.SHOP_SEARCH_BACKEND)
@@ -0,0 +1,71 @@
+from functools import partial
+
+from django.db import transaction
+from django.db.models.signals import (post_delete, post_save, pre_delete,
+                                      pre_save)
+from django.dispatch import receiver
+
+from .facets import FACET_FIELDS, update_product_facets
+from .fragments import invalidate_product
+from .models import Category, Product, ProductProxy
+from .navigation import invalidate_category_tree
+from .search import get_search_backend
+from .thumbnails import has_thumbnails, schedule_thumbnails
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def category_changed(sender, instance, **kwargs):
+    # Bumped once the change is visible, or a concurrent request could cache
+    # the old rows under the new version.
+    transaction.on_commit(invalidate_category_tree)
+
+
+@receiver(post_save, sender=Category)
+def reindex_category(sender, instance, created, **kwargs):
+    if not created:
+        get_search_backend().update_category(instance)
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_save, sender=ProductProxy)
+def product_saved(sender, instance, **kwargs):
+    get_search_backend().update(instance)
+    transaction.on_commit(partial(invalidate_product, instance.pk))
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_save, sender=ProductProxy)
+def product_image_saved(sender, instance, **kwargs):
+    image_name = instance.image.name
+    if image_name and image_name != instance.get_loaded_value('image'):
+        if not has_thumbnails(image_name):
+            schedule_thumbnails(image_name)
+    instance.remember_values('image')
+
+
+@receiver(pre_save, sender=Product)
+@receiver(pre_save, sender=ProductProxy)
+@receiver(pre_delete, sender=Product)
+@receiver(pre_delete, sender=ProductProxy)
+def load_product_facets(sender, instance, raw=False, **kwargs):
+    # The stored row, not a possibly stale instance, tells which counters to decrement.
+    if raw or instance._state.adding:
+        return
+    values = sender._base_manager.filter(pk=instance.pk).values(*FACET_FIELDS).first()
+    if values:
+        instance._loaded_values = {**(instance._loaded_values or {}), **values}
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_save, sender=ProductProxy)
+def product_facets_saved(sender, instance, **kwargs):
+    update_product_facets(instance)
+
+
+@receiver(post_delete, sender=Product)
+@receiver(post_delete, sender=ProductProxy)
+def product_deleted(sender, instance, **kwargs):
+    get_search_backend().remove(instance)
+    update_product_facets(instance, deleted=True)
+    transaction.on_commit(partial(invalidate_product, instance.pk))
@@ -0,0 +1,18 @@
+from celery import shared_task
+
+from .fragments import invalidate_products
+from .models import Product
+from .thumbnails import generate_thumbnails
+
+
+@shared_task()
+def generate_product_thumbnails(image_name):
+    """
+    Generates the thumbnails of a product image and refreshes the cached
+    cards of the products that show it.
+    """
+    generated = generate_thumbnails(image_name)
+    if generated:
+        invalidate_products(
+            Product.objects.filter(image=image_name).values_list('pk', flat=True))
+    return generated
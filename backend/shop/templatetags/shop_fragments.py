@@ -0,0 +1,16 @@
+from django import template
+
+from shop.fragments import render_product_cards
+
+register = template.Library()
+
+
+@register.simple_tag
+def product_cards(products):
+    """
+    Renders the cards of a page of products through the fragment cache.
+
+    Usage:
+        {% product_cards products as cards %}
+    """
+    return render_product_cards(products)
@@ -1,8 +1,24 @@
-from django.test import TestCase
+from io import StringIO
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection, models
+from django.test.utils import CaptureQueriesContext
+from django.test import TestCase, override_settings
 from django.core.files.uploadedfile import SimpleUploadedFile
 from django.urls import reverse
 
-from .models import Product, Category, ProductProxy
+from .models import FacetCount, Product, Category, ProductProxy
+from .benchmarks import run_benchmarks, seed_dataset
+from .facets import count_facets, get_facet_counts
+from .fragments import fragment_cache_stats, invalidate_catalog, render_product_cards
+from .navigation import get_category_tree
+from .pagination import ESTIMATED_COUNT_THRESHOLD, EstimatedCountPaginator
+from .search import get_search_backend
+from .templatetags.shop_thumbnails import thumbnail_url
+from .thumbnails import generate_thumbnails
 
 
 class ProductViewTest(TestCase):
@@ -82,4 +98,355 @@ class CategoryListViewTest(TestCase):
         response = self.client.get(
             reverse('shop:category-list', args=[self.category.slug]))
         self.assertEqual(response.context['category'], self.category)
-        self.assertEqual(response.context['products'].first(), self.product)
\ No newline at end of file
+        self.assertEqual(response.context['products'].first(), self.product)
+
+class CategoryTreeTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.root = Category.objects.create(name='Root', slug='root')
+        self.child = Category.objects.create(
+            name='Child', slug='child', parent=self.root)
+
+    def test_tree_is_built_once(self):
+        tree = get_category_tree()
+        self.assertEqual(tree[0].name, 'Root')
+        self.assertEqual(tree[0].children[0].url, self.child.get_absolute_url())
+        with self.assertNumQueries(0):
+            self.assertEqual(get_category_tree(), tree)
+
+    def test_tree_is_invalidated_on_save(self):
+        get_category_tree()
+        with self.captureOnCommitCallbacks(execute=True):
+            Category.objects.create(name='Leaf', slug='leaf', parent=self.child)
+        tree = get_category_tree()
+        self.assertEqual(tree[0].children[0].children[0].slug, 'leaf')
+
+
+class CategoryPathTest(TestCase):
+    def setUp(self):
+        self.root = Category.objects.create(name='Root', slug='root')
+        self.child = Category.objects.create(
+            name='Child', slug='child', parent=self.root)
+        self.leaf = Category.objects.create(
+            name='Leaf', slug='leaf', parent=self.child)
+
+    def test_path(self):
+        self.assertEqual(self.leaf.path, f'{self.root.pk}/{self.child.pk}/{self.leaf.pk}/')
+        self.assertEqual(self.leaf.depth, 2)
+
+    def test_str_is_single_query(self):
+        with self.assertNumQueries(1):
+            self.assertEqual(str(self.leaf), 'Root > Child > Leaf')
+
+    def test_move_rewrites_subtree(self):
+        other = Category.objects.create(name='Other', slug='other')
+        self.child.parent = other
+        self.child.save()
+        self.leaf.refresh_from_db()
+        self.assertEqual(self.leaf.path, f'{other.pk}/{self.child.pk}/{self.leaf.pk}/')
+        self.assertQuerySetEqual(
+            other.get_descendants(), [other, self.child, self.leaf], ordered=False)
+
+    def test_category_list_includes_subcategories(self):
+        product = ProductProxy.objects.create(
+            title='Leaf Product', slug='leaf-product', category=self.leaf)
+        response = self.client.get(
+            reverse('shop:category-list', args=[self.root.slug]))
+        self.assertEqual(list(response.context['products']), [product])
+
+
+@override_settings(SHOP_SEARCH_BACKEND='shop.search.InMemorySearchBackend')
+class SearchProductsTest(TestCase):
+    def setUp(self):
+        self.phones = Category.objects.create(name='Phones', slug='phones')
+        self.galaxy = ProductProxy.objects.create(
+            title='Galaxy S23', brand='Samsung', slug='galaxy-s23', category=self.phones)
+        self.pixel = ProductProxy.objects.create(
+            title='Pixel 8', brand='Google', description='Samsung killer',
+            slug='pixel-8', category=self.phones)
+        get_search_backend().rebuild()
+
+    def search(self, query):
+        return self.client.get(reverse('shop:search-products'), {'q': query})
+
+    def test_ranks_title_and_brand_above_description(self):
+        response = self.search('samsung')
+        self.assertEqual(list(response.context['products']), [self.galaxy, self.pixel])
+
+    def test_typo_fallback(self):
+        response = self.search('samsnug')
+        self.assertIn(self.galaxy, response.context['products'])
+
+    def test_category_name(self):
+        response = self.search('phones')
+        self.assertEqual(response.context['page_obj'].paginator.count, 2)
+
+    def test_no_results_redirects(self):
+        response = self.search('zzzz')
+        self.assertRedirects(response, reverse('shop:products'))
+
+
+class ProductKeysetPaginationTest(TestCase):
+    def setUp(self):
+        category = Category.objects.create(name='Category', slug='category')
+        self.products = [
+            ProductProxy.objects.create(title=f'Product {i}', slug=f'product-{i}', category=category)
+            for i in range(20)
+        ]
+
+    def test_htmx_pages_are_seeked_without_count(self):
+        url = reverse('shop:products')
+        with CaptureQueriesContext(connection) as queries:
+            first = self.client.get(url, HTTP_HX_REQUEST='true')
+        self.assertFalse([q for q in queries if 'COUNT(' in q['sql']])
+        self.assertEqual(list(first.context['products']), self.products[::-1][:15])
+
+        second = self.client.get(first.context['next_url'], HTTP_HX_REQUEST='true')
+        self.assertEqual(list(second.context['products']), self.products[::-1][15:])
+        self.assertNotIn('next_url', second.context)
+
+    def test_full_page_links_to_cursor(self):
+        response = self.client.get(reverse('shop:products'))
+        self.assertIn('cursor=', response.context['next_url'])
+
+    def test_invalid_cursor(self):
+        response = self.client.get(reverse('shop:products'), {'cursor': 'garbage'})
+        self.assertEqual(response.status_code, 404)
+
+
+class FragmentCacheTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        category = Category.objects.create(name='Category', slug='category')
+        self.product = ProductProxy.objects.create(
+            title='Cached Product', slug='cached-product', category=category)
+
+    def test_card_is_cached_until_product_is_saved(self):
+        render_product_cards([self.product])
+        hits = fragment_cache_stats()['hits']
+        render_product_cards([self.product])
+        self.assertEqual(fragment_cache_stats()['hits'], hits + 1)
+
+        self.product.title = 'Renamed Product'
+        with self.captureOnCommitCallbacks() as callbacks:
+            self.product.save()
+        # Until the save commits, other requests still read the old row.
+        self.assertNotIn('Renamed Product', render_product_cards([self.product])[0])
+        for callback in callbacks:
+            callback()
+        self.assertIn('Renamed Product', render_product_cards([self.product])[0])
+
+        ProductProxy.objects.filter(pk=self.product.pk).update(title='Bulk Renamed')
+        self.product.refresh_from_db()
+        self.assertNotIn('Bulk Renamed', render_product_cards([self.product])[0])
+        invalidate_catalog()
+        self.assertIn('Bulk Renamed', render_product_cards([self.product])[0])
+
+    def test_saving_a_product_keeps_the_other_cards(self):
+        other = ProductProxy.objects.create(
+            title='Other Product', slug='other-product', category=self.product.category)
+        render_product_cards([self.product, other])
+        with self.captureOnCommitCallbacks(execute=True):
+            self.product.save()
+        hits = fragment_cache_stats()['hits']
+        render_product_cards([self.product, other])
+        self.assertEqual(fragment_cache_stats()['hits'], hits + 1)
+
+    def test_anonymous_scroll_fragment_is_cached(self):
+        url = reverse('shop:products')
+        first = self.client.get(url, HTTP_HX_REQUEST='true')
+        with CaptureQueriesContext(connection) as queries:
+            second = self.client.get(url, HTTP_HX_REQUEST='true')
+        self.assertFalse([q for q in queries if 'shop_product' in q['sql']])
+        self.assertEqual(first.content, second.content)
+        self.assertContains(second, 'Cached Product')
+
+
+class ThumbnailTest(TestCase):
+    small_gif = (
+        b'\x47\x49\x46\x38\x39\x61\x01\x00\x01\x00\x00\x00\x00\x21\xf9\x04'
+        b'\x01\x0a\x00\x01\x00\x2c\x00\x00\x00\x00\x01\x00\x01\x00\x00\x02'
+        b'\x02\x4c\x01\x00\x3b'
+    )
+
+    def setUp(self):
+        cache.clear()
+        self.category = Category.objects.create(name='Category', slug='category')
+
+    def create_product(self):
+        uploaded = SimpleUploadedFile('thumb.gif', self.small_gif, content_type='image/gif')
+        return Product.objects.create(
+            title='Product', slug='product', category=self.category, image=uploaded)
+
+    @mock.patch('shop.tasks.generate_product_thumbnails.delay')
+    def test_saving_image_schedules_generation(self, delay):
+        with self.captureOnCommitCallbacks(execute=True):
+            product = self.create_product()
+        delay.assert_called_once_with(product.image.name)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(thumbnail_url(product.image, '400x400'), product.image.url)
+        delay.assert_called_once()
+
+    @mock.patch('shop.tasks.generate_product_thumbnails.delay')
+    def test_generated_thumbnail_is_served(self, delay):
+        product = self.create_product()
+        self.assertEqual(generate_thumbnails(product.image.name), 1)
+        self.assertEqual(generate_thumbnails(product.image.name), 0)
+
+        url = thumbnail_url(product.image, '400x400')
+        self.assertNotEqual(url, product.image.url)
+        self.assertIn('/cache/', url)
+
+
+class FacetTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.category = Category.objects.create(name='Category', slug='category')
+        self.acme = Product.objects.create(
+            title='Acme', slug='acme', brand='Acme', price=20, category=self.category)
+        self.globex = Product.objects.create(
+            title='Globex', slug='globex', brand='Globex', price=120, discount=10,
+            category=self.category)
+        Product.objects.create(
+            title='Hidden', slug='hidden', brand='Acme', price=20, available=False,
+            category=self.category)
+
+    def assertIndexConsistent(self):
+        index = {
+            (row.category_id, row.facet, row.value): row.count
+            for row in FacetCount.objects.filter(count__gt=0)
+        }
+        self.assertEqual(index, dict(count_facets()))
+
+    def test_counts_are_maintained_incrementally(self):
+        self.assertEqual(get_facet_counts()[('brand', 'Acme')], 1)
+        self.assertEqual(get_facet_counts()[('price', '100-250')], 1)
+        self.assertIndexConsistent()
+
+        product = Product.objects.only('title').get(pk=self.acme.pk)
+        product.price = 200
+        with self.captureOnCommitCallbacks(execute=True):
+            product.save()
+        self.assertIndexConsistent()
+        self.assertEqual(get_facet_counts()[('price', '100-250')], 2)
+
+        self.globex.available = False
+        with self.captureOnCommitCallbacks(execute=True):
+            self.globex.save()
+        self.assertIndexConsistent()
+        self.assertNotIn(('discount', '1'), get_facet_counts())
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.acme.delete()
+        self.assertIndexConsistent()
+        self.assertEqual(get_facet_counts(), {})
+
+    def test_products_view_filters_by_facets(self):
+        url = reverse('shop:products')
+        response = self.client.get(url, {'brand': ['Acme', 'Globex']})
+        self.assertEqual(set(response.context['products']), {self.acme, self.globex})
+
+        response = self.client.get(url, {'price': '0-50'})
+        self.assertEqual(list(response.context['products']), [self.acme])
+
+        response = self.client.get(url, {'discount': '1'})
+        self.assertEqual(list(response.context['products']), [self.globex])
+        facets = {facet.name: facet for facet in response.context['facets']}
+        self.assertEqual([option.count for option in facets['discount'].options], [1])
+        self.assertTrue(facets['discount'].options[0].selected)
+
+    def test_api_returns_facets(self):
+        response = self.client.get('/api/v1/products/', {'brand': 'Acme'})
+        self.assertEqual([item['id'] for item in response.data['results']], [self.acme.pk])
+        self.assertEqual(response.data['facets']['brand']['Acme'], 1)
+
+        response = self.client.get('/api/v1/products/', {'brand': 'Globex'})
+        self.assertEqual([item['id'] for item in response.data['results']], [self.globex.pk])
+        self.assertEqual(response.data['facets']['brand'], {'Acme': 1, 'Globex': 1})
+
+
+class FakeProductsCommandTest(TestCase):
+    def test_generates_consistent_catalog(self):
+        out = StringIO()
+        call_command('fakeproducts', count=60, users=5, reviews=30, orders=10, seed=1, stdout=out)
+
+        self.assertEqual(Product.objects.count(), 60)
+        self.assertIn('rows/s', out.getvalue())
+        for category in Category.objects.all():
+            parent_path = category.parent.path if category.parent else ''
+            self.assertEqual(category.path, f'{parent_path}{category.pk}/')
+        self.assertFalse(Product.objects.filter(category__children__isnull=False).exists())
+        self.assertEqual(FacetCount.objects.filter(facet='brand').aggregate(
+            total=models.Sum('count'))['total'], Product.objects.filter(available=True).count())
+
+
+@override_settings(SHOP_SEARCH_BACKEND='shop.search.InMemorySearchBackend')
+class QueryBudgetTest(TestCase):
+    def test_hot_paths_stay_within_query_budgets(self):
+        cache.clear()
+        fixture = seed_dataset(count=40, seed=1)
+        for result in run_benchmarks(fixture, repeat=1):
+            with self.subTest(result['name']):
+                self.assertLess(result['status'], 400)
+                self.assertLessEqual(result['queries'], result['budget'])
+
+
+class AdminPerformanceTest(TestCase):
+    def setUp(self):
+        self.category = Category.objects.create(name='Category', slug='category')
+        user = get_user_model().objects.create_superuser('admin', 'admin@example.com', 'password')
+        self.client.force_login(user)
+
+    def add_products(self, count):
+        start = Product.objects.count()
+        Product.objects.bulk_create([
+            Product(title=f'Product {i}', slug=f'product-{i}', category=self.category, price=10)
+            for i in range(start, start + count)
+        ])
+
+    def test_product_changelist_queries_do_not_grow(self):
+        url = reverse('admin:shop_product_changelist')
+        self.add_products(2)
+        self.client.get(url)
+        with CaptureQueriesContext(connection) as captured:
+            self.client.get(url)
+        self.assertLessEqual(len(captured), 5)
+        self.add_products(20)
+        with self.assertNumQueries(len(captured)):
+            self.client.get(url)
+
+    def test_category_changelist_queries_do_not_grow(self):
+        url = reverse('admin:shop_category_changelist')
+        parent = self.category
+
+        def add_categories(count):
+            nonlocal parent
+            for _ in range(count):
+                index = Category.objects.count()
+                parent = Category.objects.create(name=f'Category {index}', slug=f'category-{index}',
+                                                 parent=parent)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            add_categories(2)
+        self.client.get(url)
+        with CaptureQueriesContext(connection) as captured:
+            response = self.client.get(url)
+        queries = len(captured)
+        self.assertLessEqual(queries, 5)
+        self.assertContains(response, 'Category &gt; Category 1')
+        with self.captureOnCommitCallbacks(execute=True):
+            add_categories(5)
+        # The first request after the change rebuilds the category tree.
+        self.client.get(url)
+        with self.assertNumQueries(queries):
+            self.client.get(url)
+
+    def test_estimated_count(self):
+        self.add_products(3)
+        with mock.patch('shop.pagination.estimated_count', return_value=ESTIMATED_COUNT_THRESHOLD):
+            self.assertEqual(EstimatedCountPaginator(Product.objects.all(), 10).count,
+                             ESTIMATED_COUNT_THRESHOLD)
+            self.assertEqual(EstimatedCountPaginator(Product.objects.filter(price=10), 10).count, 3)
+        with mock.patch('shop.pagination.estimated_count', return_value=100):
+            self.assertEqual(EstimatedCountPaginator(Product.objects.all(), 10).count, 3)
@@ -0,0 +1,117 @@
+import logging
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from kombu.exceptions import OperationalError
+from sorl.thumbnail import default, get_thumbnail
+from sorl.thumbnail.base import ThumbnailBackend
+from sorl.thumbnail.conf import defaults as default_settings
+from sorl.thumbnail.conf import settings as thumbnail_settings
+from sorl.thumbnail.images import ImageFile
+
+logger = logging.getLogger(__name__)
+
+PENDING_TIMEOUT = 60 * 10
+
+
+class LookupThumbnailBackend(ThumbnailBackend):
+    """
+    A thumbnail backend that only looks thumbnails up and never creates them.
+
+    It computes the same file name as sorl's own backend, so it finds every
+    thumbnail that get_thumbnail or the {% thumbnail %} tag have generated.
+    """
+
+    def get_cached_thumbnail(self, file_, geometry_string, **options):
+        """
+        Returns the thumbnail from the key value store, or None if it has
+        not been generated yet.
+        """
+        source = ImageFile(file_)
+        if thumbnail_settings.THUMBNAIL_PRESERVE_FORMAT:
+            options.setdefault('format', self._get_format(source))
+        for key, value in self.default_options.items():
+            options.setdefault(key, value)
+        for key, attr in self.extra_options:
+            value = getattr(thumbnail_settings, attr)
+            if value != getattr(default_settings, attr):
+                options.setdefault(key, value)
+
+        name = self._get_thumbnail_filename(source, geometry_string, options)
+        return default.kvstore.get(ImageFile(name, default.storage))
+
+
+lookup_backend = LookupThumbnailBackend()
+
+
+def _pending_key(image_name):
+    return f'shop:thumbnails:pending:{image_name}'
+
+
+def get_cached_thumbnail(image, geometry_string):
+    """
+    Returns a generated thumbnail of the image without ever resizing.
+
+    Args:
+        image (FieldFile | str): The source image.
+        geometry_string (str): The size of the thumbnail, e.g. "400x400".
+
+    Returns:
+        ImageFile: The thumbnail, or None if it has not been generated yet.
+    """
+    return lookup_backend.get_cached_thumbnail(image, geometry_string)
+
+
+def has_thumbnails(image_name):
+    """
+    Checks whether every size of SHOP_THUMBNAIL_SIZES exists for the image.
+    """
+    return all(get_cached_thumbnail(image_name, size) is not None
+               for size in settings.SHOP_THUMBNAIL_SIZES)
+
+
+def generate_thumbnails(image_name):
+    """
+    Generates the missing thumbnails of every size in SHOP_THUMBNAIL_SIZES.
+
+    This is the only place that resizes images; it runs in Celery workers and
+    in the generate_thumbnails command, never in a web request.
+
+    Args:
+        image_name (str): The storage name of the source image.
+
+    Returns:
+        int: The number of thumbnails generated.
+    """
+    generated = 0
+    for size in settings.SHOP_THUMBNAIL_SIZES:
+        if get_cached_thumbnail(image_name, size) is None:
+            get_thumbnail(image_name, size)
+            generated += 1
+    cache.delete(_pending_key(image_name))
+    return generated
+
+
+def schedule_thumbnails(image_name):
+    """
+    Queues the generation of the thumbnails of an image once the current
+    transaction commits.
+
+    Requests for an image that is already queued are dropped, so a listing
+    rendered by many visitors before the worker catches up enqueues one task.
+    """
+    if not image_name or not cache.add(_pending_key(image_name), 1, PENDING_TIMEOUT):
+        return
+    transaction.on_commit(lambda: _enqueue(image_name))
+
+
+def _enqueue(image_name):
+    from .tasks import generate_product_thumbnails
+
+    # A page must render even when the broker is down; the pending key makes
+    # the next attempt wait for PENDING_TIMEOUT instead of every request.
+    try:
+        generate_product_thumbnails.delay(image_name)
+    except OperationalError:
+        logger.exception('Could not queue the thumbnails of %s', image_name)
@@ -1,18 +1,81 @@
+from django.conf import settings
 from django.contrib import messages
+from django.core.paginator import Paginator
+from django.http import Http404, HttpResponse
 from django.shortcuts import get_object_or_404, redirect, render
 from django.views.generic import ListView
 
+from .facets import filter_products, get_facets
+from .fragments import get_listing, listing_cache_key, set_listing
 from .models import Category, ProductProxy
+from .pagination import KeysetPage, encode_cursor, page_url
+from .search import get_search_backend
 
 
 # def products_view(request):
 #     products = ProductProxy.objects.all()
 #     return render(request, 'shop/products.html', {'products': products})
 class ProductListView(ListView):
+    """
+    The catalog, paginated by page number on a full page load and by an opaque
+    cursor for the HTMX infinite scroll, which skips COUNT and OFFSET entirely.
+
+    It is narrowed by the brand, price and discount facets of the query string.
+    """
     model = ProductProxy
     context_object_name = "products"
     paginate_by = 15
 
+    def get(self, request, *args, **kwargs):
+        """
+        Serves anonymous scroll fragments from the cache; they carry no
+        per-visitor data, so one rendering can be shared by everybody.
+        """
+        if not request.htmx or request.user.is_authenticated:
+            return super().get(request, *args, **kwargs)
+
+        key = listing_cache_key(request)
+        content = get_listing(key)
+        if content is not None:
+            return HttpResponse(content)
+
+        response = super().get(request, *args, **kwargs)
+
+        def store(response):
+            if response.status_code == 200:
+                set_listing(key, response.content)
+
+        response.add_post_render_callback(store)
+        return response
+
+    def get_queryset(self):
+        return filter_products(super().get_queryset(), self.request.GET)
+
+    def paginate_queryset(self, queryset, page_size):
+        cursor = self.request.GET.get('cursor')
+        if cursor is None and not self.request.htmx:
+            return super().paginate_queryset(queryset, page_size)
+        try:
+            page = KeysetPage(queryset, cursor, page_size)
+        except ValueError:
+            raise Http404('Invalid cursor')
+        return (None, page, page.object_list, page.has_next())
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        page = context['page_obj']
+        if isinstance(page, KeysetPage):
+            next_cursor = page.next_cursor
+        elif page.has_next():
+            next_cursor = encode_cursor(page.object_list[len(page.object_list) - 1])
+        else:
+            next_cursor = None
+        if next_cursor:
+            context['next_url'] = page_url(self.request, cursor=next_cursor)
+        if not self.request.htmx:
+            context['facets'] = get_facets(self.request.GET)
+        return context
+
     def get_template_names(self):
         if self.request.htmx:
             return "shop/components/product_list.html"
@@ -44,14 +107,25 @@ def products_detail_view(request, slug):
 
 def category_list(request, slug):
     category = get_object_or_404(Category, slug=slug)
-    products = ProductProxy.objects.select_related('category').filter(category=category)
-    context = {'category': category, 'products': products}
+    products = ProductProxy.objects.select_related('category').filter(
+        category__path__startswith=category.path)
+    context = {'category': category, 'ancestors': category.get_ancestors(), 'products': products}
     return render(request, 'shop/category_list.html', context)
 
 def search_products(request):
-    query = request.GET.get('q')
-    products = ProductProxy.objects.filter(title__icontains=query).distinct()
-    context = {'products': products}
-    if not query or not products:
+    query = request.GET.get('q', '').strip()
+    if not query:
         return redirect('shop:products')
+
+    products = get_search_backend().search(query)
+    page_obj = Paginator(products, settings.SHOP_SEARCH_PAGE_SIZE).get_page(
+        request.GET.get('page'))
+    if not page_obj.object_list:
+        return redirect('shop:products')
+
+    context = {'products': page_obj.object_list, 'page_obj': page_obj, 'query': query}
+    if page_obj.has_next():
+        context['next_url'] = page_url(request, page=page_obj.next_page_number())
+    if request.htmx:
+        return render(request, 'shop/components/product_list.html', context)
     return render(request, 'shop/products.html', context)
\ No newline at end of file